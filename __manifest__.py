@@ -1,7 +1,7 @@
 # whatsapp_business_api/__manifest__.py
 {
     "name": "WhatsApp b-2-b",
-    "version": "16.0.1.0.0",
+    "version": "16.0.1.4.0",
     "summary": "Intégration API WhatsApp b-2-b",
     "description": """
         Module complet pour intégrer l'API WhatsApp Business Cloud à Odoo :
@@ -20,6 +20,7 @@
     },
     "data": [
         "security/ir.model.access.csv",
+        "security/whatsapp_security.xml",
         "data/whatsapp_button_action_examples.xml",
         "data/whatsapp_template_examples.xml",
         "data/whatsapp_order_validation_actions.xml",
@@ -34,6 +35,7 @@
         "data/whatsapp_next_invoice_action.xml",
         "data/whatsapp_greeting_menu_action.xml",
         "data/whatsapp_greeting_menu_buttons_action.xml",
+        "data/whatsapp_keyword_trigger_data.xml",
         "views/whatsapp_config_views.xml",
         "views/whatsapp_send_message_views.xml",
         "views/whatsapp_send_partner_message_views.xml",
@@ -43,7 +45,9 @@
         "views/whatsapp_message_views.xml",
         "views/whatsapp_template_views.xml",
         "views/whatsapp_button_action_views.xml",
+        "views/whatsapp_keyword_trigger_views.xml",
         "views/whatsapp_interactive_scenario_views.xml",
+        "views/whatsapp_queue_views.xml",
         # "views/sale_order_whatsapp_views.xml",  # Décommenter après vérification que le module sale est installé
     ],
     "installable": True,
@@ -1,14 +1,28 @@
 # whatsapp_business_api/controllers/whatsapp_webhook.py
 from odoo import http
 from odoo.http import request, Response
+from odoo.service.model import PG_CONCURRENCY_ERRORS_TO_RETRY
+import psycopg2
 import logging
 import json
 import hmac
 import hashlib
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 _logger = logging.getLogger(__name__)
 
 
+def _json_loads(raw_data):
+    """Parse le corps du webhook directement depuis les bytes (orjson s'il est installé)"""
+    if orjson is not None:
+        return orjson.loads(raw_data)
+    return json.loads(raw_data)
+
+
 class WhatsappWebhookController(http.Controller):
 
     @http.route("/whatsapp/webhook", type="http", auth="public", methods=["GET", "POST"], csrf=False)
@@ -62,14 +76,14 @@ class WhatsappWebhookController(http.Controller):
             _logger.warning("Webhook verification échouée : mode invalide (%s)", mode)
             return Response("Error: invalid mode", status=403)
 
-        # Récupère la configuration active
-        config = request.env["whatsapp.config"].sudo().search([("is_active", "=", True)], limit=1)
-        if not config:
+        # Récupère les configurations actives (un même webhook peut servir plusieurs numéros)
+        configs = request.env["whatsapp.config"].sudo().search([("is_active", "=", True)])
+        if not configs:
             _logger.warning("Webhook verification échouée : aucune configuration active")
             return Response("Error: no active configuration", status=403)
 
-        # Vérifie que le token correspond
-        if verify_token != config.verify_token:
+        # Vérifie que le token correspond à l'une des configurations
+        if verify_token not in configs.mapped("verify_token"):
             _logger.warning("Webhook verification échouée : token invalide")
             return Response("Error: verification failed", status=403)
 
@@ -92,15 +106,15 @@ class WhatsappWebhookController(http.Controller):
                 return Response("EVENT_RECEIVED", status=200, mimetype="text/plain")
 
             # Valide la signature SHA256 (recommandé par Meta)
-            # if not self._verify_signature(raw_data):
-            #     _logger.warning("Webhook WhatsApp : signature invalide - requête rejetée")
-            #     # Retourne quand même 200 pour éviter les nouvelles tentatives
-            #     return Response("EVENT_RECEIVED", status=200, mimetype="text/plain")
+            if not self._verify_signature(raw_data):
+                _logger.warning("Webhook WhatsApp : signature invalide - requête rejetée")
+                # Retourne quand même 200 pour éviter les nouvelles tentatives
+                return Response("EVENT_RECEIVED", status=200, mimetype="text/plain")
 
             # Parse le JSON
             try:
-                data = json.loads(raw_data.decode("utf-8"))
-            except json.JSONDecodeError as e:
+                data = _json_loads(raw_data)
+            except (json.JSONDecodeError, UnicodeDecodeError) as e:
                 _logger.exception("Impossible de parser le JSON du webhook WhatsApp : %s", e)
                 return Response("EVENT_RECEIVED", status=200, mimetype="text/plain")
             except Exception as e:
@@ -125,8 +139,13 @@ class WhatsappWebhookController(http.Controller):
 
             # Traite le webhook
             try:
-                created_records = request.env["whatsapp.message"].sudo().create_from_webhook(data)
+                created_records = request.env["whatsapp.message"].sudo().create_from_webhook(data, raw_payload=raw_data)
                 _logger.info("Webhook traité avec succès : %d enregistrement(s) créé(s)", len(created_records))
+            except psycopg2.OperationalError as e:
+                # Conflit avec un autre worker : Odoo rejoue la requête dans une nouvelle transaction
+                if e.pgcode in PG_CONCURRENCY_ERRORS_TO_RETRY:
+                    raise
+                _logger.exception("Erreur lors du traitement du webhook WhatsApp : %s", e)
             except Exception as e:
                 _logger.exception("Erreur lors du traitement du webhook WhatsApp : %s", e)
                 # Retourne quand même 200 pour éviter que Meta renvoie le webhook
@@ -134,6 +153,11 @@ class WhatsappWebhookController(http.Controller):
             # Retourne toujours 200 OK dans les 5 secondes (requis par Meta)
             return Response("EVENT_RECEIVED", status=200, mimetype="text/plain")
 
+        except psycopg2.OperationalError as e:
+            if e.pgcode in PG_CONCURRENCY_ERRORS_TO_RETRY:
+                raise
+            _logger.exception("Erreur inattendue lors du traitement du webhook WhatsApp : %s", e)
+            return Response("EVENT_RECEIVED", status=200, mimetype="text/plain")
         except Exception as e:
             _logger.exception("Erreur inattendue lors du traitement du webhook WhatsApp : %s", e)
             # Retourne toujours 200 OK même en cas d'erreur inattendue
@@ -148,13 +172,19 @@ class WhatsappWebhookController(http.Controller):
         
         Note: Meta génère la signature avec la version Unicode échappée de la charge utile.
         """
+        # Récupère les App Secrets (mis en cache par registre, sans requête SQL)
+        app_secrets = request.env["whatsapp.config"].sudo()._get_webhook_app_secrets()
+        if not app_secrets:
+            _logger.warning("Configuration active ou App Secret manquant pour la validation de signature")
+            # Si pas de secret, on accepte quand même (mais on log un avertissement)
+            return True  # Changez en False si vous voulez rejeter sans secret
+
         # Récupère la signature depuis l'en-tête
         signature_header = request.httprequest.headers.get("X-Hub-Signature-256")
         if not signature_header:
+            # Un App Secret est configuré : une requête non signée ne vient pas de Meta
             _logger.warning("En-tête X-Hub-Signature-256 manquant dans la requête webhook")
-            # Si la signature n'est pas présente, on peut choisir de l'accepter ou non
-            # Pour la compatibilité, on accepte si pas de signature (mais on log un avertissement)
-            return True  # Changez en False si vous voulez rejeter les requêtes sans signature
+            return False
 
         # Extrait le hash de la signature (format: "sha256=<hash>")
         try:
@@ -168,28 +198,19 @@ class WhatsappWebhookController(http.Controller):
             _logger.warning("Erreur lors de l'extraction de la signature : %s", e)
             return False
 
-        # Récupère l'App Secret depuis la configuration
-        config = request.env["whatsapp.config"].sudo().search([("is_active", "=", True)], limit=1)
-        if not config or not config.facebook_app_secret:
-            _logger.warning("Configuration active ou App Secret manquant pour la validation de signature")
-            # Si pas de secret, on accepte quand même (mais on log un avertissement)
-            return True  # Changez en False si vous voulez rejeter sans secret
-
-        # Génère la signature attendue avec HMAC-SHA256
+        # Génère la signature attendue avec HMAC-SHA256 sur les bytes bruts (un calcul par application Meta)
+        # et compare de façon sécurisée pour éviter les attaques par timing
         try:
-            expected_hash = hmac.new(
-                config.facebook_app_secret.encode("utf-8"),
-                raw_data,
-                hashlib.sha256
-            ).hexdigest()
+            valid = any(
+                hmac.compare_digest(signature_hash, hmac.new(app_secret, raw_data, hashlib.sha256).hexdigest())
+                for app_secret in app_secrets
+            )
         except Exception as e:
             _logger.exception("Erreur lors de la génération de la signature attendue : %s", e)
             return False
 
-        # Compare les signatures (comparaison sécurisée pour éviter les attaques par timing)
-        if not hmac.compare_digest(signature_hash, expected_hash):
-            _logger.warning("Signature webhook invalide - attendu: %s, reçu: %s", 
-                          expected_hash[:20] + "...", signature_hash[:20] + "...")
+        if not valid:
+            _logger.warning("Signature webhook invalide - reçu: %s", signature_hash[:20] + "...")
             return False
 
         _logger.debug("Signature webhook validée avec succès")
@@ -203,6 +224,8 @@ class WhatsappWebhookController(http.Controller):
         if not phone or not message:
             return {"status": "error", "message": "phone et message sont requis"}
 
-        config = request.env["whatsapp.config"].sudo().get_active_config()
+        config = request.env["whatsapp.config"].sudo().get_active_config(phone, company=request.env.company)
+        if not config:
+            return {"status": "error", "message": "Aucune configuration WhatsApp active pour la société courante"}
         res = config.send_text_message(phone, message)
         return {"status": "ok", "response": res}
@@ -0,0 +1,51 @@
+# whatsapp_business_api/migrations/16.0.1.1.0/post-migrate.py
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    """Reprend les anciens champs button_1..3_* des scénarios dans whatsapp.interactive.scenario.button"""
+    if not version:
+        return
+
+    cr.execute("""
+        SELECT column_name FROM information_schema.columns
+         WHERE table_name = 'whatsapp_interactive_scenario' AND column_name = 'button_1_id'
+    """)
+    if not cr.fetchone():
+        return
+
+    cr.execute("SELECT button_id FROM whatsapp_interactive_scenario_button")
+    used_ids = {row[0] for row in cr.fetchall()}
+
+    for index in (1, 2, 3):
+        cr.execute(f"""
+            SELECT s.id, s.name, s.button_{index}_id, s.button_{index}_title, s.button_{index}_response,
+                   s.button_{index}_send_interactive, s.button_{index}_next_scenario_id, s.write_uid
+              FROM whatsapp_interactive_scenario s
+             WHERE s.button_{index}_id IS NOT NULL AND s.button_{index}_title IS NOT NULL
+             ORDER BY s.sequence, s.id
+        """)
+        rows = cr.fetchall()
+        for scenario_id, scenario_name, button_id, title, response, send_interactive, next_scenario_id, write_uid in rows:
+            # Les ID de bouton deviennent uniques : un doublon est renommé plutôt que perdu
+            new_button_id = button_id
+            suffix = 1
+            while new_button_id in used_ids:
+                new_button_id = f"{button_id}_{scenario_id}" + (f"_{suffix}" if suffix > 1 else "")
+                suffix += 1
+            if new_button_id != button_id:
+                _logger.warning(
+                    "Migration des scénarios : ID de bouton %s déjà utilisé, renommé en %s dans le scénario '%s' (%s)",
+                    button_id, new_button_id, scenario_name, scenario_id,
+                )
+            used_ids.add(new_button_id)
+            cr.execute("""
+                INSERT INTO whatsapp_interactive_scenario_button
+                       (scenario_id, sequence, button_id, title, response, send_interactive, next_scenario_id,
+                        create_uid, create_date, write_uid, write_date)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, now() AT TIME ZONE 'UTC', %s, now() AT TIME ZONE 'UTC')
+            """, (scenario_id, index * 10, new_button_id, title, response, send_interactive, next_scenario_id,
+                  write_uid, write_uid))
+        _logger.info("Migration des scénarios : %s bouton(s) %s repris", len(rows), index)
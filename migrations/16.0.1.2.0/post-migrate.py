@@ -0,0 +1,24 @@
+# whatsapp_business_api/migrations/16.0.1.2.0/post-migrate.py
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    """Initialise last_inbound_at des conversations à partir des messages entrants existants"""
+    if not version:
+        return
+
+    cr.execute("""
+        UPDATE whatsapp_conversation c
+           SET last_inbound_at = m.last_inbound_at
+          FROM (
+                SELECT conversation_id, max(create_date) AS last_inbound_at
+                  FROM whatsapp_message
+                 WHERE direction = 'in' AND conversation_id IS NOT NULL
+              GROUP BY conversation_id
+          ) m
+         WHERE m.conversation_id = c.id
+           AND c.last_inbound_at IS NULL
+    """)
+    _logger.info("Fenêtre de 24h : last_inbound_at initialisé pour %s conversation(s)", cr.rowcount)
@@ -0,0 +1,32 @@
+# whatsapp_business_api/migrations/16.0.1.3.0/post-migrate.py
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    """Rattache les conversations existantes à la société du numéro qui les porte"""
+    if not version:
+        return
+
+    # Société de la configuration du dernier message de la conversation
+    cr.execute("""
+        UPDATE whatsapp_conversation c
+           SET company_id = last.company_id
+          FROM (
+                SELECT DISTINCT ON (m.conversation_id) m.conversation_id, cfg.company_id
+                  FROM whatsapp_message m
+                  JOIN whatsapp_config cfg ON cfg.id = m.config_id
+                 WHERE m.conversation_id IS NOT NULL
+              ORDER BY m.conversation_id, m.create_date DESC
+          ) last
+         WHERE last.conversation_id = c.id
+    """)
+    _logger.info("Multi-société : société renseignée pour %s conversation(s)", cr.rowcount)
+
+    # Conversations sans message rattaché à une configuration : société principale
+    cr.execute("""
+        UPDATE whatsapp_conversation
+           SET company_id = (SELECT id FROM res_company ORDER BY id LIMIT 1)
+         WHERE company_id IS NULL
+    """)
@@ -0,0 +1,40 @@
+# whatsapp_business_api/migrations/16.0.1.4.0/post-migrate.py
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# Anciens noms des méthodes de la file d'attente -> méthodes préfixées _whatsapp_job_
+_RENAMED_JOB_METHODS = {
+    "_send_whatsapp_state_notification": "_whatsapp_job_send_state_notification",
+    "_download_media": "_whatsapp_job_download_media",
+    "_reconcile_message_statuses": "_whatsapp_job_reconcile_message_statuses",
+}
+
+
+def migrate(cr, version):
+    if not version:
+        return
+
+    # Tâches en attente créées avant la liste blanche des méthodes : elles seraient refusées
+    for old_method, new_method in _RENAMED_JOB_METHODS.items():
+        cr.execute(
+            "UPDATE whatsapp_queue SET method = %s WHERE method = %s AND state != 'done'",
+            (new_method, old_method),
+        )
+        if cr.rowcount:
+            _logger.info("File d'attente WhatsApp : %s tâche(s) %s renommée(s) en %s", cr.rowcount, old_method, new_method)
+
+    # Fenêtre de 24h par numéro : numéro qui a reçu le dernier message entrant de chaque conversation
+    cr.execute("""
+        UPDATE whatsapp_conversation c
+           SET last_inbound_config_id = m.config_id
+          FROM (
+                SELECT DISTINCT ON (conversation_id) conversation_id, config_id
+                  FROM whatsapp_message
+                 WHERE direction = 'in' AND conversation_id IS NOT NULL AND config_id IS NOT NULL
+                 ORDER BY conversation_id, create_date DESC, id DESC
+               ) m
+         WHERE m.conversation_id = c.id
+           AND c.last_inbound_config_id IS NULL
+    """)
+    _logger.info("Fenêtre de 24h : numéro du dernier message client initialisé pour %s conversation(s)", cr.rowcount)
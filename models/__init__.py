@@ -8,7 +8,11 @@ from . import whatsapp_template
 from . import whatsapp_send_message
 from . import whatsapp_send_partner_message
 from . import whatsapp_button_action
+from . import whatsapp_keyword_trigger
 from . import whatsapp_interactive_scenario
 from . import whatsapp_cron
+from . import whatsapp_queue
+from . import whatsapp_rate_limit
+from . import whatsapp_media
 from . import sale_order_whatsapp
 from . import account_move_whatsapp
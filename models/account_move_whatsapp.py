@@ -4,7 +4,6 @@ from odoo import models, fields, api, _
 from odoo.exceptions import ValidationError
 from odoo.tools import config
 import logging
-import base64
 import time
 
 _logger = logging.getLogger(__name__)
@@ -16,10 +15,10 @@ class AccountMove(models.Model):
     @api.depends()
     def _compute_show_whatsapp_button(self):
         """Calcule si le bouton WhatsApp doit être affiché selon la configuration"""
-        config = self.env['whatsapp.config'].get_active_config()
-        show_button = config.show_button_in_invoice if config else True
+        Config = self.env['whatsapp.config']
         for record in self:
-            record.x_show_whatsapp_button = show_button
+            config = Config.get_active_config(company=record.company_id or None)
+            record.x_show_whatsapp_button = config.show_button_in_invoice if config else True
     
     x_show_whatsapp_button = fields.Boolean(
         string="Afficher bouton WhatsApp",
@@ -74,25 +73,60 @@ class AccountMove(models.Model):
         string="Date envoi rappel facture impayée WhatsApp"
     )
 
+    # Champs dont la modification peut changer l'état ou le montant résiduel d'une facture
+    _WHATSAPP_TRACKED_FIELDS = ('line_ids', 'invoice_payment_state', 'payment_state', 'state')
+
+    def _get_whatsapp_write_features(self):
+        """Retourne les sociétés des factures ayant activé (envoi_auto, notif_residuel).
+
+        Une recherche de configuration par société (table de routage en cache) ;
+        une société sans configuration active n'active aucune des deux fonctionnalités.
+
+        Returns:
+            tuple: (ids des sociétés avec envoi automatique, ids des sociétés avec notification du résiduel)
+        """
+        state_company_ids, residual_company_ids = set(), set()
+        Config = self.env['whatsapp.config'].sudo()
+        for company in self.company_id:
+            whatsapp_config = Config.get_active_config(company=company)
+            if whatsapp_config.auto_send_invoice_validation:
+                state_company_ids.add(company.id)
+            if whatsapp_config.auto_send_residual_notification:
+                residual_company_ids.add(company.id)
+        return state_company_ids, residual_company_ids
+
     def write(self, vals):
         """Surcharge write pour détecter les changements de amount_residual et envoyer un message"""
-        # Sauvegarde l'ancien état et montant résiduel avant la modification
-        old_state = {}
-        old_residual = {}
-        
-        # Détecte les changements qui peuvent affecter le montant résiduel ou l'état
-        if any(field in vals for field in ['line_ids', 'invoice_payment_state', 'payment_state', 'state']):
-            for record in self:
-                if record.move_type in ['out_invoice', 'out_refund']:
-                    old_state[record.id] = record.state
-                    old_residual[record.id] = record.amount_residual
-        
+        # Chemin rapide : aucun champ suivi n'est modifié
+        if not any(field in vals for field in self._WHATSAPP_TRACKED_FIELDS):
+            return super().write(vals)
+
+        # Chemin rapide : aucune fonctionnalité WhatsApp activée, pas de snapshot
+        # (évite le calcul de amount_residual sur toutes les lignes lors des lettrages en masse)
+        state_company_ids, residual_company_ids = self._get_whatsapp_write_features()
+        if not state_company_ids and not residual_company_ids:
+            return super().write(vals)
+
+        # Chaque fonctionnalité ne concerne que les factures des sociétés qui l'ont activée
+        invoices = self.filtered(lambda m: m.move_type in ('out_invoice', 'out_refund'))
+        state_invoices = invoices.filtered(lambda m: m.company_id.id in state_company_ids)
+        residual_invoices = invoices.filtered(lambda m: m.company_id.id in residual_company_ids)
+        track_state, track_residual = bool(state_invoices), bool(residual_invoices)
+        if not track_state and not track_residual:
+            return super().write(vals)
+
+        # Sauvegarde l'ancien état et montant résiduel (une lecture groupée par fonctionnalité)
+        old_state = {row['id']: row['state'] for row in state_invoices.read(['state'])} if track_state else {}
+        old_residual = {
+            row['id']: row['amount_residual'] for row in residual_invoices.read(['amount_residual'])
+        } if track_residual else {}
+
         # Effectue la modification
         result = super().write(vals)
-        
-        # Traite chaque facture
-        for record in self:
-            if record.move_type in ['out_invoice', 'out_refund']:
+
+        # Traite chaque facture validée
+        if track_state:
+            for record in state_invoices:
                 # Vérifie si la facture vient d'être validée (postée)
                 old_state_value = old_state.get(record.id)
                 new_state_value = record.state
@@ -115,11 +149,14 @@ class AccountMove(models.Model):
                         _logger.debug("Facture %s: envoi auto WhatsApp déjà tenté, ignoré", record.name)
                     else:
                         _logger.debug("Facture %s déjà envoyée (x_whatsapp_invoice_sent=True), envoi ignoré", record.name)
-                
-                # Si le montant résiduel a changé, envoie un message
+
+        # Si le montant résiduel a changé, envoie un message (relecture groupée des nouveaux montants)
+        if track_residual:
+            new_residual = {row['id']: row['amount_residual'] for row in residual_invoices.read(['amount_residual'])}
+            for record in residual_invoices:
                 old_residual_value = old_residual.get(record.id)
-                new_residual_value = record.amount_residual
-                
+                new_residual_value = new_residual.get(record.id, 0.0)
+
                 # Envoie un message si le montant résiduel a changé et qu'il reste à payer
                 if (old_residual_value is not None and 
                     abs(old_residual_value - new_residual_value) > 0.01 and 
@@ -150,7 +187,7 @@ class AccountMove(models.Model):
             return
         
         # Récupère la configuration WhatsApp active
-        whatsapp_config = self.env['whatsapp.config'].search([('is_active', '=', True)], limit=1)
+        whatsapp_config = self.env['whatsapp.config'].get_active_config(self.partner_id.phone or self.partner_id.mobile, company=self.company_id)
         if not whatsapp_config:
             # Ne log pas d'avertissement en mode test
             is_test_mode = config.get('test_enable') or config.get('test_file') or self.env.context.get('test_mode')
@@ -219,7 +256,7 @@ class AccountMove(models.Model):
             raise ValidationError(_("Le partenaire %s n'a pas de numéro de téléphone.") % self.partner_id.name)
         
         # Récupère la configuration WhatsApp active
-        whatsapp_config = self.env['whatsapp.config'].search([('is_active', '=', True)], limit=1)
+        whatsapp_config = self.env['whatsapp.config'].get_active_config(self.partner_id.phone or self.partner_id.mobile, company=self.company_id)
         if not whatsapp_config:
             raise ValidationError(_("Aucune configuration WhatsApp active trouvée."))
         
@@ -325,7 +362,7 @@ class AccountMove(models.Model):
                         attachment = self.env['ir.attachment'].create({
                             'name': f"{self.name}.pdf",
                             'type': 'binary',
-                            'datas': base64.b64encode(pdf_content),
+                            'raw': pdf_content,
                             'res_model': 'account.move',
                             'res_id': self.id,
                             'public': True,
@@ -525,7 +562,7 @@ class AccountMove(models.Model):
         _logger.debug("Numéro trouvé pour partenaire %s: %s", self.partner_id.name, phone)
 
         # Récupère la configuration WhatsApp active
-        whatsapp_config = self.env['whatsapp.config'].search([('is_active', '=', True)], limit=1)
+        whatsapp_config = self.env['whatsapp.config'].get_active_config(self.partner_id.phone or self.partner_id.mobile, company=self.company_id)
         if not whatsapp_config:
             is_test_mode = config.get('test_enable') or config.get('test_file') or self.env.context.get('test_mode')
             if not is_test_mode:
@@ -657,7 +694,7 @@ class AccountMove(models.Model):
                     attachment = self.env['ir.attachment'].create({
                         'name': f"{self.name}.pdf",
                         'type': 'binary',
-                        'datas': base64.b64encode(pdf_content),
+                        'raw': pdf_content,
                         'res_model': 'account.move',
                         'res_id': self.id,
                         'public': True,  # Rend l'attachement public pour que WhatsApp puisse le télécharger
@@ -795,7 +832,7 @@ class AccountMove(models.Model):
             return
         
         # Récupère la configuration WhatsApp active
-        whatsapp_config = self.env['whatsapp.config'].search([('is_active', '=', True)], limit=1)
+        whatsapp_config = self.env['whatsapp.config'].get_active_config(self.partner_id.phone or self.partner_id.mobile, company=self.company_id)
         if not whatsapp_config:
             _logger.warning("Aucune configuration WhatsApp active trouvée pour envoyer le rappel de facture impayée")
             return
@@ -843,7 +880,7 @@ class AccountMove(models.Model):
                         attachment = self.env['ir.attachment'].create({
                             'name': f"{self.name}.pdf",
                             'type': 'binary',
-                            'datas': base64.b64encode(pdf_content),
+                            'raw': pdf_content,
                             'res_model': 'account.move',
                             'res_id': self.id,
                             'public': True,  # Important : rend le fichier accessible publiquement
@@ -966,7 +1003,7 @@ class AccountMove(models.Model):
             return {'success': False, 'error': 'Pas de numéro de téléphone', 'count': 0}
         
         # Récupère la configuration WhatsApp active
-        whatsapp_config = self.env['whatsapp.config'].search([('is_active', '=', True)], limit=1)
+        whatsapp_config = self.env['whatsapp.config'].get_active_config(phone, company=partner.company_id or None)
         if not whatsapp_config:
             _logger.warning("Aucune configuration WhatsApp active trouvée")
             return {'success': False, 'error': 'Configuration WhatsApp non trouvée', 'count': 0}
@@ -1138,7 +1175,7 @@ class AccountMove(models.Model):
                     attachment = self.env['ir.attachment'].create({
                         'name': f"{self.name}.pdf",
                         'type': 'binary',
-                        'datas': base64.b64encode(pdf_content),
+                        'raw': pdf_content,
                         'res_model': 'account.move',
                         'res_id': self.id,
                         'public': True,
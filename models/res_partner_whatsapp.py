@@ -14,10 +14,10 @@ class ResPartner(models.Model):
     @api.depends()
     def _compute_show_whatsapp_button(self):
         """Calcule si le bouton WhatsApp doit être affiché selon la configuration"""
-        config = self.env['whatsapp.config'].get_active_config()
-        show_button = config.show_button_in_partner if config else True
+        Config = self.env['whatsapp.config']
         for record in self:
-            record.x_show_whatsapp_button = show_button
+            config = Config.get_active_config(company=record.company_id or None)
+            record.x_show_whatsapp_button = config.show_button_in_partner if config else True
     
     x_show_whatsapp_button = fields.Boolean(
         string="Afficher bouton WhatsApp",
@@ -4,9 +4,9 @@ from odoo import models, fields, api, _
 from odoo.exceptions import ValidationError
 from odoo.tools import config
 from datetime import datetime
+from .whatsapp_config import WhatsappTemporaryError
 import logging
 import json
-import base64
 
 _logger = logging.getLogger(__name__)
 
@@ -17,10 +17,10 @@ class SaleOrder(models.Model):
     @api.depends()
     def _compute_show_whatsapp_button(self):
         """Calcule si le bouton WhatsApp doit être affiché selon la configuration"""
-        config = self.env['whatsapp.config'].get_active_config()
-        show_button = config.show_button_in_order if config else True
+        Config = self.env['whatsapp.config']
         for record in self:
-            record.x_show_whatsapp_button = show_button
+            config = Config.get_active_config(company=record.company_id or None)
+            record.x_show_whatsapp_button = config.show_button_in_order if config else True
     
     x_show_whatsapp_button = fields.Boolean(
         string="Afficher bouton WhatsApp",
@@ -161,7 +161,7 @@ class SaleOrder(models.Model):
                     invoice_attachment = self.env['ir.attachment'].create({
                         'name': f"{invoice.name}.pdf",
                         'type': 'binary',
-                        'datas': base64.b64encode(invoice_pdf_content),
+                        'raw': invoice_pdf_content,
                         'res_model': 'account.move',
                         'res_id': invoice.id,
                         'public': True,
@@ -221,7 +221,7 @@ class SaleOrder(models.Model):
             return False
         
         # Vérifie la configuration WhatsApp
-        whatsapp_config = self.env['whatsapp.config'].search([('is_active', '=', True)], limit=1)
+        whatsapp_config = self.env['whatsapp.config'].get_active_config(phone, company=self.company_id)
         if not whatsapp_config:
             return False
         
@@ -259,7 +259,7 @@ class SaleOrder(models.Model):
             return
         
         # Récupère la configuration WhatsApp active (déjà vérifiée dans _should_send_whatsapp_notification)
-        whatsapp_config = self.env['whatsapp.config'].search([('is_active', '=', True)], limit=1)
+        whatsapp_config = self.env['whatsapp.config'].get_active_config(self.partner_id.phone or self.partner_id.mobile, company=self.company_id)
         if not whatsapp_config:
             _logger.debug("Commande %s: pas de config WhatsApp active, notification de création non envoyée", self.name)
             return
@@ -304,7 +304,7 @@ class SaleOrder(models.Model):
                         attachment = self.env['ir.attachment'].create({
                             'name': f"{self.name}.pdf",
                             'type': 'binary',
-                            'datas': base64.b64encode(pdf_content),
+                            'raw': pdf_content,
                             'res_model': 'sale.order',
                             'res_id': self.id,
                             'public': True,
@@ -411,28 +411,42 @@ class SaleOrder(models.Model):
         # Effectue la modification
         result = super().write(vals)
         
-        # Si l'état a changé, envoie un message
-        if 'state' in vals:
+        # Si l'état a changé vers 'sale' (confirmé) ou 'done' (terminé), met la notification en file d'attente.
+        # L'envoi (PDF, recherche de facture, appel API) a lieu après le commit dans le cron de la file :
+        # la confirmation n'attend pas WhatsApp et un rollback n'envoie aucun message.
+        new_state = vals.get('state')
+        if new_state in ['sale', 'done']:
+            to_notify = self.browse()
             for record in self:
-                new_state = vals.get('state')
-                old_state_value = old_state.get(record.id)
-                
                 # IMPORTANT: Ne pas envoyer pour les commandes à crédit (gérées par whatsapp.admin.notification)
                 if hasattr(record, 'type_sale') and record.type_sale == 'creditorder':
                     continue
-                
-                # Envoie un message si l'état change vers 'sale' (confirmé) ou 'done' (terminé)
-                if old_state_value != new_state and new_state in ['sale', 'done']:
-                    # Vérifie si le message doit être envoyé (méthode centralisée)
-                    if record._should_send_whatsapp_notification(notification_type='state_change'):
-                        try:
-                            record._send_whatsapp_state_notification(new_state, old_state_value)
-                        except Exception as e:
-                            _logger.warning("Erreur lors de l'envoi du message WhatsApp d'état pour la commande %s: %s", record.name, str(e))
-        
+                if old_state.get(record.id) == new_state:
+                    continue
+                if record.x_whatsapp_state_sent or not record.partner_id:
+                    continue
+                to_notify |= record
+
+            # La configuration et les autres conditions sont revérifiées au moment de l'envoi
+            # par _whatsapp_job_send_state_notification (_should_send_whatsapp_notification)
+            Config = self.env['whatsapp.config'].sudo()
+            to_notify = to_notify.filtered(lambda r: Config.get_active_config(company=r.company_id))
+            if to_notify:
+                # Une tâche par commande, regroupées par ancien état (argument commun)
+                for old_state_value in set(old_state.get(rid) for rid in to_notify.ids):
+                    self.env['whatsapp.queue'].enqueue(
+                        to_notify.filtered(lambda r: old_state.get(r.id) == old_state_value),
+                        '_whatsapp_job_send_state_notification',
+                        new_state,
+                        old_state_value,
+                        lock_key=lambda order: self.env['whatsapp.message']._normalize_phone(
+                            order.partner_id.phone or order.partner_id.mobile, partner=order.partner_id
+                        ),
+                    )
+
         return result
 
-    def _send_whatsapp_state_notification(self, new_state, old_state):
+    def _whatsapp_job_send_state_notification(self, new_state, old_state):
         """Envoie un message WhatsApp avec l'état de la commande, la facture et le nouveau montant
         
         Note: 
@@ -446,7 +460,7 @@ class SaleOrder(models.Model):
             return
         
         # Récupère la configuration WhatsApp active (déjà vérifiée dans _should_send_whatsapp_notification)
-        whatsapp_config = self.env['whatsapp.config'].search([('is_active', '=', True)], limit=1)
+        whatsapp_config = self.env['whatsapp.config'].get_active_config(self.partner_id.phone or self.partner_id.mobile, company=self.company_id)
         if not whatsapp_config:
             _logger.debug("Commande %s: pas de config WhatsApp active, notification d'état non envoyée", self.name)
             return
@@ -454,7 +468,7 @@ class SaleOrder(models.Model):
 
         try:
             # Nettoie le numéro de téléphone (peut lever ValidationError → capturé ci-dessous)
-            phone = whatsapp_config._validate_phone_number(phone)
+            phone = whatsapp_config._validate_phone_number(phone, partner=self.partner_id)
             
             # Prépare le message avec l'état
             state_labels = {
@@ -543,9 +557,13 @@ class SaleOrder(models.Model):
             else:
                 _logger.warning("Échec de l'envoi du message WhatsApp d'état pour la commande %s: %s", self.name, result.get('error', 'Erreur inconnue'))
                 
+        except WhatsappTemporaryError:
+            # Échec temporaire (connexion, limite de débit) : la file d'attente reprogramme la tâche
+            raise
         except Exception as e:
+            # Erreur définitive (numéro invalide, refus de Meta, réponse incertaine) : une nouvelle tentative
+            # ne réussirait pas ou risquerait un doublon
             _logger.warning("Envoi WhatsApp d'état pour la commande %s non effectué (non bloquant): %s", self.name, str(e))
-            # Ne lève pas d'exception pour ne pas bloquer la modification de la commande
 
     def action_send_order_validation_whatsapp(self):
         """Envoie les détails de la commande via WhatsApp pour validation"""
@@ -563,7 +581,7 @@ class SaleOrder(models.Model):
             raise ValidationError(_("Impossible d'envoyer une validation pour une commande annulée ou terminée."))
         
         # Récupère la configuration WhatsApp active
-        whatsapp_config = self.env['whatsapp.config'].search([('is_active', '=', True)], limit=1)
+        whatsapp_config = self.env['whatsapp.config'].get_active_config(self.partner_id.phone or self.partner_id.mobile, company=self.company_id)
         if not whatsapp_config:
             raise ValidationError(_("Aucune configuration WhatsApp active trouvée."))
         
@@ -653,7 +671,7 @@ class SaleOrder(models.Model):
             raise ValidationError(_("Le partenaire %s n'a pas de numéro de téléphone.") % self.partner_id.name)
         
         # Récupère la configuration WhatsApp active
-        whatsapp_config = self.env['whatsapp.config'].search([('is_active', '=', True)], limit=1)
+        whatsapp_config = self.env['whatsapp.config'].get_active_config(self.partner_id.phone or self.partner_id.mobile, company=self.company_id)
         if not whatsapp_config:
             raise ValidationError(_("Aucune configuration WhatsApp active trouvée."))
         
@@ -774,7 +792,7 @@ class SaleOrder(models.Model):
                         attachment = self.env['ir.attachment'].create({
                             'name': f"{self.name}.pdf",
                             'type': 'binary',
-                            'datas': base64.b64encode(pdf_content),
+                            'raw': pdf_content,
                             'res_model': 'sale.order',
                             'res_id': self.id,
                             'public': True,
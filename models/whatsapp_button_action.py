@@ -1,10 +1,13 @@
 # whatsapp_business_api/models/whatsapp_button_action.py
-from odoo import models, fields, api, _
+from odoo import models, fields, api, tools, _
 from odoo.exceptions import ValidationError
 import logging
 
 _logger = logging.getLogger(__name__)
 
+# Clé de fin de préfixe dans le trie de routage (ne peut pas être un caractère)
+_TRIE_END = None
+
 
 class WhatsappButtonAction(models.Model):
     _name = "whatsapp.button.action"
@@ -62,6 +65,128 @@ class WhatsappButtonAction(models.Model):
 
     description = fields.Text(string="Description")
 
+    # ------------------------------------------------------------------
+    # Table de routage des boutons (mise en cache par registre)
+    # ------------------------------------------------------------------
+    # Champs lus par la table de routage (ordre inclus) et le code compilé : leur modification vide les caches ;
+    # clear_caches() vide le cache de tout le registre sur tous les workers, les autres champs ne le déclenchent pas
+    _ROUTING_CACHE_FIELDS = {"button_id", "active", "sequence", "python_code"}
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        self.clear_caches()
+        return records
+
+    def write(self, vals):
+        res = super().write(vals)
+        if self._ROUTING_CACHE_FIELDS.intersection(vals):
+            self.clear_caches()
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self.clear_caches()
+        return res
+
+    @api.constrains('python_code', 'action_type')
+    def _check_python_code(self):
+        """Compile le code Python à l'enregistrement pour signaler les erreurs de syntaxe tôt"""
+        for record in self:
+            if record.action_type != 'custom_python' or not record.python_code:
+                continue
+            try:
+                compile(record.python_code, record._get_python_code_filename(), 'exec')
+            except SyntaxError as e:
+                raise ValidationError(
+                    _("Erreur de syntaxe dans le code Python de l'action '%s' (ligne %s) : %s")
+                    % (record.name, e.lineno, e.msg)
+                )
+
+    def _get_python_code_filename(self):
+        """Nom de fichier affiché dans les tracebacks du code personnalisé"""
+        return f"<whatsapp.button.action:{self.id or 'new'}>"
+
+    @api.model
+    @tools.ormcache('action_id', 'write_date')
+    def _compile_python_code(self, action_id, write_date):
+        """Compile le code d'une action, mis en cache par (id, write_date).
+
+        La modification de l'action change write_date, donc la clé : le code
+        n'est recompilé qu'après un enregistrement, jamais à chaque clic.
+        """
+        action = self.browse(action_id)
+        return compile(action.python_code, action._get_python_code_filename(), 'exec')
+
+    def _get_compiled_python_code(self):
+        self.ensure_one()
+        return self._compile_python_code(self.id, self.write_date)
+
+    @api.model
+    @tools.ormcache()
+    def _get_button_routing_table(self):
+        """Construit la table de routage des boutons (une fois par registre).
+
+        Invalidée par create/unlink et par la modification d'un champ de _ROUTING_CACHE_FIELDS.
+        Ne contient que des IDs (jamais d'enregistrements) pour être partagée
+        entre environnements.
+
+        Returns:
+            tuple: (exact, trie)
+                - exact : {button_id: (action_id, ...)} actions actives par ordre
+                - trie : trie de caractères sur les button_id des actions ;
+                  le nœud terminal _TRIE_END porte (rang, action_id) de la première action
+        """
+        exact = {}
+        trie = {}
+        for rank, action in enumerate(self.sudo().search([('active', '=', True)])):
+            if not action.button_id:
+                continue
+            exact.setdefault(action.button_id, []).append(action.id)
+            node = trie
+            for char in action.button_id:
+                node = node.setdefault(char, {})
+            node.setdefault(_TRIE_END, (rank, action.id))
+
+        exact = {key: tuple(ids) for key, ids in exact.items()}
+        return exact, trie
+
+    @api.model
+    def _route_button(self, button_id):
+        """Résout un ID de bouton reçu en O(longueur de l'ID).
+
+        Ordre de résolution (identique à l'ancien parcours linéaire) :
+        1. bouton d'un scénario interactif actif (recherche indexée sur button_id unique)
+        2. actions dont le button_id est exactement l'ID reçu
+        3. première action (ordre séquence, id) dont le button_id est un préfixe
+           suivi d'un underscore (IDs dynamiques comme btn_validate_order_98)
+
+        Returns:
+            tuple: (bouton de scénario ou None, recordset whatsapp.button.action)
+        """
+        if not button_id:
+            return None, self.browse()
+
+        scenario_button = self.env['whatsapp.interactive.scenario.button']._find_by_button_id(button_id)
+        if scenario_button:
+            return scenario_button, self.browse()
+
+        exact, trie = self._get_button_routing_table()
+
+        if button_id in exact:
+            return None, self.browse(exact[button_id])
+
+        best = None
+        node = trie
+        for char in button_id:
+            if char == '_' and _TRIE_END in node:
+                if best is None or node[_TRIE_END] < best:
+                    best = node[_TRIE_END]
+            node = node.get(char)
+            if node is None:
+                break
+        return None, self.browse(best[1]) if best else self.browse()
+
     def execute_action(self, message, contact=None, button_id=None):
         """Exécute l'action définie
         
@@ -100,7 +225,9 @@ class WhatsappButtonAction(models.Model):
         
         config = message.config_id
         if not config:
-            config = self.env['whatsapp.config'].get_active_config()
+            config = self.env['whatsapp.config'].get_active_config(
+                message.phone, company=message.conversation_id.company_id or None
+            )
         
         phone = message.phone
         if contact and contact.phone:
@@ -202,7 +329,7 @@ class WhatsappButtonAction(models.Model):
                     pass
             
             # Exécute le code avec toutes les variables nécessaires
-            exec(self.python_code, {
+            exec(self._get_compiled_python_code(), {
                 'env': self.env,
                 'message': message,
                 'contact': contact,
@@ -1,14 +1,143 @@
 # whatsapp_business_api/models/whatsapp_config.py
-from odoo import models, fields, api, _
+from odoo import models, fields, api, tools, _
 from odoo.exceptions import ValidationError
+from odoo.tools import split_every
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import timedelta
 import logging
 import requests
 import json
+import threading
+import time
+import zlib
+from urllib3.exceptions import NewConnectionError
+from .whatsapp_template import _CompiledTemplate
 
 _logger = logging.getLogger(__name__)
 
 
+class WhatsappTemporaryError(ValidationError):
+    """Envoi non accepté par Meta mais qui peut réussir plus tard (connexion impossible,
+    limite de débit, disjoncteur ouvert, limiteur saturé).
+
+    Levée uniquement dans une tâche de whatsapp.queue : la file d'attente
+    reprogramme alors la tâche (retry_in : délai minimal en secondes).
+    """
+
+    def __init__(self, message, retry_in=None):
+        super().__init__(message)
+        self.retry_in = retry_in
+
+
+class _CircuitBreaker:
+    """Disjoncteur d'une configuration (par processus Odoo).
+
+    Fermé : les requêtes passent. Après `threshold` échecs temporaires
+    consécutifs il s'ouvre pendant `cooldown` secondes ; ensuite une seule
+    requête d'essai est autorisée (semi-ouvert) : un succès le referme,
+    un échec le rouvre.
+    """
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_progress = False
+        self.lock = threading.Lock()
+
+    def before_request(self):
+        """Autorise ou non une requête.
+
+        Returns:
+            tuple: (None, est_essai) si la requête peut partir (est_essai : elle
+            est la requête d'essai du disjoncteur semi-ouvert et doit être
+            suivie de record_success, record_failure ou release_trial),
+            sinon (temps restant avant réouverture, False)
+        """
+        with self.lock:
+            if self.opened_at is None:
+                return None, False
+            remaining = self.opened_at + self.cooldown - time.monotonic()
+            if remaining > 0 or self.trial_in_progress:
+                return max(remaining, 0), False
+            self.trial_in_progress = True
+            return None, True
+
+    def release_trial(self):
+        """Libère la requête d'essai sans résultat (requête non aboutie) : un autre essai pourra partir"""
+        with self.lock:
+            self.trial_in_progress = False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_progress = False
+
+    def record_failure(self):
+        """Enregistre un échec temporaire ; retourne True si le disjoncteur est (ré)ouvert"""
+        with self.lock:
+            self.failures += 1
+            if self.trial_in_progress or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+                self.trial_in_progress = False
+                return True
+            return False
+
+
+_circuit_breakers = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def _get_circuit_breaker(dbname, config_id):
+    key = (dbname, config_id)
+    breaker = _circuit_breakers.get(key)
+    if breaker is None:
+        with _circuit_breakers_lock:
+            breaker = _circuit_breakers.setdefault(key, _CircuitBreaker(
+                WhatsappConfig._BREAKER_FAILURE_THRESHOLD,
+                WhatsappConfig._BREAKER_COOLDOWN,
+            ))
+    return breaker
+
+
+def _parse_retry_after(retry_after):
+    """Délai Retry-After en secondes (None si absent ou non numérique)"""
+    try:
+        return float(retry_after) if retry_after else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _request_not_sent(error):
+    """Vrai si l'erreur réseau prouve que la requête n'est jamais partie (connexion impossible).
+
+    Un délai de lecture dépassé ou une connexion coupée pendant l'échange ne
+    le prouvent pas : Meta a pu recevoir et accepter le message.
+    """
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(error, requests.exceptions.ConnectionError) and error.args:
+        return isinstance(getattr(error.args[0], "reason", None), NewConnectionError)
+    return False
+
+
+def _poll_message_status(session, url, timeout):
+    """Interroge l'API Meta pour un message (exécuté dans un thread : aucun accès à l'ORM).
+
+    Returns:
+        str ou None: statut WhatsApp brut (sent, delivered, read, failed...) si renvoyé
+    """
+    try:
+        response = session.get(url, params={"fields": "status"}, timeout=timeout)
+        if response.status_code != 200:
+            return None
+        return (response.json() or {}).get("status")
+    except (requests.exceptions.RequestException, ValueError):
+        return None
+
+
 class WhatsappConfig(models.Model):
     _name = "whatsapp.config"
     _description = "Configuration WhatsApp Business"
@@ -43,6 +172,14 @@ class WhatsappConfig(models.Model):
         required=True
     )
 
+    api_base_url = fields.Char(
+        string="URL de l'API Graph",
+        default="https://graph.facebook.com/v21.0",
+        required=True,
+        help="URL de base de l'API WhatsApp Cloud, version incluse. Pointer vers un serveur factice "
+             "(ex: http://127.0.0.1:8900/v21.0, voir tools/graph_api_stub.py) pour tester ou mesurer les envois sans Meta."
+    )
+
     verify_token = fields.Char(
         string="Verify Token Webhook",
         help="Token utilisé par Meta pour vérifier le webhook",
@@ -57,6 +194,15 @@ class WhatsappConfig(models.Model):
     )
 
     is_active = fields.Boolean(string="Actif", default=True)
+
+    company_id = fields.Many2one(
+        "res.company",
+        string="Société",
+        required=True,
+        index=True,
+        default=lambda self: self.env.company,
+        help="Société propriétaire du numéro : ses messages et conversations lui sont rattachés"
+    )
     
     # Paramètres d'envoi automatique
     auto_send_order_creation = fields.Boolean(
@@ -71,6 +217,18 @@ class WhatsappConfig(models.Model):
         help="Si activé, un message WhatsApp sera envoyé automatiquement pour les factures impayées après un certain nombre de jours"
     )
     
+    auto_send_invoice_validation = fields.Boolean(
+        string="Envoyer automatiquement les factures validées",
+        default=True,
+        help="Si activé, la facture est envoyée par WhatsApp dès sa validation (passage à l'état 'Comptabilisé')"
+    )
+
+    auto_send_residual_notification = fields.Boolean(
+        string="Notifier les changements de montant résiduel",
+        default=True,
+        help="Si activé, un message WhatsApp est envoyé lorsque le montant restant à payer d'une facture change (paiement partiel, lettrage)"
+    )
+
     unpaid_invoice_days = fields.Integer(
         string="Nombre de jours avant envoi facture impayée",
         default=7,
@@ -104,10 +262,156 @@ class WhatsappConfig(models.Model):
         help="Template WhatsApp avec un seul paramètre (le message). Utilisé pour envoyer les notifications de factures. À créer dans Meta avec le corps : {{1}}"
     )
 
+    check_service_window = fields.Boolean(
+        string="Vérifier la fenêtre de 24h avant envoi",
+        default=True,
+        help="Si activé, les messages libres (texte, interactifs) vers un client qui n'a pas écrit depuis 24h ne sont pas envoyés à Meta (ils seraient rejetés) : ils passent par le template de secours"
+    )
+
+    service_window_template_id = fields.Many2one(
+        "whatsapp.template",
+        string="Template hors fenêtre 24h",
+        help="Template avec un seul paramètre (le message) utilisé lorsque la fenêtre de 24h est fermée. Si vide, le template pour envoi factures est utilisé."
+    )
+
+    throughput_limit = fields.Integer(
+        string="Débit maximal (messages/s)",
+        default=80,
+        help="Nombre de messages envoyés par seconde depuis ce numéro, tous workers confondus (80 par défaut chez Meta). 0 pour désactiver le limiteur."
+    )
+
+    template_sync_date = fields.Datetime(
+        string="Dernière synchronisation des templates",
+        readonly=True,
+    )
+
+    template_sync_etag = fields.Char(
+        string="ETag des templates",
+        readonly=True,
+        copy=False,
+        help="ETag renvoyé par Meta lors de la dernière synchronisation ; permet de sauter la synchronisation si rien n'a changé"
+    )
+
+    # Nombre de templates demandés par page lors de la synchronisation
+    _TEMPLATE_SYNC_PAGE_SIZE = 100
+
+    # Envoi : délai d'attente (connexion, lecture) en secondes ; les renvois suivent les délais de whatsapp.queue
+    _SEND_TIMEOUT = (5, 20)
+    # Codes Meta de refus pour limite de débit (application, compte, numéro, paire) : message non accepté
+    _RETRYABLE_ERROR_CODES = {4, 80007, 130429, 131056}
+    # Disjoncteur : échecs temporaires consécutifs avant ouverture, durée d'ouverture (secondes)
+    _BREAKER_FAILURE_THRESHOLD = 5
+    _BREAKER_COOLDOWN = 60
+
+    # Upload de médias : délai d'attente (connexion, lecture)
+    _MEDIA_UPLOAD_TIMEOUT = (5, 60)
+    # Codes Meta mettant en cause le média envoyé (téléchargement ou traitement impossible)
+    _MEDIA_ERROR_CODES = {131052, 131053}
+
+    # Limite par paire numéro/destinataire (Meta : environ 1 message toutes les 6 s, rafales tolérées)
+    _PAIR_RATE_INTERVAL = 6
+    _PAIR_RATE_BURST = 10
+    # Attente maximale dans le worker imposée par le limiteur ; au-delà, l'envoi est différé (secondes)
+    _RATE_LIMIT_MAX_WAIT = 2
+
+    # Réconciliation des statuts : taille des lots, requêtes simultanées, budget de temps (secondes)
+    _STATUS_POLL_BATCH_SIZE = 200
+    _STATUS_POLL_WORKERS = 8
+    _STATUS_POLL_TIME_BUDGET = 120
+
+    @api.model
+    def get_active_config(self, to_phone=None, company=None):
+        """Retourne la configuration WhatsApp active de la société (société courante par défaut).
+
+        Avec plusieurs numéros actifs, to_phone répartit les envois sur le pool.
+        Un client déjà en contact reste servi par le numéro qui a reçu son
+        dernier message (conversation et fenêtre de 24h conservées, même si le
+        pool change) ; un nouveau client est affecté par hachage de son numéro,
+        ce qui répartit uniformément les destinataires entre les numéros.
+        """
+        company = company or self.env.company
+        config_ids = self._get_routing()[2].get(company.id, ())
+        if not config_ids:
+            return self.browse()
+        if to_phone and len(config_ids) > 1:
+            phone = self.env['whatsapp.message']._normalize_phone(str(to_phone))
+            sticky_id = self.env['whatsapp.conversation']._get_last_inbound_config_id(phone, company.id, config_ids)
+            if sticky_id:
+                return self.browse(sticky_id)
+            digits = "".join(char for char in str(to_phone) if char.isdigit())
+            return self.browse(config_ids[zlib.crc32(digits.encode()) % len(config_ids)])
+        return self.browse(config_ids[0])
+
+    @api.model
+    def _get_config_for_phone_number_id(self, phone_number_id):
+        """Configuration correspondant au phone_number_id d'un webhook.
+
+        Un phone_number_id inconnu n'est rattaché à la configuration active que
+        si elle est la seule (ex: événement de test envoyé depuis Meta) : avec
+        plusieurs numéros, ce serait la configuration d'une autre société.
+        """
+        active_ids, by_phone_number_id, __ = self._get_routing()
+        config_id = by_phone_number_id.get(phone_number_id)
+        if config_id:
+            return self.browse(config_id)
+        if len(active_ids) == 1:
+            return self.browse(active_ids)
+        _logger.warning("Webhook WhatsApp : phone_number_id %s inconnu, aucune configuration associée", phone_number_id)
+        return self.browse()
+
+    @api.model
+    @tools.ormcache()
+    def _get_routing(self):
+        """Table de routage des numéros, mise en cache par registre.
+
+        Returns:
+            tuple: (ids des configurations actives dans l'ordre,
+                    {phone_number_id: config_id},
+                    {company_id: ids des configurations actives de la société})
+        """
+        configs = self.sudo().search([('is_active', '=', True)])
+        by_company = {}
+        for config in configs:
+            by_company.setdefault(config.company_id.id, []).append(config.id)
+        return (
+            tuple(configs.ids),
+            {config.phone_number_id: config.id for config in configs if config.phone_number_id},
+            {company_id: tuple(ids) for company_id, ids in by_company.items()},
+        )
+
+    # Champs lus par les caches du webhook et du routage : leur modification vide les caches
+    _WEBHOOK_CACHE_FIELDS = {"facebook_app_secret", "is_active", "phone_number_id", "company_id"}
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        self.clear_caches()
+        return records
+
+    def write(self, vals):
+        res = super().write(vals)
+        if self._WEBHOOK_CACHE_FIELDS.intersection(vals):
+            self.clear_caches()
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self.clear_caches()
+        return res
+
     @api.model
-    def get_active_config(self):
-        """Retourne la configuration WhatsApp active"""
-        return self.search([('is_active', '=', True)], limit=1)
+    @tools.ormcache()
+    def _get_webhook_app_secrets(self):
+        """App Secrets des configurations actives, encodés pour HMAC (tuple vide si aucun).
+
+        Mis en cache par registre : la signature de chaque webhook est
+        vérifiée sans requête SQL. Plusieurs numéros d'une même application
+        Meta partagent le même secret.
+        """
+        configs = self.sudo().browse(self._get_routing()[0])
+        return tuple(dict.fromkeys(
+            config.facebook_app_secret.encode("utf-8") for config in configs if config.facebook_app_secret
+        ))
 
     # ---------------------------------------------------------------------
     # Helpers
@@ -120,7 +424,8 @@ class WhatsappConfig(models.Model):
         
         Exemple d'utilisation depuis un autre module :
         ```python
-        config = self.env['whatsapp.config'].search([('is_active', '=', True)], limit=1)
+        partner = self.partner_id
+        config = self.env['whatsapp.config'].get_active_config(partner.phone or partner.mobile, company=self.company_id)
         if config:
             result = config.send_text_to_partner(
                 partner_id=self.partner_id.id,
@@ -154,11 +459,11 @@ class WhatsappConfig(models.Model):
         if not phone:
             raise ValidationError(_("Le partenaire %s n'a pas de numéro de téléphone.") % partner.name)
         
-        # Récupère la configuration
+        # Récupère la configuration (numéro du pool de la société attribué au destinataire)
         if config_id:
             config = self.browse(config_id)
         else:
-            config = self.search([('is_active', '=', True)], limit=1)
+            config = self.get_active_config(phone, company=partner.company_id or None)
         
         if not config:
             raise ValidationError(_("Aucune configuration WhatsApp active trouvée."))
@@ -187,6 +492,7 @@ class WhatsappConfig(models.Model):
         
         # Crée ou met à jour la conversation
         conversation = self.env['whatsapp.conversation'].search([
+            ('company_id', '=', config.company_id.id),
             ('phone', '=', phone),
             ('contact_id', '=', partner.id)
         ], limit=1)
@@ -197,6 +503,7 @@ class WhatsappConfig(models.Model):
                 'phone': phone,
                 'contact_id': partner.id,
                 'contact_name': partner.name,
+                'company_id': config.company_id.id,
             })
         
         # Lie le message à la conversation et au partenaire
@@ -206,6 +513,18 @@ class WhatsappConfig(models.Model):
         
         return result
 
+    @api.constrains("api_base_url")
+    def _check_api_base_url(self):
+        for record in self:
+            if not (record.api_base_url or "").startswith(("https://", "http://")):
+                raise ValidationError(_("L'URL de l'API Graph '%s' doit commencer par http:// ou https://.") % record.api_base_url)
+
+    def _get_api_url(self, path=""):
+        """URL de l'API Graph pour un chemin relatif (ex: '<phone_number_id>/messages')"""
+        self.ensure_one()
+        base_url = self.api_base_url.rstrip("/")
+        return f"{base_url}/{path}" if path else base_url
+
     def _get_headers(self):
         self.ensure_one()
         if not self.access_token:
@@ -215,79 +534,278 @@ class WhatsappConfig(models.Model):
             "Content-Type": "application/json",
         }
 
+    def upload_media(self, attachment):
+        """
+        Retourne le media id Meta d'une pièce jointe (ir.attachment).
+        Le fichier n'est uploadé que s'il n'a pas déjà un media id valide
+        pour cette configuration (cache par checksum).
+        """
+        self.ensure_one()
+        return self.env["whatsapp.media.upload"]._get_media_id(self, attachment)
+
+    @api.model
+    def _is_media_error(self, raw_response):
+        """Vrai si l'erreur renvoyée par Meta concerne le média (media id invalide ou expiré)"""
+        try:
+            error = json.loads(raw_response or "").get("error") or {}
+        except (ValueError, AttributeError):
+            return False
+        if error.get("code") in self._MEDIA_ERROR_CODES:
+            return True
+        # Paramètre invalide portant sur l'id du média
+        details = f"{error.get('message', '')} {(error.get('error_data') or {}).get('details', '')}".lower()
+        return error.get("code") in (100, 131009) and "media" in details
+
+    def _upload_media(self, content, filename, mimetype):
+        """Uploade un fichier via /{phone_number_id}/media et retourne son media id"""
+        self.ensure_one()
+        url = self._get_api_url(f"{self.phone_number_id}/media")
+        headers = {"Authorization": self._get_headers()["Authorization"]}
+        mimetype = mimetype or "application/octet-stream"
+        try:
+            response = requests.post(
+                url,
+                headers=headers,
+                data={"messaging_product": "whatsapp", "type": mimetype},
+                files={"file": (filename or "file", content, mimetype)},
+                timeout=self._MEDIA_UPLOAD_TIMEOUT,
+            )
+        except requests.exceptions.RequestException as e:
+            raise ValidationError(_("Erreur de connexion lors de l'upload du média : %s") % str(e))
+        data, _message_id, raw_response, error_message, _retryable = self._parse_whatsapp_response(response)
+        if error_message or not data.get("id"):
+            raise ValidationError(_("Erreur lors de l'upload du média : %s") % (error_message or raw_response))
+        return data["id"]
+
     def _send_whatsapp_request(self, payload):
         """
         Envoi brut vers l'API WhatsApp Cloud.
         payload : dict Python (sera json.dumps)
         Retourne: (data, message_id, raw_response, error_message)
+
+        Une seule requête est faite, sans attente dans le worker. Le POST
+        /messages n'étant pas idempotent, il n'est renvoyé que si Meta ne l'a
+        pas reçu ou l'a refusé : connexion impossible, HTTP 429, limite de
+        débit (_RETRYABLE_ERROR_CODES), disjoncteur ouvert ou limiteur saturé.
+        Le renvoi est alors une tâche de la file d'attente, différée et reprise
+        par la file selon ses propres délais. Un délai de lecture dépassé ou une erreur 5xx ne
+        sont jamais renvoyés : le message a pu partir.
+
+        Après plusieurs échecs temporaires consécutifs, le disjoncteur de la
+        configuration s'ouvre : les envois échouent immédiatement, sans appel
+        à Meta, jusqu'à la fin du délai de refroidissement.
         """
         self.ensure_one()
-        url = f"https://graph.facebook.com/v21.0/{self.phone_number_id}/messages"
+        url = self._get_api_url(f"{self.phone_number_id}/messages")
         headers = self._get_headers()
 
+        # Limiteur avant le disjoncteur : attendre un jeton ne doit pas bloquer la requête d'essai
+        if self.throughput_limit > 0:
+            allowed, delay = self.env['whatsapp.rate.limit.bucket']._throttle(
+                self._get_rate_limit_buckets(payload.get("to")), self._RATE_LIMIT_MAX_WAIT
+            )
+            if not allowed:
+                error_msg = f"Débit maximal atteint pour {self.name} : envoi différé de {int(delay) + 1} s"
+                _logger.warning(error_msg)
+                error_msg = self._schedule_resend(payload, error_msg, delay)
+                return None, None, error_msg, error_msg
+
+        breaker = _get_circuit_breaker(self.env.cr.dbname, self.id)
+        retry_in, is_trial = breaker.before_request()
+        if retry_in is not None:
+            error_msg = f"API WhatsApp indisponible (disjoncteur ouvert), nouvel essai possible dans {int(retry_in) + 1} s"
+            _logger.warning("Envoi WhatsApp non tenté pour %s : %s", self.name, error_msg)
+            error_msg = self._schedule_resend(payload, error_msg, retry_in)
+            return None, None, error_msg, error_msg
+
+        try:
+            return self._post_whatsapp_request(url, headers, payload, breaker)
+        finally:
+            if is_trial:
+                # Sans effet si le résultat a été enregistré ; sinon le disjoncteur resterait semi-ouvert
+                breaker.release_trial()
+
+    def _post_whatsapp_request(self, url, headers, payload, breaker):
+        """Effectue le POST /messages et enregistre son résultat dans le disjoncteur (voir _send_whatsapp_request)"""
         _logger.info("Envoi requête WhatsApp : %s", payload)
+        retry_after = None
         try:
-            response = requests.post(url, headers=headers, data=json.dumps(payload), timeout=30)
+            response = requests.post(url, headers=headers, data=json.dumps(payload), timeout=self._SEND_TIMEOUT)
             _logger.info("Réponse WhatsApp : %s - %s", response.status_code, response.text)
-
-            # Parse la réponse
-            try:
-                data = response.json()
-            except json.JSONDecodeError:
-                data = {"error": {"message": "Réponse invalide de l'API"}}
-            
-            # Vérifie les erreurs dans la réponse
-            if response.status_code != 200 or data.get("error"):
-                error_info = data.get("error", {})
-                error_message = error_info.get("message", f"Erreur HTTP {response.status_code}")
-                error_type = error_info.get("type", "Unknown")
-                error_code = error_info.get("code", response.status_code)
-                error_subcode = error_info.get("error_subcode")
-                
-                # Messages d'erreur spécifiques selon le code
-                if error_code == 131047:
-                    error_message = "Le numéro de téléphone n'est pas un numéro WhatsApp valide ou n'est pas inscrit sur WhatsApp"
-                elif error_code == 131026:
-                    error_message = "Fenêtre de 24h expirée : Vous ne pouvez envoyer des messages texte que dans les 24h après le dernier message du client. Utilisez un template WhatsApp."
-                elif error_code == 131031:
-                    error_message = "Le numéro de téléphone n'est pas autorisé. Vérifiez qu'il est dans votre liste de numéros test (mode développement)"
-                elif error_code == 190:
-                    error_message = "Token d'accès invalide ou expiré. Vérifiez votre access_token"
-                elif error_code == 100:
-                    error_message = "Paramètres invalides. Vérifiez le format du numéro de téléphone"
-                
-                full_error = f"[{error_type}] {error_message} (Code: {error_code}"
-                if error_subcode:
-                    full_error += f", SubCode: {error_subcode}"
-                full_error += ")"
-                
-                _logger.error("Erreur API WhatsApp : %s - Réponse complète: %s", full_error, response.text)
-                return None, None, response.text, full_error
-            
-            # Extrait le message_id et les contacts selon le format de réponse Meta
-            # Format attendu : {"messaging_product": "whatsapp", "contacts": [...], "messages": [{"id": "..."}]}
-            message_id = None
-            contacts_data = []
-            
-            try:
-                messages = data.get("messages", [])
-                if messages:
-                    message_id = messages[0].get("id")
-                contacts_data = data.get("contacts", [])
-            except Exception:
-                pass
-
-            return data, message_id, response.text, None
-            
+            data, message_id, raw_response, error_message, retryable = self._parse_whatsapp_response(response)
+            failed = retryable or response.status_code >= 500
+            if retryable:
+                retry_after = response.headers.get("Retry-After")
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            retryable = _request_not_sent(e)
+            if retryable:
+                _logger.warning("Connexion à l'API WhatsApp impossible : %s", e)
+                error_message = f"Erreur de connexion : {str(e)}"
+            else:
+                # La requête a pu être reçue par Meta : la renvoyer risquerait un doublon
+                _logger.warning("Réponse de l'API WhatsApp non reçue, envoi non renvoyé : %s", e)
+                error_message = f"Réponse non reçue, le message a pu être envoyé (vérifier avant de renvoyer) : {str(e)}"
+            data, message_id, raw_response, failed = None, None, str(e), True
         except requests.exceptions.RequestException as e:
             error_msg = f"Erreur de connexion : {str(e)}"
             _logger.exception("Erreur en envoyant une requête WhatsApp : %s", e)
+            # Erreur non liée à la disponibilité de Meta : ne compte pas comme un échec
+            breaker.record_success()
             return None, None, str(e), error_msg
         except Exception as e:
             error_msg = f"Erreur inattendue : {str(e)}"
             _logger.exception("Erreur inattendue lors de l'envoi WhatsApp : %s", e)
+            breaker.record_success()
             return None, None, str(e), error_msg
 
+        if not failed:
+            breaker.record_success()
+            return data, message_id, raw_response, error_message
+
+        if breaker.record_failure():
+            _logger.error("Disjoncteur WhatsApp ouvert pour %s après %d échecs temporaires consécutifs",
+                          self.name, self._BREAKER_FAILURE_THRESHOLD)
+        if retryable:
+            error_message = self._schedule_resend(payload, error_message, _parse_retry_after(retry_after))
+        return data, message_id, raw_response, error_message
+
+    def _schedule_resend(self, payload, error_message, delay=None):
+        """Met en file d'attente le renvoi différé d'une requête que Meta n'a pas acceptée.
+
+        Dans une tâche de la file d'attente, lève WhatsappTemporaryError : la
+        tâche elle-même est reprogrammée (pas de renvoi séparé en double).
+
+        Sinon la tâche de renvoi est créée dans la transaction de l'appelant,
+        comme toute tâche de la file : si l'opération est annulée (erreur
+        levée, webhook rejoué puis rollback), le renvoi l'est aussi. Les
+        tentatives suivantes sont celles de la tâche (whatsapp.queue._run).
+
+        Args:
+            delay: Délai indiqué par Meta ou le limiteur, en secondes
+                (délai de base de la file d'attente s'il est absent)
+
+        Returns:
+            str: message d'erreur, complété du délai du renvoi programmé
+        """
+        self.ensure_one()
+        if self.env.context.get("whatsapp_queue_job"):
+            raise WhatsappTemporaryError(error_message, retry_in=delay)
+        Queue = self.env["whatsapp.queue"]
+        delay = int(min(delay or Queue._RETRY_DELAY_BASE, Queue._RETRY_DELAY_MAX)) + 1
+        to_phone = payload.get("to")
+        Queue.enqueue(
+            self,
+            "_whatsapp_job_resend_message",
+            payload,
+            name=f"Renvoi WhatsApp vers {to_phone}",
+            lock_key=lambda config: to_phone,
+            delay=delay,
+        )
+        _logger.info("Renvoi WhatsApp vers %s programmé dans %d s", to_phone, delay)
+        return f"{error_message} ; nouvel essai programmé dans {delay} s si l'opération est validée"
+
+    def _whatsapp_job_resend_message(self, payload):
+        """Tâche de file d'attente : renvoie une requête refusée et enregistre le message sortant.
+
+        Un nouveau refus temporaire lève WhatsappTemporaryError (voir
+        _schedule_resend) : la file reprogramme la tâche ou la passe en échec.
+        """
+        self.ensure_one()
+        data, message_id, raw_response, error_message = self._send_whatsapp_request(payload)
+
+        message_type = payload.get("type") or "unknown"
+        part = payload.get(message_type) or {}
+        if message_type == "text":
+            content = part.get("body")
+        elif message_type == "interactive":
+            content = (part.get("body") or {}).get("text")
+        elif message_type == "template":
+            content = f"Template: {part.get('name')}"
+        else:
+            content = part.get("caption")
+        if message_type not in dict(self.env["whatsapp.message"]._fields["message_type"].selection):
+            message_type = "unknown"
+
+        self.env["whatsapp.message"].create({
+            "config_id": self.id,
+            "direction": "out",
+            "wa_message_id": message_id,
+            "phone": payload.get("to"),
+            "content": content or "",
+            "message_type": message_type,
+            "status": "sent" if message_id and not error_message else "error",
+            "wa_status": error_message or "sent",
+            "raw_payload": json.dumps(payload),
+            "raw_response": raw_response or "",
+        })
+
+    def _get_rate_limit_buckets(self, to_phone):
+        """Seaux à jetons à consommer pour un envoi : numéro d'envoi et paire numéro/destinataire"""
+        self.ensure_one()
+        buckets = [(f"number:{self.phone_number_id}", self.throughput_limit, self.throughput_limit)]
+        if to_phone:
+            buckets.append((
+                f"pair:{self.phone_number_id}:{to_phone}",
+                1.0 / self._PAIR_RATE_INTERVAL,
+                self._PAIR_RATE_BURST,
+            ))
+        return buckets
+
+    def _parse_whatsapp_response(self, response):
+        """Analyse la réponse de l'API Meta.
+
+        Returns:
+            tuple: (data, message_id, raw_response, error_message, retryable) ;
+            retryable indique un refus de Meta qui peut être renvoyé sans doublon
+        """
+        # Parse la réponse
+        try:
+            data = response.json()
+        except (json.JSONDecodeError, ValueError):
+            data = {"error": {"message": "Réponse invalide de l'API"}}
+
+        # Vérifie les erreurs dans la réponse
+        if response.status_code != 200 or data.get("error"):
+            error_info = data.get("error", {})
+            error_message = error_info.get("message", f"Erreur HTTP {response.status_code}")
+            error_type = error_info.get("type", "Unknown")
+            error_code = error_info.get("code", response.status_code)
+            error_subcode = error_info.get("error_subcode")
+            # Refus explicite (limite de débit) : le message n'a pas été accepté, le renvoi est sans risque
+            retryable = response.status_code == 429 or error_code in self._RETRYABLE_ERROR_CODES
+            
+            # Messages d'erreur spécifiques selon le code
+            if error_code == 131047:
+                error_message = "Le numéro de téléphone n'est pas un numéro WhatsApp valide ou n'est pas inscrit sur WhatsApp"
+            elif error_code == 131026:
+                error_message = "Fenêtre de 24h expirée : Vous ne pouvez envoyer des messages texte que dans les 24h après le dernier message du client. Utilisez un template WhatsApp."
+            elif error_code == 131031:
+                error_message = "Le numéro de téléphone n'est pas autorisé. Vérifiez qu'il est dans votre liste de numéros test (mode développement)"
+            elif error_code == 190:
+                error_message = "Token d'accès invalide ou expiré. Vérifiez votre access_token"
+            elif error_code == 100:
+                error_message = "Paramètres invalides. Vérifiez le format du numéro de téléphone"
+            
+            full_error = f"[{error_type}] {error_message} (Code: {error_code}"
+            if error_subcode:
+                full_error += f", SubCode: {error_subcode}"
+            full_error += ")"
+            
+            _logger.error("Erreur API WhatsApp : %s - Réponse complète: %s", full_error, response.text)
+            return None, None, response.text, full_error, retryable
+        
+        # Extrait le message_id selon le format de réponse Meta
+        # Format attendu : {"messaging_product": "whatsapp", "contacts": [...], "messages": [{"id": "..."}]}
+        message_id = None
+        try:
+            messages = data.get("messages", [])
+            if messages:
+                message_id = messages[0].get("id")
+        except Exception:
+            pass
+
+        return data, message_id, response.text, None, False
+
     # ---------------------------------------------------------------------
     # Envoi de messages : texte, média, localisation, template
     # ---------------------------------------------------------------------
@@ -297,21 +815,9 @@ class WhatsappConfig(models.Model):
         if not phone:
             raise ValidationError(_("Numéro de téléphone manquant."))
         
-        # Nettoie le numéro
-        phone = phone.replace(' ', '').replace('-', '').replace('.', '').replace('(', '').replace(')', '')
-        
-        # Format international
-        if not phone.startswith('+'):
-            if phone.startswith('0'):
-                # Utilise l'indicatif du pays du partenaire si disponible, sinon Sénégal (+221) par défaut
-                country_code = '+221'
-                if partner and partner.country_id and partner.country_id.phone_code:
-                    raw = str(partner.country_id.phone_code).strip().lstrip('+')
-                    if raw.isdigit():
-                        country_code = '+' + raw
-                phone = country_code + phone[1:]
-            else:
-                phone = '+' + phone
+        # Format international, identique aux conversations et aux verrous par numéro
+        # (indicatif du pays du partenaire pour un numéro national, Sénégal +221 par défaut)
+        phone = self.env['whatsapp.message']._normalize_phone(phone, partner=partner) or ''
         
         # Vérifie que c'est un numéro valide (au moins 9 chiffres après le +, ex. +221771234567)
         digits_only = phone[1:].lstrip('+')
@@ -324,6 +830,49 @@ class WhatsappConfig(models.Model):
         
         return phone
 
+    def _is_service_window_open(self, to_phone):
+        """Indique si le client a écrit à ce numéro dans les dernières 24h (numéro déjà normalisé)"""
+        self.ensure_one()
+        if not self.check_service_window:
+            return True
+        last_inbound_at = self.env['whatsapp.conversation']._get_last_inbound_at(
+            to_phone, self.company_id.id, config_id=self.id
+        )
+        return bool(last_inbound_at) and fields.Datetime.now() - last_inbound_at < timedelta(hours=24)
+
+    def _send_outside_service_window(self, to_phone, body_text):
+        """Fenêtre de 24h fermée : envoie le texte via le template de secours au lieu d'un appel voué à l'échec"""
+        self.ensure_one()
+        template = self.service_window_template_id or self.template_invoice_id
+        if not template or not template.wa_name:
+            raise ValidationError(_(
+                "Fenêtre de 24h fermée pour %s : le client n'a pas écrit depuis plus de 24h. "
+                "Configurez un template hors fenêtre 24h ou envoyez un template WhatsApp."
+            ) % to_phone)
+        _logger.info("Fenêtre de 24h fermée pour %s : envoi via le template %s", to_phone, template.wa_name)
+        return self.send_template_message(
+            to_phone=to_phone,
+            template=template,
+            components=[{
+                "type": "body",
+                "parameters": [{"type": "text", "text": body_text}],
+            }],
+        )
+
+    def _send_media_outside_service_window(self, to_phone, media_label, link=None, caption=None):
+        """Fenêtre de 24h fermée : Meta rejetterait aussi les médias (erreur 131026).
+
+        Un média accessible par lien est transmis en texte (légende + lien) via
+        le template de secours ; un média uploadé (media id) ne peut pas l'être.
+        """
+        self.ensure_one()
+        if link:
+            return self._send_outside_service_window(to_phone, "\n".join(filter(None, [caption, link])))
+        raise ValidationError(_(
+            "Fenêtre de 24h fermée pour %s : le client n'a pas écrit depuis plus de 24h, "
+            "%s ne peut pas être envoyé(e). Envoyez un template WhatsApp."
+        ) % (to_phone, media_label))
+
     def send_text_message(self, to_phone, body_text, preview_url=False, recipient_type="individual"):
         """
         Envoie un message texte simple.
@@ -339,6 +888,10 @@ class WhatsappConfig(models.Model):
         
         # Valide et nettoie le numéro
         to_phone = self._validate_phone_number(to_phone)
+
+        # Hors fenêtre de 24h, Meta rejetterait le message (erreur 131026)
+        if not self._is_service_window_open(to_phone):
+            return self._send_outside_service_window(to_phone, body_text)
         
         payload = {
             "messaging_product": "whatsapp",
@@ -423,6 +976,10 @@ class WhatsappConfig(models.Model):
         
         if len(buttons) > 3:
             raise ValidationError(_("Un message interactif ne peut contenir que 3 boutons maximum."))
+
+        # Hors fenêtre de 24h, seul le texte peut être transmis (via template)
+        if not self._is_service_window_open(to_phone):
+            return self._send_outside_service_window(to_phone, body_text)
         
         payload = {
             "messaging_product": "whatsapp",
@@ -473,13 +1030,97 @@ class WhatsappConfig(models.Model):
             "error": error_message
         }
 
-    def send_image_message(self, to_phone, image_id=None, image_link=None, caption=None):
+    def send_list_message(self, to_phone, body_text, button_text, sections, recipient_type="individual"):
+        """
+        Envoie un message interactif de type liste (jusqu'à 10 options).
+
+        Args:
+            to_phone: Numéro de téléphone destinataire
+            body_text: Texte du message
+            button_text: Texte du bouton qui ouvre la liste (max 20 caractères)
+            sections: Liste de sections
+                Exemple:
+                [
+                    {"title": "Options", "rows": [
+                        {"id": "opt_1", "title": "Option 1", "description": "..."},
+                    ]},
+                ]
+            recipient_type: Type de destinataire ("individual" par défaut selon la doc Meta)
+        """
+        if not to_phone:
+            raise ValidationError(_("Numéro de téléphone destinataire manquant."))
+
+        # Valide et nettoie le numéro
+        to_phone = self._validate_phone_number(to_phone)
+
+        row_count = sum(len(section.get("rows", [])) for section in sections or [])
+        if row_count == 0:
+            raise ValidationError(_("Un message liste doit contenir au moins une option."))
+        if row_count > 10:
+            raise ValidationError(_("Un message liste ne peut contenir que 10 options maximum."))
+
+        # Hors fenêtre de 24h, seul le texte peut être transmis (via template)
+        if not self._is_service_window_open(to_phone):
+            return self._send_outside_service_window(to_phone, body_text)
+
+        payload = {
+            "messaging_product": "whatsapp",
+            "recipient_type": recipient_type,
+            "to": to_phone,
+            "type": "interactive",
+            "interactive": {
+                "type": "list",
+                "body": {
+                    "text": body_text
+                },
+                "action": {
+                    "button": button_text,
+                    "sections": sections
+                }
+            }
+        }
+
+        data, message_id, raw_response, error_message = self._send_whatsapp_request(payload)
+
+        status = "sent" if message_id and not error_message else "error"
+
+        message_record = self.env["whatsapp.message"].create({
+            "config_id": self.id,
+            "direction": "out",
+            "wa_message_id": message_id,
+            "phone": to_phone,
+            "content": body_text,
+            "message_type": "interactive",
+            "status": status,
+            "wa_status": error_message or "sent",
+            "raw_payload": json.dumps(payload),
+            "raw_response": raw_response or "",
+        })
+
+        if error_message:
+            raise ValidationError(_("Erreur lors de l'envoi du message liste : %s") % error_message)
+
+        return {
+            "success": True if message_id else False,
+            "message_id": message_id,
+            "message_record": message_record,
+            "error": error_message
+        }
+
+    def send_image_message(self, to_phone, image_id=None, image_link=None, caption=None, attachment=None):
         """
         image_id : ID média uploadé chez Meta
         image_link : URL publique d'une image (si pas d'ID)
+        attachment : ir.attachment uploadé chez Meta (une seule fois par fichier)
         """
         if not to_phone:
             raise ValidationError(_("Numéro de téléphone destinataire manquant."))
+        to_phone = self._validate_phone_number(to_phone)
+        # Vérifiée avant l'upload : hors fenêtre de 24h, le fichier ne serait pas envoyé
+        if not self._is_service_window_open(to_phone):
+            return self._send_media_outside_service_window(to_phone, _("l'image"), image_link, caption)
+        if attachment and not image_id and not image_link:
+            image_id = self.upload_media(attachment)
         if not image_id and not image_link:
             raise ValidationError(_("Vous devez fournir soit un image_id, soit un image_link."))
 
@@ -517,14 +1158,28 @@ class WhatsappConfig(models.Model):
         })
         
         if error_message:
+            if attachment and image_id and self._is_media_error(raw_response):
+                self.env["whatsapp.media.upload"]._forget(self, image_id)
             raise ValidationError(_("Erreur lors de l'envoi de l'image : %s") % error_message)
         
         return data
 
     def send_document_message(self, to_phone, document_id=None, document_link=None,
-                              filename=None, caption=None):
+                              filename=None, caption=None, attachment=None):
+        """
+        document_id : ID média uploadé chez Meta
+        document_link : URL publique du document (si pas d'ID)
+        attachment : ir.attachment uploadé chez Meta (une seule fois par fichier)
+        """
         if not to_phone:
             raise ValidationError(_("Numéro de téléphone destinataire manquant."))
+        to_phone = self._validate_phone_number(to_phone)
+        # Vérifiée avant l'upload : hors fenêtre de 24h, le fichier ne serait pas envoyé
+        if not self._is_service_window_open(to_phone):
+            return self._send_media_outside_service_window(to_phone, _("le document"), document_link, caption)
+        if attachment and not document_id and not document_link:
+            document_id = self.upload_media(attachment)
+            filename = filename or attachment.name
         if not document_id and not document_link:
             raise ValidationError(_("Vous devez fournir soit un document_id, soit un document_link."))
 
@@ -564,6 +1219,8 @@ class WhatsappConfig(models.Model):
         })
         
         if error_message:
+            if attachment and document_id and self._is_media_error(raw_response):
+                self.env["whatsapp.media.upload"]._forget(self, document_id)
             raise ValidationError(_("Erreur lors de l'envoi du document : %s") % error_message)
         
         return data
@@ -573,6 +1230,9 @@ class WhatsappConfig(models.Model):
             raise ValidationError(_("Numéro de téléphone destinataire manquant."))
         if not audio_id and not audio_link:
             raise ValidationError(_("Vous devez fournir soit un audio_id, soit un audio_link."))
+        to_phone = self._validate_phone_number(to_phone)
+        if not self._is_service_window_open(to_phone):
+            return self._send_media_outside_service_window(to_phone, _("l'audio"), audio_link)
 
         audio_payload = {}
         if audio_id:
@@ -614,6 +1274,9 @@ class WhatsappConfig(models.Model):
             raise ValidationError(_("Numéro de téléphone destinataire manquant."))
         if not video_id and not video_link:
             raise ValidationError(_("Vous devez fournir soit un video_id, soit un video_link."))
+        to_phone = self._validate_phone_number(to_phone)
+        if not self._is_service_window_open(to_phone):
+            return self._send_media_outside_service_window(to_phone, _("la vidéo"), video_link, caption)
 
         video_payload = {}
         if video_id:
@@ -659,6 +1322,10 @@ class WhatsappConfig(models.Model):
             raise ValidationError(_("Numéro de téléphone destinataire manquant."))
         if latitude is None or longitude is None:
             raise ValidationError(_("Latitude et longitude sont requis pour un message de localisation."))
+        to_phone = self._validate_phone_number(to_phone)
+        if not self._is_service_window_open(to_phone):
+            location_text = ", ".join(filter(None, [name, address, f"{latitude}, {longitude}"]))
+            return self._send_outside_service_window(to_phone, location_text)
 
         loc_payload = {
             "latitude": str(latitude),
@@ -700,10 +1367,12 @@ class WhatsappConfig(models.Model):
     def send_template_message(
         self,
         to_phone,
-        template_name,
-        language_code="fr",
+        template_name=None,
+        language_code=None,
         components=None,
         recipient_type="individual",
+        template=None,
+        values=None,
     ):
         """
         Envoie un message template WhatsApp selon la documentation Meta.
@@ -713,9 +1382,15 @@ class WhatsappConfig(models.Model):
         Args:
             to_phone: Numéro de téléphone destinataire (format international, ex: +33612345678)
             template_name: Nom du template tel que défini dans Meta (ex: "hello_world", "order_confirmation")
-            language_code: Code langue ('fr', 'fr_FR', 'en_US', etc.)
+            language_code: Code langue ('fr', 'fr_FR', 'en_US', etc. ; langue du template par défaut, sinon 'fr')
             components: Liste de composants pour les paramètres (body, header, buttons, footer)
             recipient_type: Type de destinataire ("individual" par défaut)
+            template: whatsapp.template (remplace template_name) ; son template compilé en cache
+                construit les components à partir de values
+            values: Valeurs des paramètres ({"body_1": ..., "header_1": ..., "button_0": ...})
+
+        Le payload est toujours construit par _CompiledTemplate.build_payload ;
+        des components fournis sont envoyés tels quels.
         
         Exemples de components selon la documentation Meta:
         
@@ -818,30 +1493,21 @@ class WhatsappConfig(models.Model):
         """
         if not to_phone:
             raise ValidationError(_("Numéro de téléphone destinataire manquant."))
+        if template:
+            template_name = template.wa_name
         if not template_name:
             raise ValidationError(_("Nom du template WhatsApp manquant."))
 
         # Valide et nettoie le numéro
         to_phone = self._validate_phone_number(to_phone)
 
-        # Construit le template selon la documentation Meta
-        template = {
-            "name": template_name,
-            "language": {"code": language_code},
-        }
-        
-        # Ajoute les composants si fournis
-        if components:
-            template["components"] = components
-
-        # Construit le payload selon la documentation Meta
-        payload = {
-            "messaging_product": "whatsapp",
-            "recipient_type": recipient_type,
-            "to": to_phone,
-            "type": "template",
-            "template": template,
-        }
+        # Payload selon la documentation Meta, construit par le template compilé
+        compiled = template._get_compiled() if template else _CompiledTemplate(template_name, language_code, {})
+        payload = compiled.build_payload(
+            to_phone, values, components=components, recipient_type=recipient_type, language_code=language_code
+        )
+        components = payload["template"].get("components")
+        language_code = payload["template"]["language"]["code"]
         
         data, message_id, raw_response, error_message = self._send_whatsapp_request(payload)
 
@@ -913,8 +1579,7 @@ class WhatsappConfig(models.Model):
             ]
             return self.send_template_message(
                 to_phone=phone,
-                template_name=self.template_invoice_id.wa_name,
-                language_code=self.template_invoice_id.language_code or "fr",
+                template=self.template_invoice_id,
                 components=components,
             )
         return self.send_text_to_partner(partner_id=partner_id, message_text=message_text)
@@ -928,7 +1593,7 @@ class WhatsappConfig(models.Model):
         self.ensure_one()
         try:
             # Test de connexion en récupérant les informations du compte
-            url = f"https://graph.facebook.com/v21.0/{self.phone_number_id}"
+            url = self._get_api_url(self.phone_number_id)
             headers = self._get_headers()
             
             response = requests.get(url, headers=headers, timeout=10)
@@ -954,66 +1619,139 @@ class WhatsappConfig(models.Model):
         """Synchronise les templates depuis l'API Meta"""
         self.ensure_one()
         try:
-            # Récupère les templates depuis l'API Meta
-            url = f"https://graph.facebook.com/v21.0/{self.whatsapp_business_account_id}/message_templates"
-            headers = self._get_headers()
-            
-            response = requests.get(url, headers=headers, timeout=30)
-            response.raise_for_status()
-            data = response.json()
-            
-            templates = data.get('data', [])
-            created_count = 0
-            updated_count = 0
-            
-            for template_data in templates:
-                wa_name = template_data.get('name', '')
-                status = template_data.get('status', 'UNKNOWN')
-                category = template_data.get('category', 'UNKNOWN')
-                
-                # Extrait le code langue
-                language = template_data.get('language', {})
-                if isinstance(language, dict):
-                    language_code = language.get('code', 'fr')
-                else:
-                    language_code = str(language) if language else 'fr'
-                
-                # Cherche le template existant
-                template = self.env['whatsapp.template'].search([
-                    ('wa_name', '=', wa_name)
-                ], limit=1)
-                
-                template_vals = {
-                    'wa_name': wa_name,
-                    'status': status,
-                    'category': category,
-                    'language_code': language_code,
-                }
-                
-                if template:
-                    template.write(template_vals)
-                    updated_count += 1
-                else:
-                    template_vals['name'] = wa_name
-                    self.env['whatsapp.template'].create(template_vals)
-                    created_count += 1
-            
-            message = _('Synchronisation terminée : %d créés, %d mis à jour') % (created_count, updated_count)
-            return {
-                'type': 'ir.actions.client',
-                'tag': 'display_notification',
-                'params': {
-                    'title': _('Succès'),
-                    'message': message,
-                    'type': 'success',
-                    'sticky': False,
-                }
-            }
+            result = self._sync_templates()
         except requests.exceptions.RequestException as e:
             raise ValidationError(_("Erreur lors de la synchronisation des templates : %s") % str(e))
         except Exception as e:
             raise ValidationError(_("Erreur lors de la synchronisation : %s") % str(e))
 
+        if result is None:
+            message = _('Templates déjà à jour (aucune modification côté Meta)')
+        else:
+            message = _('Synchronisation terminée : %d créés, %d mis à jour, %d inchangés') % result
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Succès'),
+                'message': message,
+                'type': 'success',
+                'sticky': False,
+            }
+        }
+
+    def _sync_templates(self):
+        """Synchronise les templates page par page (suit paging.next).
+
+        Les templates existants sont préchargés dans un dict (wa_name, langue).
+        Les pages sont d'abord toutes lues ; ensuite les nouveaux templates sont
+        créés en un seul create() et les lignes dont l'empreinte a changé sont
+        mises à jour en masse (_apply_template_updates). Si Meta répond 304 à
+        l'ETag de la dernière synchronisation, rien n'est relu.
+
+        Returns:
+            tuple (créés, mis à jour, inchangés), ou None si rien n'a changé côté Meta
+        """
+        self.ensure_one()
+        Template = self.env['whatsapp.template'].sudo()
+        templates = Template.search([])
+        existing = {(t.wa_name, t.language_code): t for t in templates}
+        # Templates saisis à la main (jamais synchronisés) : rapprochés par nom seul
+        unsynced_by_name = {t.wa_name: t for t in templates if not t.sync_hash}
+
+        url = self._get_api_url(f"{self.whatsapp_business_account_id}/message_templates")
+        params = {
+            "fields": "id,name,status,category,language,components",
+            "limit": self._TEMPLATE_SYNC_PAGE_SIZE,
+        }
+        # L'ETag ne couvre que la première page : il n'est utilisé que si tout tient sur une page
+        etag = self.template_sync_etag if templates else None
+        new_etag = False
+        unchanged_count = 0
+        vals_to_create = []
+        vals_to_write = {}
+        first_page = True
+
+        with requests.Session() as session:
+            session.headers.update(self._get_headers())
+            while url:
+                request_headers = {"If-None-Match": etag} if first_page and etag else None
+                response = session.get(url, params=params, headers=request_headers, timeout=30)
+                if first_page and response.status_code == 304:
+                    self.template_sync_date = fields.Datetime.now()
+                    _logger.info("Templates WhatsApp inchangés depuis la dernière synchronisation (ETag %s)", etag)
+                    return None
+                response.raise_for_status()
+                data = response.json()
+                next_url = (data.get('paging') or {}).get('next')
+                if first_page and not next_url:
+                    new_etag = response.headers.get('ETag') or False
+
+                for template_data in data.get('data', []):
+                    vals = Template._prepare_vals_from_meta(template_data)
+                    key = (vals['wa_name'], vals['language_code'])
+                    template = existing.get(key) or unsynced_by_name.pop(vals['wa_name'], None)
+                    if not template:
+                        vals['name'] = vals['wa_name']
+                        vals_to_create.append(vals)
+                    elif template.sync_hash != vals['sync_hash']:
+                        vals_to_write[template.id] = vals
+                    else:
+                        unchanged_count += 1
+
+                # L'URL "next" contient déjà tous les paramètres de requête
+                url = next_url
+                params = None
+                first_page = False
+
+        if vals_to_create:
+            Template.create(vals_to_create)
+        self._apply_template_updates(Template, vals_to_write)
+        created_count, updated_count = len(vals_to_create), len(vals_to_write)
+
+        self.write({
+            'template_sync_date': fields.Datetime.now(),
+            'template_sync_etag': new_etag,
+        })
+        _logger.info("Synchronisation des templates WhatsApp : %d créés, %d mis à jour, %d inchangés",
+                     created_count, updated_count, unchanged_count)
+        return created_count, updated_count, unchanged_count
+
+    def _apply_template_updates(self, Template, vals_by_id):
+        """Applique en masse les modifications des templates synchronisés.
+
+        Seuls les champs réellement modifiés sont écrits, avec un write() par
+        jeu de modifications identiques (ex: une vague d'approbations ne change
+        que le statut). Les empreintes, propres à chaque template, sont écrites
+        en une seule requête.
+
+        Args:
+            Template: modèle whatsapp.template (sudo)
+            vals_by_id: {template_id: valeurs issues de _prepare_vals_from_meta}
+        """
+        if not vals_by_id:
+            return
+        templates = Template.browse(list(vals_by_id))
+        grouped_changes = {}
+        for template in templates:
+            changes = {
+                name: value for name, value in vals_by_id[template.id].items()
+                if name != 'sync_hash' and (template[name] or False) != (value or False)
+            }
+            if changes:
+                grouped_changes.setdefault(json.dumps(changes, sort_keys=True), []).append(template.id)
+        for changes, template_ids in grouped_changes.items():
+            Template.browse(template_ids).write(json.loads(changes))
+
+        templates.flush_recordset(['sync_hash'])
+        self.env.cr.execute("""
+            UPDATE whatsapp_template t
+               SET sync_hash = v.sync_hash
+              FROM (SELECT unnest(%s::int[]) AS id, unnest(%s::varchar[]) AS sync_hash) v
+             WHERE t.id = v.id
+        """, (templates.ids, [vals_by_id[template_id]['sync_hash'] for template_id in templates.ids]))
+        templates.invalidate_recordset(['sync_hash'])
+
     def action_fetch_sent_messages(self):
         """Récupère les messages envoyés depuis l'API"""
         self.ensure_one()
@@ -1059,47 +1797,158 @@ class WhatsappConfig(models.Model):
             raise ValidationError(_("Erreur lors de la récupération des messages : %s") % str(e))
 
     def action_fetch_message_statuses(self):
-        """Récupère les statuts des messages depuis l'API Meta"""
+        """Lance la réconciliation des statuts en arrière-plan (file d'attente)"""
         self.ensure_one()
-        try:
-            # Récupère les messages avec statut en attente de mise à jour
-            messages_to_check = self.env['whatsapp.message'].search([
-                ('config_id', '=', self.id),
-                ('direction', '=', 'out'),
-                ('wa_message_id', '!=', False),
-                ('status', 'in', ['sent', 'delivered'])
-            ], limit=50)
-            
-            updated_count = 0
-            for message in messages_to_check:
-                try:
-                    # Vérifie le statut du message via l'API
-                    url = f"https://graph.facebook.com/v21.0/{message.wa_message_id}"
-                    headers = self._get_headers()
-                    
-                    response = requests.get(url, headers=headers, timeout=10)
-                    if response.status_code == 200:
-                        data = response.json()
-                        # Met à jour le statut si nécessaire
-                        # Note: L'API Meta ne retourne pas directement le statut, 
-                        # mais on peut utiliser le webhook pour cela
-                        updated_count += 1
-                except Exception:
-                    continue
-            
-            message = _('Vérification terminée : %d messages vérifiés') % updated_count
-            return {
-                'type': 'ir.actions.client',
-                'tag': 'display_notification',
-                'params': {
-                    'title': _('Succès'),
-                    'message': message,
-                    'type': 'success',
-                    'sticky': False,
-                }
+        self.env['whatsapp.queue'].enqueue(
+            self, '_whatsapp_job_reconcile_message_statuses',
+            name=_("Réconciliation des statuts WhatsApp (%s)") % self.name,
+        )
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Vérification lancée'),
+                'message': _('La réconciliation des statuts est en cours en arrière-plan.'),
+                'type': 'info',
+                'sticky': False,
             }
-        except Exception as e:
-            raise ValidationError(_("Erreur lors de la vérification des statuts : %s") % str(e))
+        }
+
+    def _whatsapp_job_reconcile_message_statuses(self, limit=5000, time_budget=None):
+        """Réconcilie les messages restés en 'sent' / 'delivered' (ex: webhook indisponible).
+
+        Les statuts sont interrogés par lots, en parallèle, sur une session HTTP
+        partagée ; le tout est borné par un budget de temps. Les mises à jour
+        sont appliquées en un write par statut.
+
+        Returns:
+            dict: {'checked': nombre interrogé, 'updated': nombre mis à jour}
+        """
+        self.ensure_one()
+        deadline = time.monotonic() + (time_budget or self._STATUS_POLL_TIME_BUDGET)
+        Message = self.env['whatsapp.message']
+        rows = Message.search_read([
+            ('config_id', '=', self.id),
+            ('direction', '=', 'out'),
+            ('wa_message_id', '!=', False),
+            ('status', 'in', ['sent', 'delivered'])
+        ], ['wa_message_id', 'status'], order='id', limit=limit)
+        if not rows:
+            return {'checked': 0, 'updated': 0}
+
+        base_url = self._get_api_url()
+        remote_statuses = {}
+        checked = 0
+        with requests.Session() as session:
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=self._STATUS_POLL_WORKERS)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update(self._get_headers())
+            with ThreadPoolExecutor(max_workers=self._STATUS_POLL_WORKERS) as executor:
+                for batch in split_every(self._STATUS_POLL_BATCH_SIZE, rows):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    futures = {
+                        executor.submit(_poll_message_status, session, f"{base_url}/{row['wa_message_id']}", min(10, remaining)): row
+                        for row in batch
+                    }
+                    pending = set(futures)
+                    while pending:
+                        remaining = deadline - time.monotonic()
+                        done, pending = wait(pending, timeout=max(remaining, 0), return_when=FIRST_COMPLETED)
+                        for future in done:
+                            checked += 1
+                            wa_status = future.result()
+                            if wa_status:
+                                remote_statuses[futures[future]['id']] = (futures[future]['status'], wa_status)
+                        if remaining <= 0:
+                            for future in pending:
+                                future.cancel()
+                            break
+                    if deadline - time.monotonic() <= 0:
+                        _logger.info("Réconciliation des statuts : budget de temps atteint après %d message(s)", checked)
+                        break
+
+        # Application en masse : un write par (statut interne, statut brut), sans jamais rétrograder
+        rank = {'sent': 1, 'delivered': 2, 'read': 3}
+        to_write = {}
+        for message_id, (current_status, wa_status) in remote_statuses.items():
+            new_status = Message._WA_STATUS_MAPPING.get(wa_status)
+            if not new_status or new_status == current_status:
+                continue
+            if new_status != 'error' and rank.get(new_status, 0) <= rank.get(current_status, 0):
+                continue
+            to_write.setdefault((new_status, wa_status), []).append(message_id)
+        updated = 0
+        for (new_status, wa_status), message_ids in to_write.items():
+            Message.browse(message_ids).write({'status': new_status, 'wa_status': wa_status})
+            updated += len(message_ids)
+
+        _logger.info("Réconciliation des statuts WhatsApp (%s) : %d interrogé(s), %d mis à jour", self.name, checked, updated)
+        return {'checked': checked, 'updated': updated}
+
+    def _diagnose_message_delivery(self, date_from, date_to):
+        """Diagnostic ensembliste des messages envoyés mais non délivrés sur une période.
+
+        Une seule requête SQL : le dernier message entrant de chaque numéro est
+        obtenu par LATERAL (index phone, direction, create_date) et l'erreur API
+        est extraite de la réponse brute par expression régulière, sans json.loads
+        (premier quantificateur non gourmand : la correspondance la plus courte,
+        donc la première clé "message" / "code" de l'objet error, est retenue).
+
+        Returns:
+            dict: checked, invalid_phone, window_closed, api_error, issues (liste de lignes)
+        """
+        self.ensure_one()
+        self.env['whatsapp.message'].flush_model(['config_id', 'direction', 'status', 'phone', 'message_type', 'raw_response'])
+        self.env.cr.execute(r"""
+            SELECT m.id,
+                   m.phone,
+                   m.message_type = 'text' AS is_text,
+                   m.create_date - li.create_date AS since_last_incoming,
+                   li.create_date IS NULL AS no_incoming,
+                   substring(m.raw_response FROM '"error"\s*?:\s*\{.*?"message"\s*:\s*"((?:[^"\\]|\\.)*)"') AS error_message,
+                   substring(m.raw_response FROM '"error"\s*?:\s*\{.*?"code"\s*:\s*(-?\d+)\D') AS error_code
+              FROM whatsapp_message m
+              LEFT JOIN LATERAL (
+                    SELECT i.create_date
+                      FROM whatsapp_message i
+                     WHERE i.phone = m.phone
+                       AND i.direction = 'in'
+                       AND i.create_date < m.create_date
+                  ORDER BY i.create_date DESC
+                     LIMIT 1
+              ) li ON m.message_type = 'text'
+             WHERE m.config_id = %s
+               AND m.direction = 'out'
+               AND m.status = 'sent'
+               AND m.create_date >= %s
+               AND m.create_date < %s
+          ORDER BY m.create_date DESC
+        """, (self.id, date_from, date_to))
+
+        report = {'checked': 0, 'invalid_phone': 0, 'window_closed': 0, 'api_error': 0, 'issues': []}
+        issues = report['issues']
+        for msg_id, phone, is_text, since_last_incoming, no_incoming, error_message, error_code in self.env.cr.fetchall():
+            report['checked'] += 1
+            # Vérifie le format du numéro
+            if not phone or not phone.startswith('+'):
+                report['invalid_phone'] += 1
+                issues.append(f"Message {msg_id}: Numéro invalide ({phone})")
+            # Message texte : soumis à la fenêtre de 24h
+            if is_text:
+                if no_incoming:
+                    report['window_closed'] += 1
+                    issues.append(f"Message {msg_id}: Aucun message entrant précédent - Utilisez un template WhatsApp")
+                elif since_last_incoming.total_seconds() > 86400:  # 24 heures
+                    report['window_closed'] += 1
+                    issues.append(f"Message {msg_id}: Fenêtre de 24h expirée (dernier message client: {since_last_incoming})")
+            # Erreur renvoyée par l'API
+            if error_message or error_code:
+                report['api_error'] += 1
+                issues.append(f"Message {msg_id}: Erreur API - {error_message} (Code: {error_code})")
+        return report
 
     def action_fetch_incoming_messages(self):
         """Récupère les messages entrants"""
@@ -1126,48 +1975,14 @@ class WhatsappConfig(models.Model):
         """Diagnostique pourquoi les messages ne sont pas reçus"""
         self.ensure_one()
         try:
-            # Récupère les messages envoyés récemment qui n'ont pas été lus
-            recent_messages = self.env['whatsapp.message'].search([
-                ('config_id', '=', self.id),
-                ('direction', '=', 'out'),
-                ('status', '=', 'sent'),
-                ('create_date', '>=', fields.Datetime.now() - timedelta(days=1))
-            ], limit=10, order='create_date desc')
-            
-            issues = []
-            for msg in recent_messages:
-                # Vérifie le format du numéro
-                if not msg.phone or not msg.phone.startswith('+'):
-                    issues.append(f"Message {msg.id}: Numéro invalide ({msg.phone})")
-                
-                # Vérifie si c'est un message texte (sujet à la fenêtre de 24h)
-                if msg.message_type == 'text':
-                    # Vérifie s'il y a eu un message entrant récent
-                    last_incoming = self.env['whatsapp.message'].search([
-                        ('phone', '=', msg.phone),
-                        ('direction', '=', 'in'),
-                        ('create_date', '<', msg.create_date)
-                    ], order='create_date desc', limit=1)
-                    
-                    if last_incoming:
-                        time_diff = msg.create_date - last_incoming.create_date
-                        if time_diff.total_seconds() > 86400:  # 24 heures
-                            issues.append(f"Message {msg.id}: Fenêtre de 24h expirée (dernier message client: {time_diff})")
-                    else:
-                        issues.append(f"Message {msg.id}: Aucun message entrant précédent - Utilisez un template WhatsApp")
-                
-                # Vérifie la réponse de l'API
-                if msg.raw_response:
-                    try:
-                        response_data = json.loads(msg.raw_response)
-                        if response_data.get('error'):
-                            error = response_data['error']
-                            issues.append(f"Message {msg.id}: Erreur API - {error.get('message')} (Code: {error.get('code')})")
-                    except:
-                        pass
+            now = fields.Datetime.now()
+            report = self._diagnose_message_delivery(now - timedelta(days=1), now)
+            issues = report['issues']
             
             if issues:
-                message = _("Problèmes détectés :\n\n") + "\n".join(issues[:10])
+                message = _("Problèmes détectés (%d message(s) analysé(s), %d numéro(s) invalide(s), %d fenêtre(s) de 24h fermée(s), %d erreur(s) API) :\n\n") % (
+                    report['checked'], report['invalid_phone'], report['window_closed'], report['api_error'],
+                ) + "\n".join(issues[:10])
             else:
                 message = _("Aucun problème détecté dans les messages récents.")
             
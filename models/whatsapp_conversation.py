@@ -1,5 +1,16 @@
 # whatsapp_business_api/models/whatsapp_conversation.py
-from odoo import models, fields, api
+from odoo import models, fields, api, tools
+from odoo.tools.sql import create_index
+from datetime import timedelta
+import logging
+import json
+
+_logger = logging.getLogger(__name__)
+
+
+class _ConversationNotFound(Exception):
+    """Levée par la recherche mise en cache : ormcache ne conserve pas les exceptions,
+    une absence n'est donc jamais mise en cache"""
 
 
 class WhatsappConversation(models.Model):
@@ -12,7 +23,14 @@ class WhatsappConversation(models.Model):
         required=True,
     )
     
-    phone = fields.Char("Numéro de téléphone")
+    phone = fields.Char("Numéro de téléphone", index=True)
+
+    company_id = fields.Many2one(
+        "res.company",
+        string="Société",
+        default=lambda self: self.env.company,
+        help="Société du numéro WhatsApp qui porte la conversation"
+    )
     
     contact_id = fields.Many2one(
         "res.partner",
@@ -31,9 +49,283 @@ class WhatsappConversation(models.Model):
         string="Nombre de messages",
         compute="_compute_message_count",
     )
+
+    last_inbound_at = fields.Datetime(
+        string="Dernier message du client",
+        index=True,
+        readonly=True,
+        help="Date du dernier message entrant ; les messages libres (hors template) ne sont acceptés par Meta que dans les 24h qui suivent"
+    )
+    last_inbound_config_id = fields.Many2one(
+        "whatsapp.config",
+        string="Numéro du dernier message client",
+        readonly=True,
+        ondelete="set null",
+        help="Configuration (numéro WhatsApp) qui a reçu le dernier message du client : la fenêtre de 24h "
+             "n'est ouverte que pour ce numéro, et les envois vers ce client partent de ce numéro"
+    )
+
+    # Session : étape en cours d'un échange en plusieurs messages (ex: saisie du mot de passe)
+    session_step = fields.Char(
+        string="Étape en cours",
+        help="Étape de l'échange en cours ; le prochain message entrant est routé vers le gestionnaire de cette étape"
+    )
+    session_expected_input = fields.Selection(
+        [
+            ("text", "Texte"),
+            ("password", "Mot de passe"),
+            ("button", "Clic sur un bouton"),
+        ],
+        string="Saisie attendue",
+    )
+    session_expires_at = fields.Datetime(
+        string="Expiration de la session",
+        help="Au-delà de cette date, l'étape en cours est ignorée"
+    )
+    session_data = fields.Text(
+        string="Données de session (JSON)",
+        help="Données propres à l'étape en cours"
+    )
+
+    # Durée de validité par défaut d'une étape (minutes)
+    _SESSION_TIMEOUT_MINUTES = 15
+
+    # Espace de noms des verrous consultatifs PostgreSQL par numéro ("WA")
+    _ADVISORY_LOCK_NAMESPACE = 0x5741
+
+    # Étape de session -> méthode de traitement du message entrant
+    _SESSION_HANDLERS = {
+        "password": "_session_handle_password",
+    }
     
     @api.depends('message_ids')
     def _compute_message_count(self):
         for rec in self:
             rec.message_count = len(rec.message_ids)
 
+    def write(self, vals):
+        # Seules les conversations déjà en cache peuvent devenir fausses : changement de numéro,
+        # de société, ou d'un contact existant. Une création, ou l'ajout d'un contact à une
+        # conversation qui n'en avait pas, n'invalide rien (les absences ne sont pas en cache) ;
+        # clear_caches() viderait le cache de tout le registre sur tous les workers.
+        invalidate = 'phone' in vals or 'company_id' in vals or (
+            'contact_id' in vals and any(conversation.contact_id for conversation in self)
+        )
+        res = super().write(vals)
+        if invalidate:
+            self.clear_caches()
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self.clear_caches()
+        return res
+
+    def init(self):
+        # Boîte de réception et recherche par numéro d'une société
+        create_index(self._cr, 'whatsapp_conversation_company_phone_idx', self._table,
+                     ['company_id', 'phone'])
+        create_index(self._cr, 'whatsapp_conversation_company_date_idx', self._table,
+                     ['company_id', 'create_date DESC'])
+
+    @api.model
+    def _lookup_conversation_id(self, phone, contact_id=None, company_id=None):
+        """Retourne l'ID de la conversation d'un numéro (normalisé) dans une société, ou None.
+
+        Seules les conversations trouvées sont mises en cache : la création
+        d'une conversation n'a donc aucun cache à invalider.
+        """
+        try:
+            return self._lookup_conversation_id_cached(phone, contact_id, company_id)
+        except _ConversationNotFound:
+            return None
+
+    @api.model
+    @tools.ormcache('phone', 'contact_id', 'company_id')
+    def _lookup_conversation_id_cached(self, phone, contact_id, company_id):
+        domain = [('phone', '=', phone)]
+        if company_id:
+            domain.append(('company_id', '=', company_id))
+        if contact_id:
+            domain.append(('contact_id', '=', contact_id))
+        conversation_id = self.sudo().search(domain, order='id', limit=1).id
+        if not conversation_id:
+            raise _ConversationNotFound()
+        return conversation_id
+
+    # ------------------------------------------------------------------
+    # Verrous par numéro (plusieurs workers HTTP / cron)
+    # ------------------------------------------------------------------
+    @api.model
+    def _try_lock_phone(self, phone):
+        """Tente de prendre le verrou transactionnel d'un numéro normalisé (libéré au commit)"""
+        self.env.cr.execute(
+            "SELECT pg_try_advisory_xact_lock(%s, hashtext(%s))",
+            (self._ADVISORY_LOCK_NAMESPACE, phone),
+        )
+        return self.env.cr.fetchone()[0]
+
+    @api.model
+    def _lock_phones(self, phones):
+        """Verrouille les numéros (normalisés) traités par la transaction courante.
+
+        Les verrous sont pris dans un ordre fixe pour éviter les interblocages
+        entre deux webhooks portant sur les mêmes numéros. Si un autre worker
+        traite déjà l'un d'eux, la transaction (en REPEATABLE READ) ne verrait
+        pas ses écritures : on laisse PostgreSQL lever lock_not_available pour
+        qu'Odoo rejoue la requête dans une nouvelle transaction.
+        """
+        for phone in sorted(set(filter(None, phones))):
+            if self._try_lock_phone(phone):
+                continue
+            _logger.info("Numéro %s en cours de traitement par un autre worker : requête rejouée", phone)
+            self.env.cr.execute("SET LOCAL lock_timeout = '1ms'")
+            self.env.cr.execute(
+                "SELECT pg_advisory_xact_lock(%s, hashtext(%s))",
+                (self._ADVISORY_LOCK_NAMESPACE, phone),
+            )
+            self.env.cr.execute("SET LOCAL lock_timeout = DEFAULT")
+
+    # ------------------------------------------------------------------
+    # Fenêtre de service client (24h)
+    # ------------------------------------------------------------------
+    def _touch_inbound(self, received_at=None, config=None):
+        """Enregistre la réception d'un message entrant par le numéro config (ne recule jamais la date)"""
+        received_at = received_at or fields.Datetime.now()
+        vals = {"last_inbound_at": received_at}
+        if config:
+            vals["last_inbound_config_id"] = config.id
+        self.filtered(
+            lambda c: not c.last_inbound_at or c.last_inbound_at < received_at
+        ).sudo().write(vals)
+
+    @api.model
+    def _get_last_inbound_at(self, phone, company_id=None, config_id=None):
+        """Date du dernier message entrant pour un numéro normalisé (toutes conversations de la société confondues).
+
+        Avec config_id, seul un dernier message reçu par ce numéro compte :
+        la fenêtre de 24h de Meta est propre à chaque numéro d'envoi.
+        """
+        if not phone:
+            return False
+        domain = [
+            ('phone', '=', phone),
+            ('last_inbound_at', '!=', False),
+        ]
+        if company_id:
+            domain.append(('company_id', '=', company_id))
+        conversation = self.sudo().search(domain, order='last_inbound_at desc', limit=1)
+        if config_id and conversation.last_inbound_config_id.id != config_id:
+            return False
+        return conversation.last_inbound_at
+
+    @api.model
+    def _get_last_inbound_config_id(self, phone, company_id, config_ids):
+        """Configuration, parmi config_ids, qui a reçu le dernier message du client (None pour un nouveau client)"""
+        if not phone:
+            return None
+        conversation = self.sudo().search([
+            ('phone', '=', phone),
+            ('company_id', '=', company_id),
+            ('last_inbound_config_id', 'in', list(config_ids)),
+        ], order='last_inbound_at desc', limit=1)
+        return conversation.last_inbound_config_id.id or None
+
+    # ------------------------------------------------------------------
+    # Session (machine à états des échanges en plusieurs messages)
+    # ------------------------------------------------------------------
+    def _set_session(self, step, expected_input="text", data=None, timeout_minutes=None):
+        """Place la conversation dans une étape ; le prochain message entrant lui sera routé"""
+        timeout = timeout_minutes or self._SESSION_TIMEOUT_MINUTES
+        self.sudo().write({
+            "session_step": step,
+            "session_expected_input": expected_input,
+            "session_expires_at": fields.Datetime.now() + timedelta(minutes=timeout),
+            "session_data": json.dumps(data) if data else False,
+        })
+
+    def _clear_session(self):
+        self.sudo().write({
+            "session_step": False,
+            "session_expected_input": False,
+            "session_expires_at": False,
+            "session_data": False,
+        })
+
+    def _get_session_step(self):
+        """Retourne l'étape en cours, ou None si aucune étape ou si elle a expiré"""
+        self.ensure_one()
+        if not self.session_step:
+            return None
+        if self.session_expires_at and self.session_expires_at < fields.Datetime.now():
+            _logger.info("Session '%s' expirée pour la conversation %s", self.session_step, self.id)
+            self._clear_session()
+            return None
+        return self.session_step
+
+    def _get_session_data(self):
+        self.ensure_one()
+        try:
+            return json.loads(self.session_data) if self.session_data else {}
+        except (ValueError, TypeError):
+            return {}
+
+    def _dispatch_session(self, message):
+        """Route le message entrant vers le gestionnaire de l'étape en cours.
+
+        Returns:
+            bool: True si le message a été traité par une étape de session
+        """
+        self.ensure_one()
+        step = self._get_session_step()
+        if not step:
+            return False
+        handler = self._SESSION_HANDLERS.get(step)
+        if not handler:
+            _logger.warning("Aucun gestionnaire pour l'étape de session '%s' (conversation %s)", step, self.id)
+            self._clear_session()
+            return False
+        getattr(self, handler)(message)
+        return True
+
+    def _session_handle_password(self, message):
+        """Enregistre le mot de passe envoyé par le client après le bouton 'Définir mot de passe'"""
+        partner = self.contact_id or message.contact_id
+        config = message.config_id or self.env['whatsapp.config'].get_active_config(
+            message.phone, company=self.company_id or None
+        )
+        new_password = (message.content or "").strip()
+        if not new_password:
+            # Mot de passe vide : on envoie un message d'erreur au client, la session reste ouverte
+            if config and message.phone:
+                error_msg = (
+                    "Le mot de passe envoyé est vide.\n\n"
+                    "Veuillez renvoyer un mot de passe valide (au moins quelques caractères)."
+                )
+                config.send_text_message(message.phone, error_msg)
+            return
+
+        self._clear_session()
+        if not partner:
+            _logger.warning("Mot de passe reçu sans partenaire associé (conversation %s)", self.id)
+            return
+        try:
+            had_password = bool(partner.password)
+            partner.sudo().write({'password': new_password})
+            if config and message.phone:
+                if had_password:
+                    confirm_msg = (
+                        "Votre mot de passe a été modifié avec succès.\n\n"
+                        "Vous pouvez maintenant vous connecter sur le portail Touba Sandaga avec ce nouveau mot de passe.\n\n"
+                        "Équipe CCTS"
+                    )
+                else:
+                    confirm_msg = (
+                        "Votre mot de passe a été enregistré.\n\n"
+                        "Vous pouvez maintenant vous connecter sur le portail Touba Sandaga avec ce mot de passe.\n\n"
+                        "Équipe CCTS"
+                    )
+                config.send_text_message(message.phone, confirm_msg)
+            _logger.info("Mot de passe mis à jour via WhatsApp pour le partenaire %s (ID: %s)", partner.name, partner.id)
+        except Exception as e:
+            _logger.exception("Erreur lors de l'enregistrement du mot de passe via WhatsApp pour le partenaire %s : %s", partner, str(e))
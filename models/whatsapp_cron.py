@@ -13,33 +13,50 @@ class WhatsappCron(models.Model):
 
     @api.model
     def send_unpaid_invoice_reminders(self):
-        """Cron job pour envoyer des rappels pour les factures impayées"""
-        # Récupère la configuration WhatsApp active
-        config = self.env['whatsapp.config'].search([('is_active', '=', True)], limit=1)
-        
-        if not config or not config.auto_send_unpaid_invoices:
-            _logger.info("Envoi automatique de factures impayées désactivé ou configuration non trouvée")
-            return
-        
-        # Calcule la date limite (nombre de jours après l'échéance)
-        days_after_due = config.unpaid_invoice_days or 7
-        date_limit = fields.Date.today() - timedelta(days=days_after_due)
-        
-        # Cherche les factures impayées dont l'échéance est dépassée depuis X jours
-        invoices = self.env['account.move'].search([
-            ('move_type', '=', 'out_invoice'),
-            ('state', '=', 'posted'),
-            ('payment_state', 'in', ['not_paid', 'partial']),
-            ('amount_residual', '>', 0),
-            ('x_whatsapp_unpaid_reminder_sent', '=', False),
-            ('invoice_date_due', '<=', date_limit),
+        """Cron job pour envoyer des rappels pour les factures impayées (une passe par société)"""
+        Config = self.env['whatsapp.config']
+        for company in Config.search([('is_active', '=', True)]).company_id:
+            # Configuration active de la société : ses paramètres s'appliquent à ses factures
+            config = Config.get_active_config(company=company)
+            if not config.auto_send_unpaid_invoices:
+                _logger.info("Envoi automatique de factures impayées désactivé pour la société %s", company.name)
+                continue
+
+            # Calcule la date limite (nombre de jours après l'échéance)
+            days_after_due = config.unpaid_invoice_days or 7
+            date_limit = fields.Date.today() - timedelta(days=days_after_due)
+
+            # Cherche les factures impayées dont l'échéance est dépassée depuis X jours
+            invoices = self.env['account.move'].search([
+                ('company_id', '=', company.id),
+                ('move_type', '=', 'out_invoice'),
+                ('state', '=', 'posted'),
+                ('payment_state', 'in', ['not_paid', 'partial']),
+                ('amount_residual', '>', 0),
+                ('x_whatsapp_unpaid_reminder_sent', '=', False),
+                ('invoice_date_due', '<=', date_limit),
+            ])
+
+            _logger.info("Trouvé %s facture(s) impayée(s) à traiter pour la société %s", len(invoices), company.name)
+
+            for invoice in invoices:
+                try:
+                    invoice._send_unpaid_invoice_reminder()
+                except Exception as e:
+                    _logger.warning("Rappel WhatsApp facture %s non envoyé (non bloquant): %s", invoice.name, str(e))
+
+    @api.model
+    def sync_templates(self):
+        """Cron job pour synchroniser les templates (et leur structure) depuis l'API Meta"""
+        configs = self.env['whatsapp.config'].search([
+            ('is_active', '=', True),
+            ('whatsapp_business_account_id', '!=', False),
+            ('access_token', '!=', False),
         ])
-        
-        _logger.info("Trouvé %s facture(s) impayée(s) à traiter", len(invoices))
-        
-        for invoice in invoices:
+        for config in configs:
             try:
-                invoice._send_unpaid_invoice_reminder()
+                result = config._sync_templates()
+                if result is None:
+                    _logger.info("Templates WhatsApp inchangés pour la configuration %s", config.name)
             except Exception as e:
-                _logger.warning("Rappel WhatsApp facture %s non envoyé (non bloquant): %s", invoice.name, str(e))
-
+                _logger.warning("Synchronisation des templates WhatsApp échouée pour %s (non bloquant): %s", config.name, str(e))
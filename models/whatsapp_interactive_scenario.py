@@ -31,45 +31,34 @@ class WhatsappInteractiveScenario(models.Model):
         help="Message à envoyer avec les boutons interactifs"
     )
 
-    # Boutons (jusqu'à 3 boutons selon l'API WhatsApp)
-    button_1_id = fields.Char(
-        string="ID Bouton 1",
-        help="ID unique du bouton (ex: btn_yes, btn_validate, etc.)"
-    )
-    button_1_title = fields.Char(
-        string="Titre Bouton 1",
-        help="Texte affiché sur le bouton (max 20 caractères)"
-    )
-    button_1_response = fields.Text(
-        string="Réponse automatique Bouton 1",
-        help="Message à envoyer automatiquement si ce bouton est cliqué"
-    )
-    button_1_send_interactive = fields.Boolean(
-        string="Bouton 1 : Envoyer un message interactif",
-        help="Si coché, la réponse sera un message interactif avec boutons"
+    # Type de message : boutons de réponse (max 3) ou liste (max 10 lignes)
+    message_type = fields.Selection(
+        [
+            ("button", "Boutons de réponse (max 3)"),
+            ("list", "Liste d'options (max 10)"),
+        ],
+        string="Type de message",
+        required=True,
+        default="button",
+        help="Les boutons de réponse sont limités à 3 par WhatsApp ; une liste permet jusqu'à 10 options"
     )
-    button_1_next_scenario_id = fields.Many2one(
-        'whatsapp.interactive.scenario',
-        string="Bouton 1 : Scénario suivant",
-        help="Scénario à exécuter après ce bouton (pour créer des conversations multi-étapes)"
+
+    list_button_text = fields.Char(
+        string="Texte du bouton de liste",
+        default="Voir les options",
+        help="Texte du bouton qui ouvre la liste (max 20 caractères)"
     )
 
-    button_2_id = fields.Char(string="ID Bouton 2")
-    button_2_title = fields.Char(string="Titre Bouton 2")
-    button_2_response = fields.Text(string="Réponse automatique Bouton 2")
-    button_2_send_interactive = fields.Boolean(string="Bouton 2 : Envoyer un message interactif")
-    button_2_next_scenario_id = fields.Many2one(
-        'whatsapp.interactive.scenario',
-        string="Bouton 2 : Scénario suivant"
+    list_section_title = fields.Char(
+        string="Titre de la section",
+        help="Titre affiché au-dessus des options de la liste (max 24 caractères, optionnel)"
     )
 
-    button_3_id = fields.Char(string="ID Bouton 3")
-    button_3_title = fields.Char(string="Titre Bouton 3")
-    button_3_response = fields.Text(string="Réponse automatique Bouton 3")
-    button_3_send_interactive = fields.Boolean(string="Bouton 3 : Envoyer un message interactif")
-    button_3_next_scenario_id = fields.Many2one(
-        'whatsapp.interactive.scenario',
-        string="Bouton 3 : Scénario suivant"
+    button_ids = fields.One2many(
+        'whatsapp.interactive.scenario.button',
+        'scenario_id',
+        string="Boutons / options",
+        copy=False,
     )
 
     # Configuration
@@ -79,87 +68,60 @@ class WhatsappInteractiveScenario(models.Model):
         help="Configuration à utiliser pour envoyer les messages"
     )
 
-    @api.constrains('button_1_id', 'button_2_id', 'button_3_id')
-    def _check_button_ids_unique(self):
-        """Vérifie que les IDs de boutons sont uniques"""
-        for record in self:
-            button_ids = []
-            if record.button_1_id:
-                if record.button_1_id in button_ids:
-                    raise ValidationError(_("Les IDs de boutons doivent être uniques."))
-                button_ids.append(record.button_1_id)
-            if record.button_2_id:
-                if record.button_2_id in button_ids:
-                    raise ValidationError(_("Les IDs de boutons doivent être uniques."))
-                button_ids.append(record.button_2_id)
-            if record.button_3_id:
-                if record.button_3_id in button_ids:
-                    raise ValidationError(_("Les IDs de boutons doivent être uniques."))
-                button_ids.append(record.button_3_id)
-
-    @api.constrains('button_1_title', 'button_2_title', 'button_3_title')
-    def _check_button_titles_length(self):
-        """Vérifie que les titres de boutons ne dépassent pas 20 caractères"""
+    @api.constrains('message_type', 'button_ids', 'list_button_text', 'list_section_title')
+    def _check_buttons(self):
+        """Vérifie le nombre de boutons selon le type de message"""
         for record in self:
-            if record.button_1_title and len(record.button_1_title) > 20:
-                raise ValidationError(_("Le titre du bouton 1 ne peut pas dépasser 20 caractères."))
-            if record.button_2_title and len(record.button_2_title) > 20:
-                raise ValidationError(_("Le titre du bouton 2 ne peut pas dépasser 20 caractères."))
-            if record.button_3_title and len(record.button_3_title) > 20:
-                raise ValidationError(_("Le titre du bouton 3 ne peut pas dépasser 20 caractères."))
+            max_buttons = 10 if record.message_type == "list" else 3
+            if len(record.button_ids) > max_buttons:
+                raise ValidationError(_("Le scénario '%s' ne peut pas contenir plus de %s boutons / options.") % (record.name, max_buttons))
+            if record.message_type == "list":
+                if record.list_button_text and len(record.list_button_text) > 20:
+                    raise ValidationError(_("Le texte du bouton de liste ne peut pas dépasser 20 caractères."))
+                if record.list_section_title and len(record.list_section_title) > 24:
+                    raise ValidationError(_("Le titre de la section ne peut pas dépasser 24 caractères."))
+            record.button_ids._check_title_length()
 
     def get_buttons(self):
-        """Retourne la liste des boutons configurés"""
+        """Retourne la liste des boutons configurés (format boutons de réponse)"""
         self.ensure_one()
-        buttons = []
-        
-        if self.button_1_id and self.button_1_title:
-            buttons.append({
-                "type": "reply",
-                "reply": {
-                    "id": self.button_1_id,
-                    "title": self.button_1_title
-                }
-            })
-        if self.button_2_id and self.button_2_title:
-            buttons.append({
-                "type": "reply",
-                "reply": {
-                    "id": self.button_2_id,
-                    "title": self.button_2_title
-                }
-            })
-        if self.button_3_id and self.button_3_title:
-            buttons.append({
-                "type": "reply",
-                "reply": {
-                    "id": self.button_3_id,
-                    "title": self.button_3_title
-                }
-            })
-        
-        return buttons
+        return [{
+            "type": "reply",
+            "reply": {
+                "id": button.button_id,
+                "title": button.title
+            }
+        } for button in self.button_ids]
+
+    def get_list_sections(self):
+        """Retourne les sections de la liste (format message liste)"""
+        self.ensure_one()
+        rows = []
+        for button in self.button_ids:
+            row = {"id": button.button_id, "title": button.title}
+            if button.description:
+                row["description"] = button.description
+            rows.append(row)
+        section = {"rows": rows}
+        if self.list_section_title:
+            section["title"] = self.list_section_title
+        return [section]
 
     def send_scenario(self, to_phone, contact_id=None):
         """Envoie le scénario (message initial avec boutons)"""
         self.ensure_one()
         
         if not self.config_id:
-            config = self.env['whatsapp.config'].get_active_config()
+            contact = self.env['res.partner'].browse(contact_id) if contact_id else None
+            config = self.env['whatsapp.config'].get_active_config(
+                to_phone, company=contact.company_id if contact and contact.company_id else None
+            )
             if not config:
                 raise ValidationError(_("Aucune configuration WhatsApp active trouvée."))
         else:
             config = self.config_id
 
-        buttons = self.get_buttons()
-        if not buttons:
-            raise ValidationError(_("Aucun bouton configuré pour ce scénario."))
-
-        result = config.send_interactive_message(
-            to_phone=to_phone,
-            body_text=self.initial_message,
-            buttons=buttons
-        )
+        result = self._send_options(config, to_phone, self.initial_message)
 
         # Crée ou met à jour la conversation
         if contact_id:
@@ -184,60 +146,33 @@ class WhatsappInteractiveScenario(models.Model):
 
         return result
 
-    def handle_button_click(self, button_id, message, contact=None):
-        """Gère le clic sur un bouton et envoie la réponse appropriée"""
+    def _send_options(self, config, to_phone, body_text):
+        """Envoie un texte accompagné des boutons (ou de la liste d'options) du scénario"""
         self.ensure_one()
-        
-        config = self.config_id or self.env['whatsapp.config'].get_active_config()
-        if not config:
-            _logger.warning("Aucune configuration WhatsApp active pour gérer le clic sur le bouton %s", button_id)
-            return {"success": False, "message": "Configuration WhatsApp non trouvée"}
-
-        phone = message.phone
-        if contact and contact.phone:
-            phone = contact.phone
-
-        # Détermine quel bouton a été cliqué et quelle réponse envoyer
-        response_text = None
-        next_scenario = None
-        send_interactive = False
-
-        if button_id == self.button_1_id:
-            response_text = self.button_1_response
-            send_interactive = self.button_1_send_interactive
-            next_scenario = self.button_1_next_scenario_id
-        elif button_id == self.button_2_id:
-            response_text = self.button_2_response
-            send_interactive = self.button_2_send_interactive
-            next_scenario = self.button_2_next_scenario_id
-        elif button_id == self.button_3_id:
-            response_text = self.button_3_response
-            send_interactive = self.button_3_send_interactive
-            next_scenario = self.button_3_next_scenario_id
-
-        if not response_text and not next_scenario:
-            _logger.warning("Aucune réponse configurée pour le bouton %s dans le scénario %s", button_id, self.name)
-            return {"success": False, "message": "Aucune réponse configurée pour ce bouton"}
+        if not self.button_ids:
+            raise ValidationError(_("Aucun bouton configuré pour ce scénario."))
 
-        try:
-            # Si un scénario suivant est défini, l'envoyer
-            if next_scenario:
-                return next_scenario.send_scenario(to_phone=phone, contact_id=contact.id if contact else None)
-            
-            # Sinon, envoyer la réponse textuelle ou interactive
-            if send_interactive and response_text:
-                # Pour l'instant, on envoie juste le texte
-                # TODO: Permettre de définir des boutons dans la réponse
-                result = config.send_text_message(to_phone=phone, body_text=response_text)
-            elif response_text:
-                result = config.send_text_message(to_phone=phone, body_text=response_text)
-            else:
-                return {"success": False, "message": "Aucune réponse configurée"}
+        if self.message_type == "list":
+            return config.send_list_message(
+                to_phone=to_phone,
+                body_text=body_text,
+                button_text=self.list_button_text or "Voir les options",
+                sections=self.get_list_sections()
+            )
+        return config.send_interactive_message(
+            to_phone=to_phone,
+            body_text=body_text,
+            buttons=self.get_buttons()
+        )
 
-            return {"success": True, "message": "Réponse envoyée avec succès", "result": result}
-        except Exception as e:
-            _logger.exception("Erreur lors de l'envoi de la réponse pour le bouton %s : %s", button_id, e)
-            return {"success": False, "message": str(e)}
+    def handle_button_click(self, button_id, message, contact=None):
+        """Gère le clic sur un bouton et envoie la réponse appropriée"""
+        self.ensure_one()
+        button = self.button_ids.filtered(lambda b: b.button_id == button_id)[:1]
+        if not button:
+            _logger.warning("Bouton %s introuvable dans le scénario %s", button_id, self.name)
+            return {"success": False, "message": "Bouton introuvable dans ce scénario"}
+        return button.handle_click(message, contact)
 
     def send_test_scenario(self):
         """Ouvre un wizard pour envoyer un test du scénario"""
@@ -254,3 +189,118 @@ class WhatsappInteractiveScenario(models.Model):
             }
         }
 
+
+
+class WhatsappInteractiveScenarioButton(models.Model):
+    _name = "whatsapp.interactive.scenario.button"
+    _description = "Bouton / option d'un scénario interactif WhatsApp"
+    _order = "scenario_id, sequence, id"
+    _rec_name = "title"
+
+    scenario_id = fields.Many2one(
+        'whatsapp.interactive.scenario',
+        string="Scénario",
+        required=True,
+        ondelete="cascade",
+        index=True,
+    )
+
+    sequence = fields.Integer(string="Séquence", default=10)
+
+    button_id = fields.Char(
+        string="ID du bouton",
+        required=True,
+        index=True,
+        help="ID unique du bouton (ex: btn_yes, btn_validate, etc.), utilisé pour identifier le clic"
+    )
+
+    title = fields.Char(
+        string="Titre",
+        required=True,
+        help="Texte affiché (max 20 caractères pour un bouton, 24 pour une option de liste)"
+    )
+
+    description = fields.Char(
+        string="Description",
+        help="Description affichée sous l'option (listes uniquement, max 72 caractères)"
+    )
+
+    response = fields.Text(
+        string="Réponse automatique",
+        help="Message à envoyer automatiquement si ce bouton est cliqué"
+    )
+
+    send_interactive = fields.Boolean(
+        string="Envoyer un message interactif",
+        help="Si coché, la réponse est envoyée avec les boutons / options du scénario : le client peut faire un autre choix"
+    )
+
+    next_scenario_id = fields.Many2one(
+        'whatsapp.interactive.scenario',
+        string="Scénario suivant",
+        ondelete="set null",
+        help="Scénario à exécuter après ce bouton (pour créer des conversations multi-étapes)"
+    )
+
+    _sql_constraints = [
+        ('button_id_unique', 'unique(button_id)', "L'ID du bouton doit être unique (tous scénarios confondus)."),
+    ]
+
+    def _check_title_length(self):
+        """Vérifie la longueur des titres selon le type de message du scénario"""
+        for button in self:
+            is_list = button.scenario_id.message_type == "list"
+            max_length = 24 if is_list else 20
+            if button.title and len(button.title) > max_length:
+                raise ValidationError(_("Le titre '%s' ne peut pas dépasser %s caractères.") % (button.title, max_length))
+            if button.description and len(button.description) > 72:
+                raise ValidationError(_("La description de l'option '%s' ne peut pas dépasser 72 caractères.") % button.title)
+
+    @api.constrains('title', 'description')
+    def _check_title(self):
+        self._check_title_length()
+
+    @api.model
+    def _find_by_button_id(self, button_id):
+        """Résout un clic en une recherche indexée sur button_id (scénarios actifs uniquement)"""
+        if not button_id:
+            return self.browse()
+        return self.sudo().search([
+            ('button_id', '=', button_id),
+            ('scenario_id.active', '=', True),
+        ], limit=1)
+
+    def handle_click(self, message, contact=None):
+        """Envoie la réponse associée au bouton ou le scénario suivant"""
+        self.ensure_one()
+        scenario = self.scenario_id
+
+        config = scenario.config_id or self.env['whatsapp.config'].get_active_config(
+            message.phone, company=message.conversation_id.company_id or None
+        )
+        if not config:
+            _logger.warning("Aucune configuration WhatsApp active pour gérer le clic sur le bouton %s", self.button_id)
+            return {"success": False, "message": "Configuration WhatsApp non trouvée"}
+
+        phone = message.phone
+        if contact and contact.phone:
+            phone = contact.phone
+
+        if not self.response and not self.next_scenario_id:
+            _logger.warning("Aucune réponse configurée pour le bouton %s dans le scénario %s", self.button_id, scenario.name)
+            return {"success": False, "message": "Aucune réponse configurée pour ce bouton"}
+
+        try:
+            # Si un scénario suivant est défini, l'envoyer
+            if self.next_scenario_id:
+                return self.next_scenario_id.send_scenario(to_phone=phone, contact_id=contact.id if contact else None)
+
+            # Sinon, envoyer la réponse, avec les boutons du scénario si demandé
+            if self.send_interactive:
+                result = scenario._send_options(config, phone, self.response)
+            else:
+                result = config.send_text_message(to_phone=phone, body_text=self.response)
+            return {"success": True, "message": "Réponse envoyée avec succès", "result": result}
+        except Exception as e:
+            _logger.exception("Erreur lors de l'envoi de la réponse pour le bouton %s : %s", self.button_id, e)
+            return {"success": False, "message": str(e)}
@@ -0,0 +1,230 @@
+# whatsapp_business_api/models/whatsapp_keyword_trigger.py
+from odoo import models, fields, api, tools, _
+from odoo.exceptions import ValidationError
+from collections import deque
+import logging
+import re
+
+_logger = logging.getLogger(__name__)
+
+
+class _KeywordAutomaton:
+    """Automate Aho-Corasick : trouve toutes les occurrences de tous les mots-clés en un seul parcours du texte."""
+
+    def __init__(self, keywords):
+        """keywords : itérable de (mot_clé, trigger_id)"""
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        for keyword, trigger_id in keywords:
+            state = 0
+            for char in keyword:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                    self._goto[state][char] = next_state
+                state = next_state
+            self._out[state].append((len(keyword), trigger_id))
+
+        # Liens d'échec calculés en largeur
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                fail_state = self._goto[fallback].get(char, 0)
+                self._fail[next_state] = fail_state if fail_state != next_state else 0
+                self._out[next_state] = self._out[next_state] + self._out[self._fail[next_state]]
+
+    def iter_matches(self, text):
+        """Génère (début, fin, trigger_id) pour chaque occurrence, fin exclue"""
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for length, trigger_id in self._out[state]:
+                yield index + 1 - length, index + 1, trigger_id
+
+
+class WhatsappKeywordTrigger(models.Model):
+    _name = "whatsapp.keyword.trigger"
+    _description = "Déclencheur par mot-clé sur les messages texte entrants"
+    _order = "sequence, id"
+
+    name = fields.Char(string="Nom", required=True)
+
+    active = fields.Boolean(string="Actif", default=True)
+
+    sequence = fields.Integer(
+        string="Séquence",
+        default=10,
+        help="Ordre d'exécution lorsque plusieurs déclencheurs correspondent au même message"
+    )
+
+    match_type = fields.Selection(
+        [
+            ("contains", "Contient"),
+            ("startswith", "Commence par"),
+            ("exact", "Message exact"),
+            ("regex", "Expression régulière"),
+        ],
+        string="Type de correspondance",
+        required=True,
+        default="contains",
+    )
+
+    keywords = fields.Text(
+        string="Mots-clés",
+        required=True,
+        help="Un mot-clé par ligne (insensible à la casse). Pour le type 'Expression régulière', une expression par ligne."
+    )
+
+    action_id = fields.Many2one(
+        "whatsapp.button.action",
+        string="Action à exécuter",
+        ondelete="cascade",
+        help="Action exécutée lorsque le message correspond (variables: message, contact)"
+    )
+
+    response_message = fields.Text(
+        string="Réponse automatique",
+        help="Message texte envoyé lorsque le message correspond (si aucune action n'est définie)"
+    )
+
+    description = fields.Text(string="Description")
+
+    @api.constrains("action_id", "response_message")
+    def _check_target(self):
+        for record in self:
+            if not record.action_id and not record.response_message:
+                raise ValidationError(_("Le déclencheur '%s' doit avoir une action ou une réponse automatique.") % record.name)
+
+    @api.constrains("match_type", "keywords")
+    def _check_regex(self):
+        for record in self.filtered(lambda t: t.match_type == "regex"):
+            for pattern in record._get_keyword_list():
+                try:
+                    re.compile(pattern, re.IGNORECASE)
+                except re.error as e:
+                    raise ValidationError(_("Expression régulière invalide dans '%s' : %s (%s)") % (record.name, pattern, e))
+
+    # Champs lus par le moteur de correspondance : leur modification vide les caches du registre
+    _MATCHER_CACHE_FIELDS = {"active", "match_type", "keywords"}
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        self.clear_caches()
+        return records
+
+    def write(self, vals):
+        res = super().write(vals)
+        if self._MATCHER_CACHE_FIELDS.intersection(vals):
+            self.clear_caches()
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self.clear_caches()
+        return res
+
+    def _get_keyword_list(self):
+        self.ensure_one()
+        keywords = [line.strip() for line in (self.keywords or "").splitlines()]
+        if self.match_type != "regex":
+            keywords = [keyword.lower() for keyword in keywords]
+        return [keyword for keyword in keywords if keyword]
+
+    # ------------------------------------------------------------------
+    # Moteur de correspondance (compilé une fois par registre)
+    # ------------------------------------------------------------------
+    @api.model
+    @tools.ormcache()
+    def _get_matcher(self):
+        """Compile tous les déclencheurs actifs en un seul moteur.
+
+        Les mots-clés littéraux forment un seul automate. Les expressions
+        régulières sont compilées une à une : les assembler en une seule regex
+        échouerait dès que deux d'entre elles définissent le même groupe nommé,
+        utilisent un drapeau global (?i) ou une référence arrière.
+
+        Returns:
+            tuple: (automate Aho-Corasick des mots-clés littéraux,
+                    {trigger_id: match_type},
+                    tuple de (trigger_id, regex compilées) des déclencheurs 'regex')
+        """
+        literal_keywords = []
+        match_types = {}
+        regex_triggers = []
+        for trigger in self.sudo().search([]):
+            match_types[trigger.id] = trigger.match_type
+            if trigger.match_type == "regex":
+                compiled = []
+                for pattern in trigger._get_keyword_list():
+                    try:
+                        compiled.append(re.compile(pattern, re.IGNORECASE))
+                    except re.error as e:
+                        # Expression enregistrée avant la contrainte : seule cette ligne est ignorée
+                        _logger.warning("Déclencheur '%s' : expression régulière ignorée %s (%s)", trigger.name, pattern, e)
+                if compiled:
+                    regex_triggers.append((trigger.id, tuple(compiled)))
+            else:
+                literal_keywords.extend((keyword, trigger.id) for keyword in trigger._get_keyword_list())
+
+        automaton = _KeywordAutomaton(literal_keywords) if literal_keywords else None
+        return automaton, match_types, tuple(regex_triggers)
+
+    @api.model
+    def _match(self, text):
+        """Retourne les déclencheurs actifs correspondant au texte, dans l'ordre de séquence.
+
+        Le texte est parcouru une seule fois par l'automate pour tous les
+        mots-clés littéraux, puis par chaque expression régulière ; seuls les
+        déclencheurs correspondants sont chargés.
+        """
+        text = (text or "").strip().lower()
+        if not text:
+            return self.browse()
+        automaton, match_types, regex_triggers = self._get_matcher()
+
+        matched_ids = set()
+        if automaton:
+            for start, end, trigger_id in automaton.iter_matches(text):
+                if trigger_id in matched_ids:
+                    continue
+                match_type = match_types[trigger_id]
+                if (match_type == "contains"
+                        or (match_type == "startswith" and start == 0)
+                        or (match_type == "exact" and start == 0 and end == len(text))):
+                    matched_ids.add(trigger_id)
+
+        for trigger_id, patterns in regex_triggers:
+            if any(pattern.search(text) for pattern in patterns):
+                matched_ids.add(trigger_id)
+
+        if not matched_ids:
+            return self.browse()
+        return self.browse(list(matched_ids)).sorted(lambda t: (t.sequence, t.id))
+
+    def _execute(self, message, contact=None):
+        """Exécute le déclencheur pour un message entrant"""
+        self.ensure_one()
+        if self.action_id:
+            if not self.action_id.active:
+                return {"success": False, "message": "Action inactive"}
+            return self.action_id.execute_action(message, contact)
+
+        config = message.config_id or self.env['whatsapp.config'].get_active_config(
+            message.phone, company=message.conversation_id.company_id or None
+        )
+        if not config or not message.phone:
+            return {"success": False, "message": "Configuration WhatsApp ou numéro manquant"}
+        config.send_text_message(message.phone, self.response_message)
+        return {"success": True, "message": "Réponse automatique envoyée"}
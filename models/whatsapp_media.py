@@ -0,0 +1,77 @@
+# whatsapp_business_api/models/whatsapp_media.py
+from odoo import models, fields, api
+from datetime import timedelta
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+class WhatsappMediaUpload(models.Model):
+    """Cache des médias uploadés chez Meta.
+
+    Un fichier (identifié par le checksum de sa pièce jointe) n'est uploadé
+    qu'une fois par configuration : tant que son media id est valide, les
+    envois suivants le réutilisent et Meta sert le fichier lui-même, sans
+    revenir le télécharger sur le serveur Odoo pour chaque destinataire.
+    """
+    _name = "whatsapp.media.upload"
+    _description = "Média WhatsApp uploadé (cache des media id)"
+    _log_access = False
+
+    config_id = fields.Many2one(
+        "whatsapp.config",
+        string="Configuration",
+        required=True,
+        ondelete="cascade",
+    )
+    checksum = fields.Char(string="Checksum", required=True)
+    media_id = fields.Char(string="ID Média (Meta)", required=True)
+    mimetype = fields.Char(string="Type MIME")
+    expires_at = fields.Datetime(string="Expire le", required=True)
+
+    _sql_constraints = [
+        ("config_checksum_unique", "unique(config_id, checksum)", "Un seul media id par fichier et par configuration."),
+    ]
+
+    # Meta conserve les médias uploadés 30 jours ; marge d'un jour
+    _MEDIA_VALIDITY_DAYS = 29
+
+    @api.model
+    def _get_media_id(self, config, attachment):
+        """Retourne un media id valide pour la pièce jointe, en l'uploadant si nécessaire"""
+        attachment = attachment.sudo()
+        checksum = attachment.checksum
+        if not checksum:
+            # Pièce jointe sans contenu stocké (ex: URL) : rien pour l'identifier, upload sans cache
+            return config._upload_media(attachment.raw, attachment.name, attachment.mimetype)
+        self.env.cr.execute("""
+            SELECT media_id FROM whatsapp_media_upload
+             WHERE config_id = %s AND checksum = %s AND expires_at > (now() AT TIME ZONE 'UTC')
+        """, (config.id, checksum))
+        row = self.env.cr.fetchone()
+        if row:
+            return row[0]
+
+        media_id = config._upload_media(attachment.raw, attachment.name, attachment.mimetype)
+        expires_at = fields.Datetime.now() + timedelta(days=self._MEDIA_VALIDITY_DAYS)
+        # Un autre worker a pu uploader le même fichier entre-temps : le dernier gagne
+        self.env.cr.execute("""
+            INSERT INTO whatsapp_media_upload (config_id, checksum, media_id, mimetype, expires_at)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (config_id, checksum) DO UPDATE
+               SET media_id = EXCLUDED.media_id, mimetype = EXCLUDED.mimetype, expires_at = EXCLUDED.expires_at
+        """, (config.id, checksum, media_id, attachment.mimetype, expires_at))
+        _logger.info("Média %s uploadé chez Meta pour %s : %s", attachment.name, config.name, media_id)
+        return media_id
+
+    @api.model
+    def _forget(self, config, media_id):
+        """Oublie un media id refusé par Meta : le prochain envoi uploadera à nouveau le fichier"""
+        self.env.cr.execute(
+            "DELETE FROM whatsapp_media_upload WHERE config_id = %s AND media_id = %s",
+            (config.id, media_id),
+        )
+
+    @api.autovacuum
+    def _gc_expired_media(self):
+        self.env.cr.execute("DELETE FROM whatsapp_media_upload WHERE expires_at < (now() AT TIME ZONE 'UTC')")
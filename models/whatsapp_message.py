@@ -1,8 +1,15 @@
 # whatsapp_business_api/models/whatsapp_message.py
 from odoo import models, fields, api, _
 from odoo.exceptions import ValidationError
+from odoo.tools.sql import create_index
+from datetime import datetime
+import hashlib
 import logging
 import json
+import mimetypes
+import os
+import requests
+import tempfile
 
 _logger = logging.getLogger(__name__)
 
@@ -12,6 +19,15 @@ class WhatsappMessage(models.Model):
     _description = "Journal des messages WhatsApp"
     _order = "create_date desc"
 
+    # Statuts WhatsApp -> statuts internes
+    _WA_STATUS_MAPPING = {
+        "sent": "sent",
+        "delivered": "delivered",
+        "read": "read",
+        "failed": "error",
+        "deleted": "error",
+    }
+
     direction = fields.Selection(
         [
             ("in", "Entrant"),
@@ -33,7 +49,15 @@ class WhatsappMessage(models.Model):
         ondelete="set null",
     )
 
-    wa_message_id = fields.Char("ID Message WhatsApp")
+    wa_message_id = fields.Char("ID Message WhatsApp", index=True)
+
+    company_id = fields.Many2one(
+        "res.company",
+        string="Société",
+        related="config_id.company_id",
+        store=True,
+        readonly=True,
+    )
     wa_conversation_id = fields.Char("ID Conversation")
     wa_status = fields.Char("Statut WhatsApp brut")
 
@@ -81,6 +105,13 @@ class WhatsappMessage(models.Model):
     media_url = fields.Char("URL Média (si lien)")
     media_mime_type = fields.Char("Type MIME")
     caption = fields.Char("Légende média")
+    media_sha256 = fields.Char("SHA-256 du média", index=True, readonly=True)
+    attachment_id = fields.Many2one(
+        "ir.attachment",
+        string="Fichier média",
+        readonly=True,
+        help="Fichier téléchargé depuis Meta pour les médias entrants"
+    )
 
     # Infos template
     template_name = fields.Char("Nom du template")
@@ -108,8 +139,10 @@ class WhatsappMessage(models.Model):
         if not self.phone:
             raise ValidationError(_("Aucun numéro de téléphone associé à ce message."))
         
-        # Récupère la configuration active
-        config = self.env['whatsapp.config'].search([('is_active', '=', True)], limit=1)
+        # Répond depuis le numéro qui a reçu le message (sinon le numéro du pool attribué au contact)
+        config = self.config_id if self.config_id.is_active else self.env['whatsapp.config'].get_active_config(
+            self.phone, company=self.company_id or self.conversation_id.company_id or None
+        )
         if not config:
             raise ValidationError(_("Aucune configuration WhatsApp active trouvée."))
         
@@ -168,19 +201,60 @@ class WhatsappMessage(models.Model):
             
             rec.error_help = help_text
 
+    # Types de messages entrants dont le fichier est téléchargé depuis Meta
+    _MEDIA_TYPES = ("image", "document", "audio", "video", "sticker")
+    # Téléchargement des médias : taille des blocs, délai d'attente (connexion, lecture)
+    _MEDIA_CHUNK_SIZE = 64 * 1024
+    _MEDIA_DOWNLOAD_TIMEOUT = (5, 60)
+
+    def init(self):
+        # Dernier message entrant d'un numéro (diagnostic, fenêtre de 24h)
+        create_index(self._cr, 'whatsapp_message_phone_direction_date_idx', self._table,
+                     ['phone', 'direction', 'create_date DESC'])
+        # Journal d'une société (boîte de réception, crons par statut)
+        create_index(self._cr, 'whatsapp_message_company_date_idx', self._table,
+                     ['company_id', 'create_date DESC'])
+        create_index(self._cr, 'whatsapp_message_company_direction_status_idx', self._table,
+                     ['company_id', 'direction', 'status'])
+
     # ------------------------------------------------------------------
     # Création à partir du webhook
     # ------------------------------------------------------------------
-    def _normalize_phone(self, phone):
-        """Normalise un numéro de téléphone pour la recherche"""
+    # Indicatif des numéros nationaux lorsque le pays du partenaire est inconnu (Sénégal)
+    _DEFAULT_PHONE_COUNTRY_CODE = "221"
+    # Un numéro de partenaire sans indicatif et d'au plus ce nombre de chiffres est un numéro national
+    _NATIONAL_NUMBER_MAX_DIGITS = 9
+
+    @api.model
+    def _normalize_phone(self, phone, partner=None):
+        """Normalise un numéro au format international (+indicatif).
+
+        Forme unique des numéros : conversations, verrous par numéro (webhook
+        et file d'attente) et envois. Un numéro national (0 initial, ou numéro
+        court sans indicatif d'un partenaire) reçoit l'indicatif du pays du
+        partenaire, Sénégal par défaut. Les numéros du webhook (wa_id) sont
+        déjà internationaux, sans le +.
+        """
         if not phone:
             return None
         # Nettoie le numéro
-        phone_clean = phone.replace(' ', '').replace('-', '').replace('.', '').replace('(', '').replace(')', '')
-        # Ajoute le + si absent
-        if phone_clean and not phone_clean.startswith('+'):
-            phone_clean = '+' + phone_clean.lstrip('+')
-        return phone_clean
+        phone_clean = str(phone).replace(' ', '').replace('-', '').replace('.', '').replace('(', '').replace(')', '')
+        if not phone_clean or phone_clean.startswith('+'):
+            return phone_clean or None
+        if phone_clean.startswith('00'):
+            return '+' + phone_clean[2:]
+        if phone_clean.startswith('0') or (partner and len(phone_clean) <= self._NATIONAL_NUMBER_MAX_DIGITS):
+            return '+' + self._get_phone_country_code(partner) + phone_clean.lstrip('0')
+        return '+' + phone_clean
+
+    @api.model
+    def _get_phone_country_code(self, partner=None):
+        """Indicatif (sans +) du pays du partenaire, ou indicatif par défaut"""
+        if partner and partner.country_id and partner.country_id.phone_code:
+            raw = str(partner.country_id.phone_code).strip().lstrip('+')
+            if raw.isdigit():
+                return raw
+        return self._DEFAULT_PHONE_COUNTRY_CODE
 
     def _find_or_create_contact(self, phone, contact_name=None):
         """Trouve ou crée un contact à partir d'un numéro de téléphone"""
@@ -218,8 +292,8 @@ class WhatsappMessage(models.Model):
         
         return contact
 
-    def _find_or_create_conversation(self, phone, contact=None, contact_name=None):
-        """Trouve ou crée une conversation"""
+    def _find_or_create_conversation(self, phone, contact=None, contact_name=None, company=None):
+        """Trouve ou crée une conversation (dans la société du numéro WhatsApp si fournie)"""
         if not phone:
             return None
         
@@ -227,12 +301,13 @@ class WhatsappMessage(models.Model):
         if not phone_clean:
             return None
         
-        # Cherche la conversation
-        domain = [('phone', '=', phone_clean)]
-        if contact:
-            domain.append(('contact_id', '=', contact.id))
-        
-        conversation = self.env['whatsapp.conversation'].search(domain, limit=1)
+        # Cherche la conversation (ID mis en cache par numéro et contact)
+        Conversation = self.env['whatsapp.conversation']
+        conversation = Conversation.browse(
+            Conversation._lookup_conversation_id(
+                phone_clean, contact.id if contact else None, company.id if company else None
+            )
+        ).exists()
         
         # Si pas trouvée, crée une nouvelle conversation
         if not conversation:
@@ -242,6 +317,7 @@ class WhatsappMessage(models.Model):
                 'phone': phone_clean,
                 'contact_id': contact.id if contact else False,
                 'contact_name': contact_name or (contact.name if contact else None),
+                'company_id': company.id if company else self.env.company.id,
             })
         
         # Met à jour le contact si nécessaire
@@ -253,9 +329,16 @@ class WhatsappMessage(models.Model):
         return conversation
 
     @api.model
-    def create_from_webhook(self, payload):
-        """Crée des enregistrements à partir du JSON du webhook."""
-        data_str = json.dumps(payload)
+    def create_from_webhook(self, payload, raw_payload=None):
+        """Crée des enregistrements à partir du JSON du webhook.
+
+        raw_payload : corps HTTP reçu (bytes), stocké tel quel ; à défaut le
+        payload est re-sérialisé.
+        """
+        if raw_payload is not None:
+            data_str = raw_payload.decode("utf-8", errors="replace") if isinstance(raw_payload, bytes) else raw_payload
+        else:
+            data_str = json.dumps(payload)
 
         entry = (payload.get("entry") or [{}])[0]
         changes = (entry.get("changes") or [{}])[0]
@@ -265,7 +348,10 @@ class WhatsappMessage(models.Model):
         statuses = value.get("statuses") or []
         contacts_data = value.get("contacts") or []  # Informations de contact fournies par WhatsApp
 
-        config = self.env["whatsapp.config"].search([("is_active", "=", True)], limit=1)
+        # Route l'événement vers la configuration du numéro qui l'a reçu
+        config = self.env["whatsapp.config"]._get_config_for_phone_number_id(
+            value.get("metadata", {}).get("phone_number_id")
+        )
 
         created_records = self.env["whatsapp.message"]
         
@@ -279,8 +365,22 @@ class WhatsappMessage(models.Model):
                     'phone': phone
                 }
 
+        # Sérialise le traitement par numéro entre workers, puis ignore les messages
+        # déjà enregistrés (webhook renvoyé par Meta) : pas d'effet de bord en double
+        self.env["whatsapp.conversation"]._lock_phones(
+            self._normalize_phone(msg.get("from")) for msg in messages
+        )
+        wa_message_ids = [msg["id"] for msg in messages if msg.get("id")]
+        known_ids = set(self.sudo().search([
+            ("direction", "=", "in"),
+            ("wa_message_id", "in", wa_message_ids),
+        ]).mapped("wa_message_id")) if wa_message_ids else set()
+
         # Messages entrants
         for msg in messages:
+            if msg.get("id") in known_ids:
+                _logger.info("Message WhatsApp %s déjà traité, ignoré", msg["id"])
+                continue
             mtype = msg.get("type", "unknown")
             from_phone = msg.get("from")
             metadata = value.get("metadata", {})
@@ -417,7 +517,8 @@ class WhatsappMessage(models.Model):
             conversation = self._find_or_create_conversation(
                 from_phone,
                 contact,
-                contacts_map.get(from_phone, {}).get('name')
+                contacts_map.get(from_phone, {}).get('name'),
+                company=config.company_id if config else None,
             )
             
             # Extrait les informations de template si c'est un message template
@@ -454,6 +555,16 @@ class WhatsappMessage(models.Model):
                 "raw_payload": data_str,
             })
             created_records |= rec
+
+            # Ouvre (ou prolonge) la fenêtre de service client de 24h
+            if conversation:
+                received_at = None
+                if msg.get("timestamp"):
+                    try:
+                        received_at = datetime.utcfromtimestamp(int(msg["timestamp"]))
+                    except (TypeError, ValueError):
+                        received_at = None
+                conversation._touch_inbound(received_at, config)
             
             _logger.info("Message entrant créé : ID=%s, Type=%s, Phone=%s, Contact=%s", 
                         rec.id, message_type, from_phone, contact.name if contact else "N/A")
@@ -470,104 +581,18 @@ class WhatsappMessage(models.Model):
                 try:
                     text_lower = text_body.strip().lower()
 
-                    # 0) Si le partenaire a été marqué "en attente de mot de passe via WhatsApp",
-                    # on considère que ce message contient le mot de passe à enregistrer.
-                    # 0) Gestion du mot de passe envoyé via WhatsApp
-                    # On récupère d'abord le partenaire lié au message, ou on le cherche par téléphone.
-                    partner = contact
-                    if not partner and from_phone:
-                        try:
-                            phone_clean = self._normalize_phone(from_phone)
-                            if phone_clean:
-                                partner = self.env['res.partner'].search([
-                                    '|',
-                                    ('phone', 'ilike', phone_clean),
-                                    ('mobile', 'ilike', phone_clean),
-                                ], limit=1)
-                        except Exception as e:
-                            _logger.debug("Erreur lors de la recherche du partenaire pour mot de passe via téléphone %s : %s", from_phone, str(e))
-
-                    if partner and hasattr(partner, 'waiting_password_whatsapp') and partner.waiting_password_whatsapp:
-                        new_password = text_body.strip()
-                        if new_password:
-                            try:
-                                had_password = bool(partner.password)
-                                partner.sudo().write({
-                                    'password': new_password,
-                                    # 'waiting_password_whatsapp': False,
-                                })
-                                config_pwd = rec.config_id or self.env['whatsapp.config'].search([('is_active', '=', True)], limit=1)
-                                if config_pwd and rec.phone:
-                                    if had_password:
-                                        confirm_msg = (
-                                            "Votre mot de passe a été modifié avec succès.\n\n"
-                                            "Vous pouvez maintenant vous connecter sur le portail Touba Sandaga avec ce nouveau mot de passe.\n\n"
-                                            "Équipe CCTS"
-                                        )
-                                    else:
-                                        confirm_msg = (
-                                            "Votre mot de passe a été enregistré.\n\n"
-                                            "Vous pouvez maintenant vous connecter sur le portail Touba Sandaga avec ce mot de passe.\n\n"
-                                            "Équipe CCTS"
-                                        )
-                                    config_pwd.send_text_message(rec.phone, confirm_msg)
-                                    _logger.info("Mot de passe mis à jour via WhatsApp pour le partenaire %s (ID: %s)", partner.name, partner.id)
-                            except Exception as e:
-                                _logger.exception("Erreur lors de l'enregistrement du mot de passe via WhatsApp pour le partenaire %s : %s", partner, str(e))
-                        else:
-                            # Mot de passe vide : on envoie un message d'erreur au client
-                            config_pwd = rec.config_id or self.env['whatsapp.config'].search([('is_active', '=', True)], limit=1)
-                            if config_pwd and rec.phone:
-                                error_msg = (
-                                    "Le mot de passe envoyé est vide.\n\n"
-                                    "Veuillez renvoyer un mot de passe valide (au moins quelques caractères)."
-                                )
-                                config_pwd.send_text_message(rec.phone, error_msg)
-                        # Une fois le mot de passe traité (ou ignoré si vide), on ne lance pas les autres actions automatiques
+                    # 0) Étape de session en cours (ex: saisie du mot de passe après le bouton 'Définir mot de passe') :
+                    # le message est routé vers le gestionnaire de l'étape, sans déclencher les autres actions automatiques
+                    if conversation and conversation._dispatch_session(rec):
                         continue
 
-                    # 1) Menu d'accueil automatique (Bonjour / Salut, etc.)
-                    greeting_action = self.env['whatsapp.button.action'].search([
-                        ('button_id', '=', 'auto_greeting_menu'),
-                        ('active', '=', True)
-                    ], limit=1)
-                    if greeting_action:
-                        try:
-                            greeting_action.execute_action(rec, contact)
-                        except Exception as e:
-                            _logger.exception("Erreur lors de l'exécution de l'action de menu d'accueil : %s", str(e))
-
-                    # 2) Envoi automatique des factures (mots-clés liés aux factures)
-                    auto_action = self.env['whatsapp.button.action'].search([
-                        ('button_id', '=', 'auto_send_all_invoices'),
-                        ('active', '=', True)
-                    ], limit=1)
-                    
-                    if auto_action:
-                        _logger.info("Action automatique d'envoi de factures trouvée, vérification des mots-clés...")
-                        try:
-                            auto_action.execute_action(rec, contact)
-                        except Exception as e:
-                            _logger.exception("Erreur lors de l'exécution de l'action automatique d'envoi de factures : %s", str(e))
-
-                    # 3) Réponse automatique aux messages de remerciement ("merci", "thanks", etc.)
-                    thanks_keywords = ["merci", "thanks", "thank you", "thx"]
-                    if any(k in text_lower for k in thanks_keywords):
+                    # 1) Déclencheurs par mots-clés (menu d'accueil, factures, remerciements, ...)
+                    # Un seul parcours du texte par le moteur compilé ; seules les actions correspondantes sont exécutées
+                    for trigger in self.env['whatsapp.keyword.trigger']._match(text_lower):
                         try:
-                            config_thanks = rec.config_id or self.env['whatsapp.config'].search([('is_active', '=', True)], limit=1)
-                            if config_thanks and rec.phone:
-                                info_message = (
-                                    "Merci pour votre message.\n\n"
-                                    "ℹInformations Touba Sandaga :\n"
-                                    "• Site : https://toubasandaga.sn\n"
-                                    "• Service client : (+221) 33 849 56 99\n"
-                                    "• Adresse : Touba Sandaga, Dakar\n\n"
-                                    "Équipe CCTS"
-                                )
-                                config_thanks.send_text_message(rec.phone, info_message)
-                                _logger.info("Message d'information Touba Sandaga envoyé suite à un 'merci' pour le numéro %s", rec.phone)
+                            trigger._execute(rec, contact)
                         except Exception as e:
-                            _logger.exception("Erreur lors de l'envoi de la réponse 'merci' Touba Sandaga : %s", str(e))
+                            _logger.exception("Erreur lors de l'exécution du déclencheur '%s' : %s", trigger.name, str(e))
 
                 except Exception as e:
                     _logger.debug("Erreur lors de la vérification des actions automatiques texte : %s", str(e))
@@ -587,15 +612,7 @@ class WhatsappMessage(models.Model):
                 _logger.warning("Erreur de statut pour le message %s : %s", message_id, error_message)
 
             # Mappe les statuts WhatsApp vers les statuts internes
-            status_mapping = {
-                "sent": "sent",
-                "delivered": "delivered",
-                "read": "read",
-                "failed": "error",
-                "deleted": "error",
-            }
-            
-            internal_status = status_mapping.get(status, "sent")
+            internal_status = self._WA_STATUS_MAPPING.get(status, "sent")
 
             msg_rec = self.search([("wa_message_id", "=", message_id)], limit=1)
             if msg_rec:
@@ -624,7 +641,9 @@ class WhatsappMessage(models.Model):
                 # Message non trouvé, crée un enregistrement de statut
                 # Trouve le contact si possible
                 contact = self._find_or_create_contact(phone) if phone else None
-                conversation = self._find_or_create_conversation(phone, contact) if phone else None
+                conversation = self._find_or_create_conversation(
+                    phone, contact, company=config.company_id if config else None
+                ) if phone else None
                 
                 rec = self.create({
                     "direction": "out",
@@ -642,8 +661,142 @@ class WhatsappMessage(models.Model):
                 
                 _logger.info("Enregistrement de statut créé pour le message WhatsApp %s : %s", message_id, status)
 
+        # Télécharge les médias entrants en arrière-plan : le webhook répond sans attendre Meta
+        inbound_media = created_records.filtered(
+            lambda m: m.direction == "in" and m.media_id and m.message_type in self._MEDIA_TYPES
+        )
+        if inbound_media:
+            self.env["whatsapp.queue"].enqueue(inbound_media, "_whatsapp_job_download_media")
+
         return created_records
 
+    # ------------------------------------------------------------------
+    # Téléchargement des médias entrants
+    # ------------------------------------------------------------------
+    def _whatsapp_job_download_media(self):
+        """Télécharge le fichier d'un média entrant et le lie au message (appelé par whatsapp.queue).
+
+        L'URL du média est d'abord résolue via /{media_id} ; si un fichier de
+        même SHA-256 a déjà été reçu par la même société, sa pièce jointe est
+        réutilisée sans téléchargement (jamais celle d'une autre société). Sinon le fichier est écrit par blocs dans le filestore.
+        """
+        self.ensure_one()
+        if self.attachment_id or not self.media_id:
+            return
+        config = self.config_id or self.env["whatsapp.config"].get_active_config(
+            company=self.conversation_id.company_id or None
+        )
+        if not config:
+            raise ValidationError(_("Aucune configuration WhatsApp pour télécharger le média %s.") % self.media_id)
+
+        with requests.Session() as session:
+            session.headers["Authorization"] = config._get_headers()["Authorization"]
+            response = session.get(
+                config._get_api_url(self.media_id),
+                timeout=self._MEDIA_DOWNLOAD_TIMEOUT,
+            )
+            if response.status_code != 200:
+                raise ValidationError(_("Impossible de résoudre le média %s : %s") % (self.media_id, response.text))
+            info = response.json()
+
+            sha256 = info.get("sha256")
+            if sha256:
+                duplicate = self.search([
+                    ("media_sha256", "=", sha256),
+                    ("attachment_id", "!=", False),
+                    ("attachment_id.res_model", "=", self._name),
+                    ("attachment_id.company_id", "=", config.company_id.id),
+                ], limit=1)
+                if duplicate:
+                    self.write({"media_sha256": sha256, "attachment_id": duplicate.attachment_id.id})
+                    return
+
+            mimetype = info.get("mime_type") or self.media_mime_type
+            with session.get(info["url"], stream=True, timeout=self._MEDIA_DOWNLOAD_TIMEOUT) as download:
+                if download.status_code != 200:
+                    raise ValidationError(_("Impossible de télécharger le média %s (HTTP %s)") % (self.media_id, download.status_code))
+                attachment, computed_sha256 = self._store_media_stream(download, mimetype, config.company_id)
+
+        self.write({
+            "media_sha256": sha256 or computed_sha256,
+            "media_mime_type": mimetype,
+            "attachment_id": attachment.id,
+        })
+        _logger.info("Média %s téléchargé pour le message %s (%d octets)", self.media_id, self.id, attachment.file_size)
+
+    def _store_media_stream(self, response, mimetype, company):
+        """Écrit une réponse HTTP par blocs dans le filestore et crée la pièce jointe.
+
+        Le fichier n'est jamais chargé entièrement en mémoire : il est écrit
+        dans un fichier temporaire du filestore (SHA-1 et SHA-256 calculés au
+        fil de l'eau) puis déplacé à son emplacement définitif.
+
+        ir.attachment._file_write() n'accepte que le contenu complet en
+        mémoire ; ce flux en reproduit donc la tenue du filestore :
+        - même chemin que _get_path() (SHA-1 du contenu, ancien chemin à
+          3 caractères réutilisé s'il existe) ;
+        - fichier existant conservé tel quel (adressé par son contenu) ;
+        - nouveau fichier marqué pour le ramasse-miettes (_mark_for_gc), qui
+          le supprime si la transaction est annulée, comme _file_write().
+        create() ignorant store_fname, file_size et checksum, ces trois
+        colonnes sont ensuite écrites en SQL sur la pièce jointe qui vient
+        d'être créée : la suppression, la copie et le ramasse-miettes les
+        lisent ensuite comme pour toute pièce jointe. Seule l'indexation du
+        contenu (index_content) n'est pas faite, comme pour un média binaire.
+
+        Returns:
+            tuple: (ir.attachment, sha256 hexadécimal)
+        """
+        self.ensure_one()
+        Attachment = self.env["ir.attachment"].sudo()
+        name = f"whatsapp_{self.media_id}{mimetypes.guess_extension(mimetype or '') or ''}"
+        values = {
+            "name": name,
+            "type": "binary",
+            "mimetype": mimetype,
+            "res_model": self._name,
+            "res_id": self.id,
+            "company_id": company.id,
+        }
+
+        sha1, sha256, size = hashlib.sha1(), hashlib.sha256(), 0
+        fd, tmp_path = tempfile.mkstemp(prefix="whatsapp_media_", dir=Attachment._full_path(""))
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                for chunk in response.iter_content(self._MEDIA_CHUNK_SIZE):
+                    tmp.write(chunk)
+                    sha1.update(chunk)
+                    sha256.update(chunk)
+                    size += len(chunk)
+
+            if Attachment._storage() != "file":
+                # Stockage en base : pas d'écriture directe possible
+                with open(tmp_path, "rb") as tmp:
+                    return Attachment.create(dict(values, raw=tmp.read())), sha256.hexdigest()
+
+            checksum = sha1.hexdigest()
+            fname = f"{checksum[:3]}/{checksum}"
+            if not os.path.isfile(Attachment._full_path(fname)):
+                fname = f"{checksum[:2]}/{checksum}"
+            full_path = Attachment._full_path(fname)
+            if not os.path.isfile(full_path):
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                os.replace(tmp_path, full_path)
+                # Supprimé par le ramasse-miettes du filestore si la transaction est annulée
+                Attachment._mark_for_gc(fname)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+        attachment = Attachment.create(values)
+        # create() ignore store_fname, file_size et checksum (voir la docstring)
+        self.env.cr.execute(
+            "UPDATE ir_attachment SET store_fname = %s, file_size = %s, checksum = %s WHERE id = %s",
+            (fname, size, checksum, attachment.id),
+        )
+        attachment.invalidate_recordset(["store_fname", "file_size", "checksum"])
+        return attachment, sha256.hexdigest()
+
     def _process_button_action(self, interactive_data):
         """Traite les actions associées aux boutons cliqués"""
         self.ensure_one()
@@ -670,49 +823,19 @@ class WhatsappMessage(models.Model):
                 if contact:
                     self.contact_id = contact.id
             
-            # Cherche d'abord dans les scénarios interactifs
-            scenarios = self.env['whatsapp.interactive.scenario'].search([
-                ('active', '=', True)
-            ])
-            
-            scenario_found = None
-            for scenario in scenarios:
-                if button_id in [scenario.button_1_id, scenario.button_2_id, scenario.button_3_id]:
-                    scenario_found = scenario
-                    break
+            # Résout le bouton via la table de routage en cache (scénarios, ID exact, puis préfixe)
+            scenario_button, actions = self.env['whatsapp.button.action']._route_button(button_id)
             
-            if scenario_found:
+            if scenario_button:
+                scenario_found = scenario_button.scenario_id
                 _logger.info("Scénario interactif trouvé pour le bouton %s : %s", button_id, scenario_found.name)
-                result = scenario_found.handle_button_click(button_id, self, contact)
+                result = scenario_button.handle_click(self, contact)
                 if result.get('success'):
                     self.content = f"[Scénario: {scenario_found.name}] Réponse envoyée"
                 else:
                     self.content = f"[Scénario: {scenario_found.name}] Erreur : {result.get('message', 'Erreur inconnue')}"
                 return
             
-            # Si pas de scénario, cherche les actions de boutons classiques
-            # D'abord recherche exacte
-            actions = self.env['whatsapp.button.action'].search([
-                ('button_id', '=', button_id),
-                ('active', '=', True)
-            ])
-            
-            # Si pas trouvé, cherche par préfixe (pour les IDs dynamiques comme btn_validate_order_98)
-            if not actions:
-                # Cherche les actions dont le button_id est un préfixe du button_id reçu
-                all_actions = self.env['whatsapp.button.action'].search([
-                    ('active', '=', True)
-                ])
-                
-                for action in all_actions:
-                    # Vérifie si le button_id reçu commence par le button_id de l'action suivi d'un underscore
-                    # Exemple: button_id="btn_validate_order_98" et action.button_id="btn_validate_order"
-                    if button_id.startswith(action.button_id + '_') or button_id == action.button_id:
-                        actions |= action
-                        # Ne break pas pour permettre de trouver toutes les actions correspondantes
-                        # Mais généralement il n'y en a qu'une, donc on peut break
-                        break
-            
             if not actions:
                 _logger.info("Aucune action trouvée pour le bouton %s (Message ID: %s, Phone: %s)", 
                             button_id, self.id, self.phone)
@@ -0,0 +1,213 @@
+# whatsapp_business_api/models/whatsapp_queue.py
+from odoo import models, fields, api, _
+from odoo.exceptions import ValidationError
+from datetime import timedelta
+from .whatsapp_config import WhatsappTemporaryError
+import logging
+import json
+import threading
+
+_logger = logging.getLogger(__name__)
+
+
+class WhatsappQueue(models.Model):
+    """File d'attente des envois WhatsApp différés.
+
+    Les tâches sont créées dans la transaction de l'appelant : un rollback les
+    supprime, donc aucun message n'est envoyé pour une opération annulée.
+    Elles sont traitées par le cron « Traiter la file d'attente WhatsApp »,
+    déclenché immédiatement après le commit via ir.cron._trigger().
+
+    Les tâches sont exécutées en superutilisateur : seules les méthodes
+    préfixées par _whatsapp_job_ peuvent être mises en file, et les tâches ne
+    sont créées que par enqueue() (les utilisateurs n'ont qu'un accès en lecture).
+
+    Une tâche peut être différée (delay) : le cron est alors déclenché à
+    l'heure prévue, ce qui sert aux nouvelles tentatives d'envoi sans bloquer
+    le worker qui a essuyé le refus.
+    """
+    _name = "whatsapp.queue"
+    _description = "File d'attente des envois WhatsApp"
+    _order = "id"
+
+    name = fields.Char(string="Description", required=True)
+
+    res_model = fields.Char(string="Modèle", required=True)
+    res_id = fields.Integer(string="ID enregistrement", required=True)
+    method = fields.Char(
+        string="Méthode",
+        required=True,
+        help="Méthode à appeler sur l'enregistrement lors du traitement"
+    )
+    args_json = fields.Text(
+        string="Arguments (JSON)",
+        default="[]",
+        help="Arguments positionnels passés à la méthode"
+    )
+
+    state = fields.Selection(
+        [
+            ("pending", "En attente"),
+            ("done", "Traité"),
+            ("failed", "Échec"),
+        ],
+        string="Statut",
+        default="pending",
+        required=True,
+        index=True,
+    )
+    lock_key = fields.Char(
+        string="Numéro (sérialisation)",
+        index=True,
+        help="Numéro normalisé du destinataire : les tâches d'un même numéro sont exécutées une à une, "
+             "dans l'ordre de création, et jamais en même temps que le traitement d'un webhook de ce numéro"
+    )
+    scheduled_at = fields.Datetime(
+        string="Exécuter à partir de",
+        index=True,
+        help="Tâche différée : elle n'est pas traitée avant cette date (vide : dès que possible)"
+    )
+    attempt_count = fields.Integer(string="Tentatives", default=0)
+    last_error = fields.Text(string="Dernière erreur")
+    processed_date = fields.Datetime(string="Date de traitement")
+
+    # Nombre maximal de tentatives avant de passer la tâche en échec
+    _MAX_ATTEMPTS = 3
+    # Échec temporaire d'envoi : délai avant nouvelle tentative, doublé à chaque essai (secondes)
+    _RETRY_DELAY_BASE = 30
+    _RETRY_DELAY_MAX = 900
+
+    # Préfixe obligatoire des méthodes exécutables par la file d'attente
+    _JOB_METHOD_PREFIX = "_whatsapp_job_"
+
+    @api.model
+    def enqueue(self, records, method, *args, name=None, lock_key=None, delay=None):
+        """Ajoute une tâche par enregistrement et programme le traitement après commit.
+
+        Args:
+            records: Recordset sur lequel la méthode sera appelée
+            method: Nom de la méthode à appeler, préfixé par _whatsapp_job_
+                (ex: '_whatsapp_job_send_state_notification')
+            args: Arguments positionnels (sérialisables en JSON)
+            name: Description de la tâche (optionnel)
+            lock_key: Fonction enregistrement -> numéro du destinataire (optionnel) ;
+                les tâches d'un même numéro sont sérialisées (passer le partenaire à
+                whatsapp.message._normalize_phone pour un numéro national)
+            delay: Délai minimal avant exécution, en secondes (optionnel)
+
+        Returns:
+            whatsapp.queue: Tâches créées
+        """
+        if not records:
+            return self.browse()
+        self._check_job_method(records, method)
+        args_json = json.dumps(list(args))
+        scheduled_at = fields.Datetime.now() + timedelta(seconds=delay) if delay else False
+        jobs = self.sudo().create([{
+            "name": name or f"{record.display_name} : {method}",
+            "res_model": record._name,
+            "res_id": record.id,
+            "method": method,
+            "args_json": args_json,
+            "lock_key": self._normalize_lock_key(lock_key(record)) if lock_key else False,
+            "scheduled_at": scheduled_at,
+        } for record in records])
+        self._trigger_processing(scheduled_at or None)
+        return jobs
+
+    @api.model
+    def _check_job_method(self, records, method):
+        """Refuse toute méthode qui n'est pas une tâche WhatsApp déclarée"""
+        if not method.startswith(self._JOB_METHOD_PREFIX) or not callable(getattr(records, method, None)):
+            raise ValidationError(_("La méthode %s.%s ne peut pas être exécutée par la file d'attente WhatsApp.")
+                                  % (records._name, method))
+
+    @api.model
+    def _normalize_lock_key(self, phone):
+        """Normalise le numéro comme pour les conversations (même verrou que le webhook, qui reçoit des numéros internationaux)"""
+        return self.env["whatsapp.message"]._normalize_phone(phone) or False
+
+    @api.model
+    def _trigger_processing(self, at=None):
+        """Demande l'exécution du cron de traitement (effective après le commit, ou à la date at)"""
+        cron = self.env.ref("api_whatsapp.ir_cron_process_whatsapp_queue", raise_if_not_found=False)
+        if cron:
+            cron.sudo()._trigger(at)
+
+    @api.model
+    def _process_queue(self, limit=100):
+        """Traite les tâches en attente (appelé par le cron)"""
+        jobs = self.sudo().search([
+            ("state", "=", "pending"),
+            "|", ("scheduled_at", "=", False), ("scheduled_at", "<=", fields.Datetime.now()),
+        ], limit=limit)
+        if not jobs:
+            return
+        # Commit après chaque tâche : un envoi effectué ne doit jamais être rejoué
+        auto_commit = not getattr(threading.current_thread(), "testing", False)
+        _logger.info("Traitement de %d tâche(s) de la file d'attente WhatsApp", len(jobs))
+        # Numéros occupés par un autre worker : leurs tâches suivantes attendent pour garder l'ordre
+        busy_keys = set()
+        for job in jobs:
+            if job.lock_key and job.lock_key in busy_keys:
+                continue
+            if job.lock_key and not self.env["whatsapp.conversation"]._try_lock_phone(job.lock_key):
+                _logger.info("Tâche WhatsApp %s reportée : numéro %s en cours de traitement", job.id, job.lock_key)
+                busy_keys.add(job.lock_key)
+                continue
+            job._run()
+            if auto_commit:
+                self.env.cr.commit()
+        # S'il reste des tâches (ou des tâches reportées), relance le cron immédiatement
+        if len(jobs) == limit or busy_keys:
+            self._trigger_processing()
+
+    def _run(self):
+        """Exécute une tâche dans un savepoint ; une erreur n'affecte pas les autres tâches"""
+        self.ensure_one()
+        self.attempt_count += 1
+        try:
+            with self.env.cr.savepoint():
+                if self.res_model not in self.env:
+                    raise ValidationError(_("Modèle %s inconnu.") % self.res_model)
+                record = self.env[self.res_model].sudo().browse(self.res_id).exists()
+                if record:
+                    self._check_job_method(record, self.method)
+                    # Le contexte signale aux envois qu'un échec temporaire doit être levé (tâche reprogrammée)
+                    record = record.with_context(whatsapp_queue_job=True)
+                    getattr(record, self.method)(*json.loads(self.args_json or "[]"))
+                else:
+                    _logger.info("Tâche WhatsApp %s : enregistrement %s,%s introuvable, ignorée",
+                                 self.id, self.res_model, self.res_id)
+            self.write({
+                "state": "done",
+                "processed_date": fields.Datetime.now(),
+                "last_error": False,
+            })
+        except WhatsappTemporaryError as e:
+            failed = self.attempt_count >= self._MAX_ATTEMPTS
+            delay = max(e.retry_in or 0, min(self._RETRY_DELAY_MAX, self._RETRY_DELAY_BASE * 2 ** (self.attempt_count - 1)))
+            scheduled_at = fields.Datetime.now() + timedelta(seconds=int(delay) + 1)
+            _logger.warning("Tâche WhatsApp %s (%s) : échec temporaire (tentative %d), %s : %s",
+                            self.id, self.name, self.attempt_count,
+                            "abandon" if failed else f"nouvel essai à {scheduled_at}", str(e))
+            self.write({
+                "state": "failed" if failed else "pending",
+                "scheduled_at": False if failed else scheduled_at,
+                "last_error": str(e),
+            })
+            if not failed:
+                self._trigger_processing(scheduled_at)
+        except Exception as e:
+            _logger.warning("Tâche WhatsApp %s (%s) en erreur (tentative %d): %s",
+                            self.id, self.name, self.attempt_count, str(e))
+            self.write({
+                "state": "failed" if self.attempt_count >= self._MAX_ATTEMPTS else "pending",
+                "last_error": str(e),
+            })
+
+    def action_retry(self):
+        """Remet les tâches en attente pour une nouvelle tentative"""
+        self.write({"state": "pending", "attempt_count": 0, "last_error": False, "scheduled_at": False})
+        self._trigger_processing()
+        return True
@@ -0,0 +1,102 @@
+# whatsapp_business_api/models/whatsapp_rate_limit.py
+from odoo import models, fields, api
+import logging
+import time
+
+_logger = logging.getLogger(__name__)
+
+
+class WhatsappRateLimitBucket(models.Model):
+    """Seau à jetons partagé entre les workers Odoo.
+
+    Chaque clé (numéro d'envoi, paire numéro/destinataire) possède une ligne.
+    La recharge et la consommation sont faites en une seule requête
+    INSERT ... ON CONFLICT DO UPDATE, dans un curseur dédié validé aussitôt :
+    le verrou de ligne n'est tenu que le temps de cette requête et non
+    pendant toute la transaction de l'appelant.
+
+    Le solde peut devenir négatif : l'appelant réserve son jeton puis attend
+    le temps nécessaire à sa recharge. Les rafales sont ainsi étalées au
+    lieu d'être rejetées par Meta.
+    """
+    _name = "whatsapp.rate.limit.bucket"
+    _description = "Limiteur de débit WhatsApp (seau à jetons)"
+    _log_access = False
+
+    key = fields.Char(string="Clé", required=True)
+    tokens = fields.Float(string="Jetons disponibles", required=True, default=0)
+    updated_at = fields.Datetime(string="Dernière recharge", required=True)
+
+    _sql_constraints = [
+        ("key_unique", "unique(key)", "Un seul seau par clé."),
+    ]
+
+    @api.model
+    def _acquire(self, key, rate, capacity):
+        """Réserve un jeton et retourne le temps d'attente (secondes) avant de pouvoir envoyer.
+
+        Args:
+            key: Clé du seau (ex: 'number:<phone_number_id>')
+            rate: Jetons ajoutés par seconde
+            capacity: Taille maximale du seau (rafale autorisée)
+
+        Returns:
+            float: 0 si un jeton était disponible, sinon le délai d'attente
+        """
+        with self.pool.cursor() as cr:
+            cr.execute("""
+                INSERT INTO whatsapp_rate_limit_bucket AS bucket (key, tokens, updated_at)
+                VALUES (%(key)s, %(capacity)s - 1, clock_timestamp() AT TIME ZONE 'UTC')
+                ON CONFLICT (key) DO UPDATE SET
+                    tokens = LEAST(
+                        %(capacity)s,
+                        bucket.tokens + %(rate)s * GREATEST(
+                            EXTRACT(EPOCH FROM (clock_timestamp() AT TIME ZONE 'UTC') - bucket.updated_at), 0)
+                    ) - 1,
+                    updated_at = clock_timestamp() AT TIME ZONE 'UTC'
+                RETURNING tokens
+            """, {"key": key, "rate": rate, "capacity": capacity})
+            tokens = cr.fetchone()[0]
+        return -tokens / rate if tokens < 0 else 0.0
+
+    @api.model
+    def _release(self, key):
+        """Rend un jeton réservé mais non utilisé"""
+        with self.pool.cursor() as cr:
+            cr.execute(
+                "UPDATE whatsapp_rate_limit_bucket SET tokens = tokens + 1 WHERE key = %s",
+                (key,),
+            )
+
+    @api.model
+    def _throttle(self, buckets, max_wait):
+        """Réserve un jeton dans chaque seau et attend le plus long délai.
+
+        Args:
+            buckets: Liste de (clé, débit par seconde, capacité)
+            max_wait: Attente maximale acceptée (secondes)
+
+        Returns:
+            tuple: (True, temps attendu), ou (False, délai nécessaire) si
+            l'attente dépasserait max_wait (les jetons réservés sont alors rendus)
+        """
+        acquired = []
+        delay = 0.0
+        for key, rate, capacity in buckets:
+            delay = max(delay, self._acquire(key, rate, capacity))
+            acquired.append(key)
+        if delay > max_wait:
+            for key in acquired:
+                self._release(key)
+            return False, delay
+        if delay:
+            _logger.info("Limiteur de débit WhatsApp : attente de %.2f s (%s)", delay, ", ".join(acquired))
+            time.sleep(delay)
+        return True, delay
+
+    @api.autovacuum
+    def _gc_idle_buckets(self):
+        """Supprime les seaux inutilisés depuis plus d'un jour (ils seraient pleins de toute façon)"""
+        self.env.cr.execute(
+            "DELETE FROM whatsapp_rate_limit_bucket WHERE updated_at < (now() AT TIME ZONE 'UTC') - interval '1 day'"
+        )
@@ -47,7 +47,8 @@ class WhatsappSendMessage(models.TransientModel):
         """Charge la configuration active par défaut et les valeurs du contexte"""
         res = super().default_get(fields_list)
         if 'config_id' in fields_list:
-            config = self.env['whatsapp.config'].search([('is_active', '=', True)], limit=1)
+            # Numéro prérempli (contexte) : configuration du pool qui sert ce destinataire
+            config = self.env['whatsapp.config'].get_active_config(res.get('phone'))
             if config:
                 res['config_id'] = config.id
         
@@ -235,7 +236,8 @@ class WhatsappSendTemplate(models.TransientModel):
         """Charge la configuration active par défaut"""
         res = super().default_get(fields_list)
         if 'config_id' in fields_list:
-            config = self.env['whatsapp.config'].search([('is_active', '=', True)], limit=1)
+            # Numéro prérempli (contexte) : configuration du pool qui sert ce destinataire
+            config = self.env['whatsapp.config'].get_active_config(res.get('phone'))
             if config:
                 res['config_id'] = config.id
         return res
@@ -281,14 +283,9 @@ class WhatsappSendTemplate(models.TransientModel):
     
     @api.depends('template_id', 'template_id.has_parameters')
     def _compute_template_has_parameters(self):
-        """Calcule si le template a des paramètres"""
+        """Calcule si le template a des paramètres (champ stocké sur le template)"""
         for record in self:
-            if record.template_id:
-                # Force le calcul de has_parameters sur le template
-                record.template_id._compute_has_parameters()
-                record.template_has_parameters = record.template_id.has_parameters
-            else:
-                record.template_has_parameters = False
+            record.template_has_parameters = bool(record.template_id.has_parameters)
     
     @api.onchange('template_id')
     def _onchange_template_id(self):
@@ -321,108 +318,6 @@ class WhatsappSendTemplate(models.TransientModel):
             'has_parameters': False
         }
     
-    def _build_components_from_values(self, param_values):
-        """
-        Construit les components à partir des valeurs saisies.
-        
-        Args:
-            param_values: Dict avec les valeurs, format:
-                {
-                    "body_1": "Valeur 1",
-                    "body_2": "Valeur 2",
-                    "header_1": "URL image",
-                    "button_0": "URL bouton"
-                }
-        
-        Returns:
-            Liste de components au format Meta
-        """
-        if not param_values:
-            return None
-        
-        structure = self.template_id.get_parameter_structure() if self.template_id else {}
-        components = []
-        
-        # Construit les paramètres du header
-        header_params = []
-        if structure.get("header"):
-            for param_def in structure.get("header", []):
-                param_key = f"header_{param_def.get('index', 1)}"
-                value = param_values.get(param_key, "")
-                if value:
-                    if param_def.get("type") == "image":
-                        header_params.append({
-                            "type": "image",
-                            "image": {"link": value}
-                        })
-                    elif param_def.get("type") == "document":
-                        header_params.append({
-                            "type": "document",
-                            "document": {"link": value}
-                        })
-                    elif param_def.get("type") == "text":
-                        header_params.append({
-                            "type": "text",
-                            "text": value
-                        })
-        
-        if header_params:
-            components.append({
-                "type": "header",
-                "parameters": header_params
-            })
-        
-        # Construit les paramètres du body
-        body_params = []
-        if structure.get("body"):
-            for param_def in structure.get("body", []):
-                param_key = f"body_{param_def.get('index', 1)}"
-                value = param_values.get(param_key, "")
-                if value:
-                    body_params.append({
-                        "type": "text",
-                        "text": value
-                    })
-        
-        if body_params:
-            components.append({
-                "type": "body",
-                "parameters": body_params
-            })
-        
-        # Construit les paramètres des boutons
-        button_params = []
-        if structure.get("buttons"):
-            for param_def in structure.get("buttons", []):
-                param_key = f"button_{param_def.get('index', 0)}"
-                value = param_values.get(param_key, "")
-                if value:
-                    button_params.append({
-                        "type": "text",
-                        "text": value
-                    })
-        
-        if button_params:
-            # Trouve le premier bouton de type URL dans la structure
-            for param_def in structure.get("buttons", []):
-                if param_def.get("type") == "url":
-                    components.append({
-                        "type": "button",
-                        "sub_type": "url",
-                        "index": str(param_def.get("index", 0)),
-                        "parameters": button_params[:1]  # Prend seulement le premier paramètre pour le bouton URL
-                    })
-                    break
-        
-        return components if components else None
-    
-    def _build_components_from_structure(self, structure, param_values):
-        """
-        Construit les components à partir de la structure du template.
-        Utilisé comme fallback si aucune valeur n'est fournie.
-        """
-        return self._build_components_from_values(param_values)
-
     def action_send_template(self):
         """Envoie le message WhatsApp via template ou message texte personnalisé"""
         self.ensure_one()
@@ -508,14 +403,14 @@ class WhatsappSendTemplate(models.TransientModel):
             if not self.template_id:
                 raise ValidationError(_("Veuillez sélectionner un template ou activer le message personnalisé."))
 
-            # Construit les components à partir des valeurs saisies ou du JSON manuel
+            # Valeurs saisies (components construits par le template compilé) ou JSON manuel
             components = None
+            param_values = None
             
             # Priorité 1 : Utilise les valeurs saisies dans parameter_values si disponibles
             if self.parameter_values and self.parameter_values.strip() != "{}":
                 try:
                     param_values = json.loads(self.parameter_values)
-                    components = self._build_components_from_values(param_values)
                 except json.JSONDecodeError:
                     _logger.warning("Format JSON invalide pour parameter_values, utilisation de template_params")
                     # Fallback sur template_params
@@ -532,20 +427,14 @@ class WhatsappSendTemplate(models.TransientModel):
                 except json.JSONDecodeError:
                     raise ValidationError(_("Format JSON invalide pour les paramètres du template."))
             
-            # Si le template a des paramètres mais qu'aucune valeur n'est fournie, on essaie de construire depuis la structure
-            elif self.template_id.has_parameters:
-                structure = self.template_id.get_parameter_structure()
-                if structure:
-                    # Construit des components vides pour permettre l'envoi (l'utilisateur devra les remplir)
-                    components = self._build_components_from_structure(structure, {})
-
             try:
                 # Envoie le message template
                 self.config_id.send_template_message(
                     to_phone=phone,
-                    template_name=self.template_id.wa_name,
+                    template=self.template_id,
                     language_code=self.language_code or "fr",
-                    components=components
+                    components=components,
+                    values=param_values,
                 )
             
                 # Récupère le message créé
@@ -667,7 +556,8 @@ class WhatsappSendInteractive(models.TransientModel):
         """Charge la configuration active par défaut"""
         res = super().default_get(fields_list)
         if 'config_id' in fields_list:
-            config = self.env['whatsapp.config'].search([('is_active', '=', True)], limit=1)
+            # Numéro prérempli (contexte) : configuration du pool qui sert ce destinataire
+            config = self.env['whatsapp.config'].get_active_config(res.get('phone'))
             if config:
                 res['config_id'] = config.id
         return res
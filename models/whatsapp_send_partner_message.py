@@ -47,18 +47,21 @@ class WhatsappSendPartnerMessage(models.TransientModel):
         """Charge la configuration active par défaut et le partenaire depuis le contexte"""
         res = super().default_get(fields_list)
         
-        # Charge la configuration active
-        if 'config_id' in fields_list:
-            config = self.env['whatsapp.config'].search([('is_active', '=', True)], limit=1)
-            if config:
-                res['config_id'] = config.id
-        
         # Charge le partenaire depuis le contexte (si appelé depuis un bouton)
         if 'partner_id' in fields_list and 'default_partner_id' in self.env.context:
             partner_id = self.env.context.get('default_partner_id')
             if partner_id:
                 res['partner_id'] = partner_id
         
+        # Charge la configuration active (numéro du pool qui sert ce partenaire)
+        if 'config_id' in fields_list:
+            partner = self.env['res.partner'].browse(res.get('partner_id'))
+            config = self.env['whatsapp.config'].get_active_config(
+                partner.phone or partner.mobile, company=partner.company_id or None
+            )
+            if config:
+                res['config_id'] = config.id
+        
         return res
 
     @api.onchange('partner_id')
@@ -1,10 +1,99 @@
 # whatsapp_business_api/models/whatsapp_template.py
-from odoo import models, fields, api
+from odoo import models, fields, api, tools
+import hashlib
 import json
 import logging
+import re
 
 _logger = logging.getLogger(__name__)
 
+# Variables positionnelles des templates Meta : {{1}}, {{2}}, ...
+_PLACEHOLDER_RE = re.compile(r"\{\{\s*(\d+)\s*\}\}")
+
+
+class _CompiledTemplate:
+    """Template compilé : les emplacements des paramètres sont résolus une fois,
+    la construction d'un payload se limite à substituer les valeurs.
+
+    Tous les envois de templates (whatsapp.config.send_template_message)
+    construisent leur payload ici. Les valeurs vides sont ignorées et seul le
+    premier bouton URL reçoit un paramètre. Un template inconnu d'Odoo est
+    compilé sans structure : l'appelant fournit alors ses components.
+    """
+
+    __slots__ = ("name", "language_code", "header_slots", "body_slots", "button_keys", "url_button_index")
+
+    def __init__(self, name, language_code, structure):
+        self.name = name
+        self.language_code = language_code or "fr"
+        # (clé de valeur, type) pour chaque paramètre
+        self.header_slots = tuple(
+            (f"header_{param.get('index', 1)}", param.get("type"))
+            for param in structure.get("header") or []
+            if param.get("type") in ("image", "document", "video", "text")
+        )
+        self.body_slots = tuple(
+            f"body_{param.get('index', 1)}" for param in structure.get("body") or []
+        )
+        buttons = structure.get("buttons") or []
+        self.button_keys = tuple(f"button_{param.get('index', 0)}" for param in buttons)
+        self.url_button_index = next(
+            (str(param.get("index", 0)) for param in buttons if param.get("type") == "url"), None
+        )
+
+    def build_components(self, values):
+        """Construit les components Meta à partir des valeurs ({"body_1": ..., "header_1": ...})"""
+        if not values:
+            return None
+        components = []
+
+        header_params = []
+        for key, param_type in self.header_slots:
+            value = values.get(key)
+            if value:
+                if param_type == "text":
+                    header_params.append({"type": "text", "text": value})
+                else:
+                    header_params.append({"type": param_type, param_type: {"link": value}})
+        if header_params:
+            components.append({"type": "header", "parameters": header_params})
+
+        body_params = [{"type": "text", "text": values[key]} for key in self.body_slots if values.get(key)]
+        if body_params:
+            components.append({"type": "body", "parameters": body_params})
+
+        if self.url_button_index is not None:
+            value = next((values[key] for key in self.button_keys if values.get(key)), None)
+            if value:
+                components.append({
+                    "type": "button",
+                    "sub_type": "url",
+                    "index": self.url_button_index,
+                    "parameters": [{"type": "text", "text": value}],
+                })
+
+        return components or None
+
+    def build_payload(self, to_phone, values=None, components=None, recipient_type="individual", language_code=None):
+        """Construit le payload Graph complet pour un destinataire.
+
+        components (déjà au format Meta, ex: JSON saisi à la main) remplace
+        la construction à partir de values ; language_code remplace la langue
+        du template.
+        """
+        template = {"name": self.name, "language": {"code": language_code or self.language_code}}
+        if components is None:
+            components = self.build_components(values)
+        if components:
+            template["components"] = components
+        return {
+            "messaging_product": "whatsapp",
+            "recipient_type": recipient_type,
+            "to": to_phone,
+            "type": "template",
+            "template": template,
+        }
+
 
 class WhatsappTemplate(models.Model):
     _name = "whatsapp.template"
@@ -34,6 +123,14 @@ class WhatsappTemplate(models.Model):
         default="APPROVED",
     )
     description = fields.Text("Description / Notes")
+
+    wa_template_id = fields.Char("ID template Meta", readonly=True, copy=False)
+    sync_hash = fields.Char(
+        "Empreinte de synchronisation",
+        readonly=True,
+        copy=False,
+        help="Empreinte des données Meta lors de la dernière synchronisation ; le template n'est réécrit que si elle change"
+    )
     
     # Structure des paramètres du template
     parameter_structure = fields.Text(
@@ -62,37 +159,136 @@ class WhatsappTemplate(models.Model):
         """,
     )
     
+    components_json = fields.Text(
+        string="Composants Meta (JSON)",
+        readonly=True,
+        help="Composants du template tels que renvoyés par l'API Meta lors de la synchronisation"
+    )
+
+    parsed_structure = fields.Json(
+        string="Structure des paramètres (analysée)",
+        compute="_compute_parsed_structure",
+        store=True,
+        help="Structure des paramètres analysée une seule fois à l'enregistrement"
+    )
+
     has_parameters = fields.Boolean(
         string="A des paramètres",
-        compute="_compute_has_parameters",
-        store=False,
+        compute="_compute_parsed_structure",
+        store=True,
     )
     
     @api.depends('parameter_structure')
-    def _compute_has_parameters(self):
-        """Détermine si le template a des paramètres"""
+    def _compute_parsed_structure(self):
+        """Analyse la structure des paramètres une fois et la stocke"""
         for record in self:
-            try:
-                if record.parameter_structure:
+            structure = {}
+            if record.parameter_structure:
+                try:
                     structure = json.loads(record.parameter_structure)
-                    has_params = bool(
-                        structure.get("body") or 
-                        structure.get("header") or 
-                        structure.get("buttons")
-                    )
-                    record.has_parameters = has_params
-                else:
-                    record.has_parameters = False
-            except (json.JSONDecodeError, Exception) as e:
-                _logger.warning("Erreur lors du parsing de la structure des paramètres pour le template %s: %s", record.name, e)
-                record.has_parameters = False
+                    if not isinstance(structure, dict):
+                        structure = {}
+                except (json.JSONDecodeError, Exception) as e:
+                    _logger.warning("Erreur lors du parsing de la structure des paramètres pour le template %s: %s", record.name, e)
+                    structure = {}
+            record.parsed_structure = structure
+            record.has_parameters = bool(
+                structure.get("body") or
+                structure.get("header") or
+                structure.get("buttons")
+            )
     
     def get_parameter_structure(self):
-        """Retourne la structure des paramètres parsée"""
+        """Retourne la structure des paramètres (déjà analysée et stockée)"""
         self.ensure_one()
-        if not self.parameter_structure:
-            return {}
-        try:
-            return json.loads(self.parameter_structure)
-        except json.JSONDecodeError:
-            return {}
+        return self.parsed_structure or {}
+
+    @api.model
+    @tools.ormcache('template_id', 'write_date')
+    def _get_compiled_template(self, template_id, write_date):
+        """Compile le template (une fois par version, clé id + write_date)"""
+        template = self.browse(template_id)
+        return _CompiledTemplate(template.wa_name, template.language_code, template.parsed_structure or {})
+
+    def _get_compiled(self):
+        """Retourne le template compilé en cache pour la version courante"""
+        self.ensure_one()
+        return self._get_compiled_template(self.id, self.write_date)
+
+    @api.model
+    def _parse_meta_components(self, components):
+        """Déduit la structure des paramètres des composants Meta.
+
+        Returns:
+            dict: {"header": [...], "body": [...], "buttons": [...]} au format de parameter_structure
+        """
+        structure = {"header": [], "body": [], "buttons": []}
+        for component in components or []:
+            component_type = (component.get("type") or "").upper()
+            example = component.get("example") or {}
+
+            if component_type == "HEADER":
+                header_format = (component.get("format") or "TEXT").upper()
+                if header_format in ("IMAGE", "DOCUMENT", "VIDEO"):
+                    structure["header"].append({
+                        "index": 1,
+                        "type": header_format.lower(),
+                        "label": "Média d'en-tête (URL)",
+                    })
+                else:
+                    examples = example.get("header_text") or []
+                    for index in sorted({int(i) for i in _PLACEHOLDER_RE.findall(component.get("text") or "")}):
+                        structure["header"].append(self._make_parameter(index, "text", "En-tête", examples))
+
+            elif component_type == "BODY":
+                examples = (example.get("body_text") or [[]])[0]
+                for index in sorted({int(i) for i in _PLACEHOLDER_RE.findall(component.get("text") or "")}):
+                    structure["body"].append(self._make_parameter(index, "text", "Paramètre", examples))
+
+            elif component_type == "BUTTONS":
+                for button_index, button in enumerate(component.get("buttons") or []):
+                    if (button.get("type") or "").upper() == "URL" and _PLACEHOLDER_RE.search(button.get("url") or ""):
+                        structure["buttons"].append({
+                            "index": button_index,
+                            "type": "url",
+                            "label": f"Suffixe URL du bouton « {button.get('text', button_index)} »",
+                        })
+        return structure
+
+    @api.model
+    def _make_parameter(self, index, param_type, label, examples):
+        label = f"{label} {index}"
+        if len(examples) >= index:
+            label = f"{label} (ex: {examples[index - 1]})"
+        return {"index": index, "type": param_type, "label": label}
+
+    @api.model
+    def _prepare_vals_from_meta(self, template_data):
+        """Convertit un template renvoyé par l'API Meta en valeurs Odoo"""
+        language = template_data.get('language', {})
+        if isinstance(language, dict):
+            language_code = language.get('code', 'fr')
+        else:
+            language_code = str(language) if language else 'fr'
+
+        status = template_data.get('status', 'UNKNOWN')
+        if status not in dict(self._fields['status'].selection):
+            # PAUSED, IN_APPEAL, ... : non utilisable pour l'envoi
+            status = 'DISABLED'
+        category = template_data.get('category', 'UNKNOWN')
+        if category not in dict(self._fields['category'].selection):
+            category = 'UNKNOWN'
+
+        vals = {
+            'wa_name': template_data.get('name', ''),
+            'wa_template_id': template_data.get('id'),
+            'status': status,
+            'category': category,
+            'language_code': language_code,
+            'sync_hash': hashlib.sha1(json.dumps(template_data, sort_keys=True).encode()).hexdigest(),
+        }
+        components = template_data.get('components')
+        if components:
+            vals['components_json'] = json.dumps(components)
+            vals['parameter_structure'] = json.dumps(self._parse_meta_components(components))
+        return vals
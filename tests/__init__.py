@@ -0,0 +1,2 @@
+# whatsapp_business_api/tests/__init__.py
+from . import test_whatsapp_template
@@ -0,0 +1,92 @@
+# whatsapp_business_api/tests/test_whatsapp_template.py
+import logging
+import time
+from unittest.mock import patch
+
+from odoo.tests import TransactionCase, tagged
+
+_logger = logging.getLogger(__name__)
+
+
+@tagged("post_install", "-at_install")
+class TestWhatsappTemplateCompiled(TransactionCase):
+
+    def _create_synced_template(self, header_format):
+        """Template tel que créé par la synchronisation Meta, avec un en-tête média"""
+        Template = self.env["whatsapp.template"]
+        vals = Template._prepare_vals_from_meta({
+            "id": "1234567890",
+            "name": f"promo_{header_format.lower()}",
+            "status": "APPROVED",
+            "category": "MARKETING",
+            "language": "fr",
+            "components": [
+                {"type": "HEADER", "format": header_format},
+                {"type": "BODY", "text": "Bonjour {{1}}", "example": {"body_text": [["Awa"]]}},
+            ],
+        })
+        vals["name"] = vals["wa_name"]
+        return Template.create(vals)
+
+    def test_video_header_parameter(self):
+        template = self._create_synced_template("VIDEO")
+        components = template._get_compiled().build_components({
+            "header_1": "https://example.com/promo.mp4",
+            "body_1": "Awa",
+        })
+        self.assertEqual(components, [
+            {"type": "header", "parameters": [{"type": "video", "video": {"link": "https://example.com/promo.mp4"}}]},
+            {"type": "body", "parameters": [{"type": "text", "text": "Awa"}]},
+        ])
+
+    def test_media_headers_keep_their_type(self):
+        for header_format in ("IMAGE", "DOCUMENT", "VIDEO"):
+            param_type = header_format.lower()
+            template = self._create_synced_template(header_format)
+            components = template._get_compiled().build_components({"header_1": "https://example.com/file"})
+            self.assertEqual(
+                components[0]["parameters"],
+                [{"type": param_type, param_type: {"link": "https://example.com/file"}}],
+            )
+
+    def test_build_payload(self):
+        template = self._create_synced_template("IMAGE")
+        payload = template._get_compiled().build_payload("+221770000000", {"body_1": "Awa"})
+        self.assertEqual(payload, {
+            "messaging_product": "whatsapp",
+            "recipient_type": "individual",
+            "to": "+221770000000",
+            "type": "template",
+            "template": {
+                "name": template.wa_name,
+                "language": {"code": "fr"},
+                "components": [{"type": "body", "parameters": [{"type": "text", "text": "Awa"}]}],
+            },
+        })
+
+    def test_send_template_message_uses_compiled_template(self):
+        template = self._create_synced_template("VIDEO")
+        config = self.env["whatsapp.config"].create({"phone_number_id": "test_compiled_template"})
+        values = {"header_1": "https://example.com/promo.mp4", "body_1": "Awa"}
+        sent = []
+
+        def fake_send(config_self, payload):
+            sent.append(payload)
+            return {"messages": [{"id": "wamid.test"}]}, "wamid.test", "{}", None
+
+        with patch.object(type(config), "_send_whatsapp_request", fake_send):
+            config.send_template_message("+221770000000", template=template, values=values)
+
+        self.assertEqual(sent, [template._get_compiled().build_payload("+221770000000", values)])
+
+    def test_render_throughput(self):
+        """Mesure le rendu d'un payload compilé (journalisé, borne volontairement large)"""
+        compiled = self._create_synced_template("IMAGE")._get_compiled()
+        values = {"header_1": "https://example.com/promo.png", "body_1": "Awa"}
+        count = 20000
+        start = time.perf_counter()
+        for _i in range(count):
+            compiled.build_payload("+221770000000", values)
+        elapsed = time.perf_counter() - start
+        _logger.info("Rendu de templates compilés : %d payloads/s", count / elapsed)
+        self.assertLess(elapsed, 10)
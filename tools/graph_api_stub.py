@@ -0,0 +1,449 @@
+#!/usr/bin/env python3
+# whatsapp_business_api/tools/graph_api_stub.py
+"""
+Serveur factice de l'API Graph WhatsApp Cloud, pour les tests et les mesures hors ligne.
+
+Imite les points de terminaison utilisés par le module :
+    POST /<version>/<phone_number_id>/messages           envoi de message
+    POST /<version>/<phone_number_id>/media              upload de média (multipart)
+    GET  /<version>/<media_id>                           URL, type MIME et SHA-256 d'un média
+    GET  /<version>/<wa_message_id>                      statut d'un message envoyé
+    GET  /<version>/<phone_number_id>                    informations du numéro (vérification)
+    GET  /<version>/<waba_id>/message_templates          templates paginés (paging.next, ETag)
+    GET  /_media/<media_id>                              contenu d'un média (URL renvoyée ci-dessus)
+    GET  /_stats                                         compteurs et latences observées (JSON)
+
+Latence, taux d'erreurs et limites de débit sont configurables, pour observer
+le comportement du pipeline d'envoi (tentatives, disjoncteur, limiteur).
+Uniquement la bibliothèque standard.
+
+Utilisation :
+    python tools/graph_api_stub.py --port 8900 --latency-ms 80 --jitter-ms 40 \\
+        --error-rate 0.01 --rate-limit 80
+
+puis, dans la configuration WhatsApp de la base de test :
+    URL de l'API Graph = http://127.0.0.1:8900/v21.0
+
+Avec --webhook-url, chaque message envoyé est suivi des statuts sent/delivered/read
+postés sur le webhook Odoo (signés avec --app-secret), comme le ferait Meta.
+"""
+import argparse
+import email.parser
+import email.policy
+import hashlib
+import hmac
+import http.server
+import itertools
+import json
+import queue
+import random
+import re
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+# Codes d'erreur Meta renvoyés par le serveur factice
+ERROR_TEMPORARY = {"code": 2, "type": "OAuthException", "message": "Service temporarily unavailable"}
+ERROR_RATE_LIMIT = {"code": 130429, "type": "OAuthException", "message": "(#130429) Rate limit hit"}
+ERROR_PAIR_RATE_LIMIT = {"code": 131056, "type": "OAuthException",
+                         "message": "(#131056) (Business Account, Consumer Account) pair rate limit hit"}
+ERROR_TOKEN = {"code": 190, "type": "OAuthException", "message": "Invalid OAuth access token"}
+ERROR_NOT_FOUND = {"code": 100, "type": "GraphMethodException", "message": "Unsupported request"}
+
+WAMID_PREFIX = "wamid.STUB"
+
+
+class TokenBucket:
+    """Seau à jetons en mémoire (débit par seconde, rafale = capacité)"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class StubState:
+    """État partagé du serveur : médias, messages, limiteurs et statistiques"""
+
+    def __init__(self, args):
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.media = {}
+        self.messages = {}
+        self.number_buckets = {}
+        self.pair_buckets = {}
+        self.counters = {}
+        self.latencies = []
+        self.templates = [self._make_template(index) for index in range(args.templates)]
+        self.templates_etag = '"%s"' % hashlib.sha1(json.dumps(self.templates).encode()).hexdigest()
+        self.webhook_queue = queue.Queue() if args.webhook_url else None
+
+    def _make_template(self, index):
+        return {
+            "id": str(900000000000 + index),
+            "name": f"stub_template_{index:04d}",
+            "status": "APPROVED",
+            "category": "UTILITY",
+            "language": "fr",
+            "components": [{"type": "BODY", "text": "Bonjour {{1}}, " + f"message {index}"}],
+        }
+
+    def next_id(self):
+        with self.lock:
+            return next(self.ids)
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    def record_latency(self, seconds):
+        with self.lock:
+            self.latencies.append(seconds)
+
+    def delay(self):
+        """Latence simulée (moyenne + gigue uniforme), en secondes"""
+        args = self.args
+        if not args.latency_ms and not args.jitter_ms:
+            return 0.0
+        with self.lock:
+            jitter = self.random.uniform(-args.jitter_ms, args.jitter_ms)
+        return max(args.latency_ms + jitter, 0) / 1000.0
+
+    def injected_error(self):
+        """Erreur temporaire tirée au hasard selon --error-rate"""
+        with self.lock:
+            return self.args.error_rate and self.random.random() < self.args.error_rate
+
+    def rate_limited(self, phone_number_id, to_phone):
+        """Retourne l'erreur Meta à renvoyer si une limite de débit est atteinte, sinon None"""
+        args = self.args
+        with self.lock:
+            if args.rate_limit:
+                bucket = self.number_buckets.setdefault(
+                    phone_number_id, TokenBucket(args.rate_limit, args.rate_limit))
+                if not bucket.take():
+                    return ERROR_RATE_LIMIT
+            if args.pair_rate_limit and to_phone:
+                bucket = self.pair_buckets.setdefault(
+                    (phone_number_id, to_phone), TokenBucket(args.pair_rate_limit, args.pair_burst))
+                if not bucket.take():
+                    return ERROR_PAIR_RATE_LIMIT
+        return None
+
+    def stats(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            counters = dict(self.counters)
+
+        def percentile(pct):
+            if not latencies:
+                return 0.0
+            rank = max(int(round(pct / 100.0 * len(latencies) + 0.5)) - 1, 0)
+            return round(latencies[min(rank, len(latencies) - 1)] * 1000, 2)
+
+        return {
+            "counters": counters,
+            "requests": len(latencies),
+            "p50_ms": percentile(50),
+            "p95_ms": percentile(95),
+            "p99_ms": percentile(99),
+        }
+
+
+class GraphApiStubHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # En-têtes et corps sont écrits séparément : sans TCP_NODELAY, Nagle + ACK retardé ajoutent ~40 ms
+    disable_nagle_algorithm = True
+    state = None
+
+    # ------------------------------------------------------------------
+    # Réponses
+    # ------------------------------------------------------------------
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status, error, headers=None):
+        self.state.count(f"error_{error['code']}")
+        error = dict(error, fbtrace_id=f"STUB{self.state.next_id():08d}")
+        self._send_json(status, {"error": error}, headers)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _check_token(self):
+        token = self.state.args.token
+        if token and self.headers.get("Authorization") != f"Bearer {token}":
+            self._send_error(401, ERROR_TOKEN)
+            return False
+        return True
+
+    def _base_url(self):
+        return f"http://{self.headers.get('Host') or '%s:%s' % self.server.server_address[:2]}"
+
+    # ------------------------------------------------------------------
+    # Aiguillage
+    # ------------------------------------------------------------------
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def _dispatch(self, method):
+        started = time.perf_counter()
+        url = urllib.parse.urlsplit(self.path)
+        parts = [part for part in url.path.split("/") if part]
+        query = dict(urllib.parse.parse_qsl(url.query))
+        body = self._read_body() if method == "POST" else b""
+
+        if parts == ["_stats"]:
+            return self._send_json(200, self.state.stats())
+        if len(parts) == 2 and parts[0] == "_media":
+            return self._serve_media_content(parts[1])
+
+        delay = self.state.delay()
+        if delay:
+            time.sleep(delay)
+        if not self._check_token():
+            return
+        # Le premier segment est la version (v21.0) : il est ignoré
+        route = parts[1:] if parts and re.match(r"^v\d+(\.\d+)?$", parts[0]) else parts
+
+        if method == "POST" and len(route) == 2 and route[1] == "messages":
+            self._post_message(route[0], body)
+        elif method == "POST" and len(route) == 2 and route[1] == "media":
+            self._post_media(body)
+        elif method == "GET" and len(route) == 2 and route[1] == "message_templates":
+            self._get_templates(route[0], query)
+        elif method == "GET" and len(route) == 1:
+            self._get_object(route[0])
+        else:
+            self._send_error(400, ERROR_NOT_FOUND)
+        self.state.record_latency(time.perf_counter() - started)
+
+    # ------------------------------------------------------------------
+    # Points de terminaison
+    # ------------------------------------------------------------------
+    def _post_message(self, phone_number_id, body):
+        state = self.state
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return self._send_error(400, dict(ERROR_NOT_FOUND, message="Invalid JSON"))
+        to_phone = payload.get("to")
+        if state.injected_error():
+            return self._send_error(503, ERROR_TEMPORARY)
+        error = state.rate_limited(phone_number_id, to_phone)
+        if error:
+            headers = {"Retry-After": str(state.args.retry_after)} if state.args.retry_after else None
+            return self._send_error(429, error, headers)
+
+        wamid = f"{WAMID_PREFIX}{state.next_id():016d}"
+        with state.lock:
+            state.messages[wamid] = {"status": "sent", "to": to_phone, "phone_number_id": phone_number_id}
+        state.count(f"messages_{payload.get('type', 'text')}")
+        if state.webhook_queue is not None:
+            state.webhook_queue.put((phone_number_id, wamid, to_phone))
+        self._send_json(200, {
+            "messaging_product": "whatsapp",
+            "contacts": [{"input": to_phone, "wa_id": to_phone}],
+            "messages": [{"id": wamid}],
+        })
+
+    def _post_media(self, body):
+        state = self.state
+        if state.injected_error():
+            return self._send_error(503, ERROR_TEMPORARY)
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            b"Content-Type: " + self.headers.get("Content-Type", "").encode() + b"\r\n\r\n" + body
+        )
+        content, mimetype = b"", "application/octet-stream"
+        for part in message.iter_parts() if message.is_multipart() else ():
+            if part.get_param("name", header="content-disposition") == "file":
+                content = part.get_payload(decode=True) or b""
+                mimetype = part.get_content_type()
+        media_id = str(1000000000000000 + state.next_id())
+        with state.lock:
+            state.media[media_id] = (content, mimetype)
+            # Mémoire bornée : les plus anciens médias sont oubliés
+            while len(state.media) > state.args.max_media:
+                state.media.pop(next(iter(state.media)))
+        state.count("media_upload")
+        self._send_json(200, {"id": media_id})
+
+    def _get_templates(self, waba_id, query):
+        state = self.state
+        if not query.get("after") and self.headers.get("If-None-Match") == state.templates_etag:
+            state.count("templates_not_modified")
+            self.send_response(304)
+            self.send_header("ETag", state.templates_etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        limit = max(int(query.get("limit") or 25), 1)
+        offset = int(query.get("after") or 0)
+        page = state.templates[offset:offset + limit]
+        payload = {"data": page, "paging": {"cursors": {"before": str(offset), "after": str(offset + len(page))}}}
+        if offset + limit < len(state.templates):
+            next_query = dict(query, after=str(offset + limit))
+            payload["paging"]["next"] = (
+                f"{self._base_url()}{urllib.parse.urlsplit(self.path).path}?{urllib.parse.urlencode(next_query)}"
+            )
+        state.count("templates_page")
+        self._send_json(200, payload, {"ETag": state.templates_etag})
+
+    def _get_object(self, object_id):
+        state = self.state
+        with state.lock:
+            message = state.messages.get(object_id)
+            media = state.media.get(object_id)
+        if message:
+            state.count("message_status")
+            return self._send_json(200, {"id": object_id, "status": message["status"]})
+        if media:
+            content, mimetype = media
+            state.count("media_info")
+            return self._send_json(200, {
+                "messaging_product": "whatsapp",
+                "id": object_id,
+                "url": f"{self._base_url()}/_media/{object_id}",
+                "mime_type": mimetype,
+                "sha256": hashlib.sha256(content).hexdigest(),
+                "file_size": len(content),
+            })
+        if object_id.startswith(WAMID_PREFIX):
+            return self._send_error(404, ERROR_NOT_FOUND)
+        # Tout autre identifiant est traité comme un numéro (vérification des paramètres)
+        state.count("phone_number")
+        self._send_json(200, {
+            "id": object_id,
+            "display_phone_number": "+221 77 000 00 00",
+            "verified_name": "Stub WhatsApp",
+            "quality_rating": "GREEN",
+        })
+
+    def _serve_media_content(self, media_id):
+        with self.state.lock:
+            media = self.state.media.get(media_id)
+        if not media:
+            return self._send_error(404, ERROR_NOT_FOUND)
+        content, mimetype = media
+        self.state.count("media_download")
+        self.send_response(200)
+        self.send_header("Content-Type", mimetype)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        if self.state.args.verbose:
+            super().log_message(format, *args)
+
+
+def webhook_sender(state):
+    """Poste sent/delivered/read sur le webhook pour chaque message envoyé (thread dédié)"""
+    args = state.args
+    secret = args.app_secret.encode() if args.app_secret else None
+    while True:
+        phone_number_id, wamid, to_phone = state.webhook_queue.get()
+        for status in ("sent", "delivered", "read"):
+            time.sleep(args.status_delay_ms / 1000.0)
+            with state.lock:
+                state.messages[wamid]["status"] = status
+            body = json.dumps({
+                "object": "whatsapp_business_account",
+                "entry": [{"id": "STUB_WABA", "changes": [{"field": "messages", "value": {
+                    "messaging_product": "whatsapp",
+                    "metadata": {"display_phone_number": "221770000000", "phone_number_id": phone_number_id},
+                    "statuses": [{"id": wamid, "status": status, "timestamp": str(int(time.time())),
+                                  "recipient_id": to_phone}],
+                }}]}],
+            }).encode()
+            headers = {"Content-Type": "application/json"}
+            if secret:
+                headers["X-Hub-Signature-256"] = "sha256=" + hmac.new(secret, body, hashlib.sha256).hexdigest()
+            try:
+                urllib.request.urlopen(urllib.request.Request(args.webhook_url, body, headers), timeout=10).read()
+                state.count("webhook_status")
+            except OSError as e:
+                state.count("webhook_error")
+                if args.verbose:
+                    print(f"Webhook {args.webhook_url} en échec : {e}", file=sys.stderr)
+
+
+def make_server(args):
+    """Construit le serveur (sans le démarrer) ; réutilisable depuis un test"""
+    state = StubState(args)
+    handler = type("GraphApiStubHandler", (GraphApiStubHandler,), {"state": state})
+    server = http.server.ThreadingHTTPServer((args.host, args.port), handler)
+    server.daemon_threads = True
+    if state.webhook_queue is not None:
+        for _index in range(args.webhook_workers):
+            threading.Thread(target=webhook_sender, args=(state,), daemon=True).start()
+    return server, state
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serveur factice de l'API Graph WhatsApp Cloud")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency-ms", type=float, default=0, help="Latence moyenne ajoutée à chaque appel API")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="Gigue uniforme (+/-) autour de la latence")
+    parser.add_argument("--error-rate", type=float, default=0, help="Part des appels en erreur temporaire (503, code 2)")
+    parser.add_argument("--rate-limit", type=float, default=0,
+                        help="Messages/s par phone_number_id avant 429 (code 130429) ; 0 = illimité")
+    parser.add_argument("--pair-rate-limit", type=float, default=0,
+                        help="Messages/s par paire numéro/destinataire avant 429 (code 131056) ; 0 = illimité")
+    parser.add_argument("--pair-burst", type=float, default=10, help="Rafale tolérée par paire")
+    parser.add_argument("--retry-after", type=int, default=0, help="En-tête Retry-After des réponses 429 (secondes)")
+    parser.add_argument("--token", help="Access token attendu (401, code 190 sinon) ; non vérifié par défaut")
+    parser.add_argument("--templates", type=int, default=250, help="Nombre de templates exposés")
+    parser.add_argument("--max-media", type=int, default=1000, help="Médias conservés en mémoire")
+    parser.add_argument("--webhook-url", help="Webhook Odoo recevant les statuts des messages envoyés")
+    parser.add_argument("--app-secret", help="App Secret pour signer les webhooks de statuts")
+    parser.add_argument("--status-delay-ms", type=float, default=200, help="Délai entre deux statuts d'un message")
+    parser.add_argument("--webhook-workers", type=int, default=2, help="Threads d'envoi des webhooks de statuts")
+    parser.add_argument("--seed", type=int, default=42, help="Graine aléatoire (latences et erreurs reproductibles)")
+    parser.add_argument("--verbose", action="store_true", help="Journalise chaque requête")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    server, state = make_server(args)
+    host, port = server.server_address[:2]
+    print(f"API Graph factice sur http://{host}:{port}/v21.0 (Ctrl+C pour arrêter)", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(state.stats(), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
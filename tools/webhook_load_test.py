@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+# whatsapp_business_api/tools/webhook_load_test.py
+"""
+Générateur de charge pour le point de terminaison /whatsapp/webhook.
+
+Synthétise des charges utiles Meta réalistes (messages texte, réponses de
+boutons et de listes, lots de statuts), les signe si un App Secret est
+fourni, puis les rejoue sur une base de test avec la concurrence demandée.
+Rapporte le débit et les latences p50/p95/p99.
+
+Uniquement la bibliothèque standard : utilisable hors ligne en CI.
+
+Exemples :
+    # Contre une base de test Odoo locale (lancée avec --db-filter sur cette base)
+    python tools/webhook_load_test.py --url http://localhost:8069/whatsapp/webhook \\
+        --app-secret MON_SECRET --phone-number-id 123456789 --concurrency 16 --duration 30
+
+    # Vérification du harnais seul, sans Odoo (serveur local intégré)
+    python tools/webhook_load_test.py --self-test --requests 2000 --json
+
+Codes de sortie : 0 si les seuils (--min-rps, --max-p99-ms, --max-error-rate)
+sont respectés, 1 sinon.
+"""
+import argparse
+import hashlib
+import hmac
+import http.client
+import http.server
+import json
+import random
+import sys
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_MIX = "text=60,interactive=25,status=15"
+
+# Boutons et mots-clés du module, pour exercer les chemins réels du webhook
+BUTTON_IDS = [
+    "btn_my_account", "btn_my_orders", "btn_my_invoices", "btn_support",
+    "btn_download_invoice_1", "btn_next_invoice", "btn_download_order_1",
+]
+TEXTS = [
+    "Bonjour", "bonjour, je voudrais mes factures", "Merci beaucoup",
+    "Quel est le statut de ma commande ?", "menu", "Salut", "ok",
+]
+STATUSES = ["sent", "delivered", "read", "delivered", "read", "failed"]
+
+
+class PayloadFactory:
+    """Fabrique des corps de webhook au format Meta (whatsapp_business_account)"""
+
+    def __init__(self, phone_number_id, display_phone_number, senders, status_batch, seed):
+        self.phone_number_id = phone_number_id
+        self.display_phone_number = display_phone_number
+        self.senders = [f"22177{index:07d}" for index in range(senders)]
+        self.status_batch = status_batch
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counter = 0
+
+    def _next_id(self):
+        with self.lock:
+            self.counter += 1
+            return f"wamid.LOADTEST{self.counter:012d}{self.random.randrange(16 ** 6):06x}"
+
+    def _envelope(self, value):
+        value = dict(value, messaging_product="whatsapp", metadata={
+            "display_phone_number": self.display_phone_number,
+            "phone_number_id": self.phone_number_id,
+        })
+        return {
+            "object": "whatsapp_business_account",
+            "entry": [{
+                "id": "LOADTEST_WABA",
+                "changes": [{"field": "messages", "value": value}],
+            }],
+        }
+
+    def _inbound(self, message):
+        sender = self.random.choice(self.senders)
+        message = dict(message, **{"from": sender, "id": self._next_id(), "timestamp": str(int(time.time()))})
+        return self._envelope({
+            "contacts": [{"profile": {"name": f"Client {sender[-4:]}"}, "wa_id": sender}],
+            "messages": [message],
+        })
+
+    def text(self):
+        return self._inbound({"type": "text", "text": {"body": self.random.choice(TEXTS)}})
+
+    def interactive(self):
+        button_id = self.random.choice(BUTTON_IDS)
+        if self.random.random() < 0.5:
+            reply = {"type": "button_reply", "button_reply": {"id": button_id, "title": button_id[:20]}}
+        else:
+            reply = {"type": "list_reply", "list_reply": {"id": button_id, "title": button_id[:24], "description": ""}}
+        return self._inbound({"type": "interactive", "interactive": reply})
+
+    def status(self):
+        timestamp = str(int(time.time()))
+        statuses = []
+        for _index in range(self.status_batch):
+            status = self.random.choice(STATUSES)
+            entry = {
+                "id": self._next_id(),
+                "status": status,
+                "timestamp": timestamp,
+                "recipient_id": self.random.choice(self.senders),
+            }
+            if status == "failed":
+                entry["errors"] = [{"code": 131026, "title": "Message undeliverable"}]
+            statuses.append(entry)
+        return self._envelope({"statuses": statuses})
+
+
+def parse_mix(mix):
+    """'text=60,interactive=25,status=15' -> ([types], [poids])"""
+    kinds, weights = [], []
+    for part in mix.split(","):
+        kind, _sep, weight = part.partition("=")
+        kind = kind.strip()
+        if kind not in ("text", "interactive", "status"):
+            raise argparse.ArgumentTypeError(f"type de charge inconnu : {kind}")
+        kinds.append(kind)
+        weights.append(float(weight or 1))
+    return kinds, weights
+
+
+def sign(secret, body):
+    """En-tête X-Hub-Signature-256 calculé comme Meta (HMAC-SHA256 du corps brut)"""
+    if not secret:
+        return None
+    return "sha256=" + hmac.new(secret, body, hashlib.sha256).hexdigest()
+
+
+def percentile(sorted_values, pct):
+    """Percentile au rang le plus proche (valeurs déjà triées)"""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+class Worker:
+    """Client HTTP d'un thread : connexion persistante (keep-alive) vers le webhook"""
+
+    def __init__(self, url, headers, timeout):
+        self.url = urllib.parse.urlsplit(url)
+        self.path = self.url.path + (f"?{self.url.query}" if self.url.query else "")
+        self.headers = headers
+        self.timeout = timeout
+        self.connection = None
+
+    def _connect(self):
+        connection_class = http.client.HTTPSConnection if self.url.scheme == "https" else http.client.HTTPConnection
+        self.connection = connection_class(self.url.hostname, self.url.port, timeout=self.timeout)
+
+    def post(self, body, signature):
+        headers = dict(self.headers, **{"Content-Type": "application/json"})
+        if signature:
+            headers["X-Hub-Signature-256"] = signature
+        for attempt in (1, 2):
+            if self.connection is None:
+                self._connect()
+            try:
+                self.connection.request("POST", self.path, body=body, headers=headers)
+                response = self.connection.getresponse()
+                response.read()
+                return response.status
+            except (http.client.HTTPException, OSError):
+                # Connexion fermée par le serveur : une seule reconnexion
+                self.connection.close()
+                self.connection = None
+                if attempt == 2:
+                    raise
+
+
+def run_load(args):
+    kinds, weights = parse_mix(args.mix)
+    factory = PayloadFactory(args.phone_number_id, args.display_phone_number, args.senders, args.status_batch, args.seed)
+    secret = args.app_secret.encode() if args.app_secret else None
+    headers = dict(header.split(":", 1) for header in args.header)
+    headers = {key.strip(): value.strip() for key, value in headers.items()}
+
+    latencies = {kind: [] for kind in kinds}
+    errors = {"http": 0, "connection": 0}
+    results_lock = threading.Lock()
+    local = threading.local()
+    deadline = time.monotonic() + args.duration if args.duration else None
+    remaining = [args.requests]
+    choice_random = random.Random(args.seed + 1)
+
+    def next_kind():
+        with results_lock:
+            if deadline is None:
+                if remaining[0] <= 0:
+                    return None
+                remaining[0] -= 1
+            elif time.monotonic() >= deadline:
+                return None
+            return choice_random.choices(kinds, weights)[0]
+
+    def loop():
+        local.worker = Worker(args.url, headers, args.timeout)
+        while True:
+            kind = next_kind()
+            if kind is None:
+                return
+            body = json.dumps(getattr(factory, kind)()).encode()
+            started = time.perf_counter()
+            try:
+                status = local.worker.post(body, sign(secret, body))
+            except (http.client.HTTPException, OSError):
+                with results_lock:
+                    errors["connection"] += 1
+                continue
+            elapsed = time.perf_counter() - started
+            with results_lock:
+                latencies[kind].append(elapsed)
+                if status != 200:
+                    errors["http"] += 1
+
+    # Préchauffage (hors mesures) : premières requêtes, chargement du registre côté Odoo
+    warmup_worker = Worker(args.url, headers, args.timeout)
+    for _index in range(args.warmup):
+        body = json.dumps(factory.text()).encode()
+        warmup_worker.post(body, sign(secret, body))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for future in [executor.submit(loop) for _index in range(args.concurrency)]:
+            future.result()
+    wall_time = time.perf_counter() - started
+
+    return build_report(latencies, errors, wall_time, args)
+
+
+def build_report(latencies, errors, wall_time, args):
+    def summary(values):
+        values = sorted(values)
+        return {
+            "count": len(values),
+            "p50_ms": round(percentile(values, 50) * 1000, 2),
+            "p95_ms": round(percentile(values, 95) * 1000, 2),
+            "p99_ms": round(percentile(values, 99) * 1000, 2),
+            "max_ms": round(values[-1] * 1000, 2) if values else 0.0,
+        }
+
+    all_values = [value for values in latencies.values() for value in values]
+    total = len(all_values) + errors["connection"]
+    report = dict(summary(all_values), **{
+        "url": args.url,
+        "concurrency": args.concurrency,
+        "wall_time_s": round(wall_time, 3),
+        "throughput_rps": round(len(all_values) / wall_time, 1) if wall_time else 0.0,
+        "http_errors": errors["http"],
+        "connection_errors": errors["connection"],
+        "error_rate": round((errors["http"] + errors["connection"]) / total, 4) if total else 0.0,
+        "by_type": {kind: summary(values) for kind, values in latencies.items()},
+    })
+    # Un lot de statuts compte pour status_batch événements
+    events = sum(
+        len(values) * (args.status_batch if kind == "status" else 1) for kind, values in latencies.items()
+    )
+    report["events_rps"] = round(events / wall_time, 1) if wall_time else 0.0
+    return report
+
+
+def print_report(report):
+    print(f"Cible            : {report['url']} (concurrence {report['concurrency']})")
+    print(f"Requêtes         : {report['count']} en {report['wall_time_s']} s")
+    print(f"Débit            : {report['throughput_rps']} req/s ({report['events_rps']} événements/s)")
+    print(f"Latence          : p50 {report['p50_ms']} ms | p95 {report['p95_ms']} ms | "
+          f"p99 {report['p99_ms']} ms | max {report['max_ms']} ms")
+    print(f"Erreurs          : HTTP {report['http_errors']}, connexion {report['connection_errors']} "
+          f"(taux {report['error_rate']:.2%})")
+    for kind, stats in report["by_type"].items():
+        print(f"  {kind:<12} {stats['count']:>7} req | p50 {stats['p50_ms']} ms | "
+              f"p95 {stats['p95_ms']} ms | p99 {stats['p99_ms']} ms")
+
+
+class _StubWebhookHandler(http.server.BaseHTTPRequestHandler):
+    """Webhook factice pour --self-test : vérifie la signature et le JSON, répond 200"""
+    protocol_version = "HTTP/1.1"
+    # En-têtes et corps sont écrits séparément : sans TCP_NODELAY, Nagle + ACK retardé ajoutent ~40 ms
+    disable_nagle_algorithm = True
+    app_secret = None
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        status = 200
+        try:
+            json.loads(body)
+        except ValueError:
+            status = 400
+        if self.app_secret:
+            if not hmac.compare_digest(sign(self.app_secret, body), self.headers.get("X-Hub-Signature-256", "")):
+                status = 403
+        payload = b"EVENT_RECEIVED"
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(app_secret):
+    handler = type("StubWebhookHandler", (_StubWebhookHandler,), {"app_secret": app_secret})
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Test de charge du webhook WhatsApp (/whatsapp/webhook)")
+    parser.add_argument("--url", default="http://localhost:8069/whatsapp/webhook", help="URL du webhook")
+    parser.add_argument("--concurrency", type=int, default=8, help="Nombre de clients simultanés")
+    parser.add_argument("--requests", type=int, default=1000, help="Nombre de requêtes (ignoré si --duration)")
+    parser.add_argument("--duration", type=float, default=0, help="Durée du test en secondes")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Répartition des charges (défaut : {DEFAULT_MIX})")
+    parser.add_argument("--status-batch", type=int, default=20, help="Statuts par webhook de statuts")
+    parser.add_argument("--senders", type=int, default=200, help="Nombre de numéros clients distincts")
+    parser.add_argument("--phone-number-id", default="LOADTEST_PHONE_NUMBER_ID",
+                        help="metadata.phone_number_id (doit correspondre à une configuration pour le routage)")
+    parser.add_argument("--display-phone-number", default="221770000000")
+    parser.add_argument("--app-secret", help="App Secret pour signer les requêtes (X-Hub-Signature-256)")
+    parser.add_argument("--header", action="append", default=[], help="En-tête supplémentaire 'Nom: valeur'")
+    parser.add_argument("--timeout", type=float, default=30, help="Délai d'attente par requête (secondes)")
+    parser.add_argument("--warmup", type=int, default=5, help="Requêtes de préchauffage non mesurées")
+    parser.add_argument("--seed", type=int, default=42, help="Graine aléatoire (charges reproductibles)")
+    parser.add_argument("--self-test", action="store_true", help="Cible un webhook factice local (sans Odoo)")
+    parser.add_argument("--json", action="store_true", help="Affiche le rapport au format JSON")
+    parser.add_argument("--min-rps", type=float, help="Échec si le débit est inférieur")
+    parser.add_argument("--max-p99-ms", type=float, help="Échec si le p99 est supérieur")
+    parser.add_argument("--max-error-rate", type=float, default=0.0, help="Taux d'erreur maximal accepté")
+    args = parser.parse_args(argv)
+
+    server = None
+    if args.self_test:
+        server = start_stub_server(args.app_secret.encode() if args.app_secret else None)
+        args.url = f"http://127.0.0.1:{server.server_address[1]}/whatsapp/webhook"
+        args.warmup = 0
+    try:
+        report = run_load(args)
+    finally:
+        if server:
+            server.shutdown()
+
+    if args.json:
+        print(json.dumps(report, indent=2), flush=True)
+    else:
+        print_report(report)
+
+    failures = []
+    if args.min_rps is not None and report["throughput_rps"] < args.min_rps:
+        failures.append(f"débit {report['throughput_rps']} req/s < {args.min_rps}")
+    if args.max_p99_ms is not None and report["p99_ms"] > args.max_p99_ms:
+        failures.append(f"p99 {report['p99_ms']} ms > {args.max_p99_ms}")
+    if report["error_rate"] > args.max_error_rate:
+        failures.append(f"taux d'erreur {report['error_rate']:.2%} > {args.max_error_rate:.2%}")
+    for failure in failures:
+        print(f"ÉCHEC : {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())